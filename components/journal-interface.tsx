@@ -83,6 +83,7 @@ export function JournalInterface() {
   const [error, setError] = useState<string | null>(null)
   const [history, setHistory] = useState<HistoryEntry[]>([])
   const [isLoadingHistory, setIsLoadingHistory] = useState(false)
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null)
   const [showUpgradePrompt, setShowUpgradePrompt] = useState(false)
   const [editingEntryId, setEditingEntryId] = useState<string | null>(null)
   const [editingText, setEditingText] = useState("")
@@ -156,16 +157,17 @@ export function JournalInterface() {
     }
   }
 
-  // Load user's history from backend
-  const loadUserHistory = async () => {
+  // Load user's history from backend, one page at a time (newest first)
+  const loadUserHistory = async (cursor: string | null = null) => {
     if (!session?.user?.email) return
     
     try {
       setIsLoadingHistory(true)
-      const response = await fetch(apiEndpoints.userHistory(session.user.email))
+      const response = await fetch(apiEndpoints.userHistoryPage(session.user.email, cursor))
       if (response.ok) {
-        const userHistory = await response.json()
-        setHistory(userHistory)
+        const page = await response.json()
+        setHistory(cursor ? [...history, ...page.entries] : page.entries)
+        setHistoryCursor(page.next_cursor)
       }
     } catch (error) {
       console.error("Failed to load history:", error)
@@ -227,6 +229,7 @@ export function JournalInterface() {
     } else {
       // Clear history when user logs out
       setHistory([])
+      setHistoryCursor(null)
     }
   }, [session?.user?.email])
 
@@ -775,6 +778,18 @@ export function JournalInterface() {
                 </CardContent>
               </Card>
             ))}
+            {historyCursor && (
+              <div className="flex justify-center">
+                <Button
+                  onClick={() => loadUserHistory(historyCursor)}
+                  variant="outline"
+                  disabled={isLoadingHistory}
+                  className="border-gray-300 text-gray-700 hover:bg-gray-50 bg-white/80"
+                >
+                  {isLoadingHistory ? "Loading..." : "Load more"}
+                </Button>
+              </div>
+            )}
           </div>
         )}
       </div>
@@ -1026,7 +1041,7 @@ export function JournalInterface() {
             className="border-gray-300 text-gray-700 hover:bg-gray-50 bg-white/80"
           >
             <History className="w-4 h-4 mr-2" />
-            History ({history.length})
+            History ({history.length}{historyCursor ? "+" : ""})
           </Button>
         </div>
       </div>
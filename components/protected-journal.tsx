@@ -169,7 +169,7 @@ export function ProtectedJournal() {
       if (response.ok) {
         const data = await response.json()
         console.log('DEBUG: Update successful:', data)
-        alert(`Message limits updated successfully!\nFree: ${data.limits.free} messages\nPremium: ${data.limits.premium} messages\n\nUpdated ${data.updated_users.free} free users and ${data.updated_users.premium} premium users.`)
+        alert(`Message limits updated successfully!\nFree: ${data.limits.free} messages\nPremium: ${data.limits.premium} messages`)
       } else {
         const errorText = await response.text()
         console.error('DEBUG: Update failed:', response.status, errorText)
@@ -12,6 +12,8 @@ export const apiEndpoints = {
   analyzeJournal: `${config.apiUrl}/analyze-journal`,
   analyzePersonality: `${config.apiUrl}/analyze-personality`,
   userHistory: (email: string) => `${config.apiUrl}/user-history/${encodeURIComponent(email)}`,
+  userHistoryPage: (email: string, cursor?: string | null) =>
+    `${config.apiUrl}/user-history/${encodeURIComponent(email)}/page` + (cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''),
   personalityHistory: (email: string) => `${config.apiUrl}/personality-history/${encodeURIComponent(email)}`,
   deleteHistoryEntry: (email: string, id: string) => 
     `${config.apiUrl}/user-history/${encodeURIComponent(email)}/${id}`,
@@ -0,0 +1,10 @@
+-- content_hash computed field for /user/import/{email} duplicate detection
+-- Lets the backend fetch a fingerprint of each existing entry instead of its full
+-- text. Matches hashlib.md5(journal_entry.encode()).hexdigest() in the backend.
+CREATE OR REPLACE FUNCTION content_hash(journal_entries)
+RETURNS TEXT AS $$
+    SELECT MD5($1.journal_entry)
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Make PostgREST pick up the new computed field
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,16 @@
+-- imported flag for rows written by /user/import/{email}
+-- The analysis backfill is free because an entry recorded through the app was
+-- already counted against quota. Imported entries were not, so the backfill
+-- skips them (run_analysis_backfill in fastapi_backend.py).
+ALTER TABLE journal_entries ADD COLUMN IF NOT EXISTS imported BOOLEAN NOT NULL DEFAULT FALSE;
+
+COMMENT ON COLUMN journal_entries.imported IS 'Written by a bulk import; excluded from the free analysis backfill';
+
+-- Replaces the index from create_backfill_schema.sql so it matches the backfill query
+DROP INDEX IF EXISTS idx_journal_entries_unanalyzed;
+CREATE INDEX idx_journal_entries_unanalyzed
+ON journal_entries(created_at, id)
+WHERE limiting_belief IS NULL AND NOT imported;
+
+-- Make PostgREST pick up the new column
+NOTIFY pgrst, 'reload schema';
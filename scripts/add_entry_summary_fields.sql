@@ -0,0 +1,27 @@
+-- Computed fields for summary listings (?summary=true on the listing endpoints)
+-- PostgREST exposes a function that takes a table row as a virtual column, so
+-- select=id,created_at,emotion,preview,has_analysis returns a short preview
+-- without sending the full journal text or analysis over the wire.
+-- The comment above ENTRY_SUMMARY_COLUMNS in fastapi_backend.py documents the same 160-character cut.
+
+CREATE OR REPLACE FUNCTION preview(journal_entries)
+RETURNS TEXT AS $$
+    SELECT CASE WHEN LENGTH($1.journal_entry) > 160
+                THEN LEFT($1.journal_entry, 160) || '…'
+                ELSE $1.journal_entry END
+$$ LANGUAGE SQL STABLE;
+
+CREATE OR REPLACE FUNCTION has_analysis(journal_entries)
+RETURNS BOOLEAN AS $$
+    SELECT $1.limiting_belief IS NOT NULL
+$$ LANGUAGE SQL STABLE;
+
+CREATE OR REPLACE FUNCTION preview(personality_analyses)
+RETURNS TEXT AS $$
+    SELECT CASE WHEN LENGTH($1.overall_summary) > 160
+                THEN LEFT($1.overall_summary, 160) || '…'
+                ELSE $1.overall_summary END
+$$ LANGUAGE SQL STABLE;
+
+-- Make PostgREST pick up the new computed fields
+NOTIFY pgrst, 'reload schema';
@@ -0,0 +1,5 @@
+-- Composite index for keyset pagination of a user's journal history
+-- Serves /user-history/{email}/page and /stream, which order by
+-- (created_at DESC, id DESC) and resume after the last (created_at, id) seen.
+CREATE INDEX IF NOT EXISTS idx_journal_entries_user_created_id
+ON journal_entries(user_email, created_at DESC, id DESC);
@@ -0,0 +1,74 @@
+-- Atomic quota reservation for user_tiers
+-- Replaces the read-modify-write increment in the backend with a single
+-- conditional UPDATE, so concurrent requests can never lose an increment
+-- or overshoot messages_limit.
+
+-- Make sure ON CONFLICT (user_email) has a unique index to target
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_tiers_email_unique ON user_tiers(user_email);
+
+-- Reserve p_amount messages for a user in one round trip.
+-- Creates the free-tier row on first use and rolls the counter over when the
+-- stored month is stale. Returns reserved = FALSE (and the current usage)
+-- when the reservation would exceed the limit.
+CREATE OR REPLACE FUNCTION reserve_message_quota(p_user_email VARCHAR, p_amount INTEGER DEFAULT 1)
+RETURNS TABLE(
+    reserved BOOLEAN,
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR
+) AS $$
+DECLARE
+    v_month VARCHAR(7) := TO_CHAR(NOW(), 'YYYY-MM');
+    v_row user_tiers%ROWTYPE;
+BEGIN
+    INSERT INTO user_tiers (user_email, tier, messages_used_this_month, messages_limit, current_month_year)
+    VALUES (p_user_email, 'free', 0, 100, v_month)
+    ON CONFLICT (user_email) DO NOTHING;
+
+    -- The row lock taken by this UPDATE serializes concurrent reservations
+    UPDATE user_tiers ut
+    SET messages_used_this_month =
+            (CASE WHEN ut.current_month_year = v_month THEN ut.messages_used_this_month ELSE 0 END) + p_amount,
+        current_month_year = v_month
+    WHERE ut.user_email = p_user_email
+      AND (CASE WHEN ut.current_month_year = v_month THEN ut.messages_used_this_month ELSE 0 END) + p_amount
+          <= ut.messages_limit
+    RETURNING ut.* INTO v_row;
+
+    IF FOUND THEN
+        RETURN QUERY SELECT TRUE, v_row.tier, v_row.messages_used_this_month, v_row.messages_limit, v_row.current_month_year;
+    ELSE
+        SELECT ut.* INTO v_row FROM user_tiers ut WHERE ut.user_email = p_user_email;
+        RETURN QUERY SELECT
+            FALSE,
+            v_row.tier,
+            (CASE WHEN v_row.current_month_year = v_month THEN v_row.messages_used_this_month ELSE 0 END),
+            v_row.messages_limit,
+            v_month;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Give back p_amount messages reserved by a request that failed.
+-- Only refunds within the month the reservation was made in.
+CREATE OR REPLACE FUNCTION refund_message_quota(
+    p_user_email VARCHAR,
+    p_amount INTEGER DEFAULT 1,
+    p_month_year VARCHAR DEFAULT NULL
+)
+RETURNS TABLE(
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR
+) AS $$
+BEGIN
+    RETURN QUERY
+    UPDATE user_tiers ut
+    SET messages_used_this_month = GREATEST(ut.messages_used_this_month - p_amount, 0)
+    WHERE ut.user_email = p_user_email
+      AND ut.current_month_year = COALESCE(p_month_year, TO_CHAR(NOW(), 'YYYY-MM'))
+    RETURNING ut.tier, ut.messages_used_this_month, ut.messages_limit, ut.current_month_year;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the per-user similarity index (UserVectorIndex in fastapi_backend.py).
+
+Embeds a synthetic journal with the deterministic HashingEmbedder, so no API key
+or database is needed, then compares exact search with the IVF index on query
+latency and recall@k (how many of the exact top-k the IVF index also returns).
+
+Usage:
+    python scripts/benchmark_similarity_index.py [--entries 20000] [--queries 200] [--k 5] [--probes 8]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+# fastapi_backend needs these at import time; nothing here talks to the real services
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.e30.placeholder")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi_backend import HashingEmbedder, UserVectorIndex  # noqa: E402
+
+TOPICS = {
+    "work": "manager meeting deadline project promotion colleague feedback office email boss review",
+    "family": "mother father sister brother dinner holiday kids home parents call visit",
+    "health": "sleep gym run tired energy doctor diet walk stress headache yoga",
+    "money": "rent savings budget salary debt spending bills invest expensive loan",
+    "love": "partner date argument trust lonely relationship text miss hug anniversary",
+    "growth": "habit goal reading journal discipline focus learn course practice progress",
+}
+FILLER = "today felt really think maybe again still always never want need feel like".split()
+
+
+def synthetic_entries(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    topics = {name: words.split() for name, words in TOPICS.items()}
+    entries = []
+    for _ in range(count):
+        main, other = rng.sample(list(topics), 2)
+        words = rng.choices(topics[main], k=8) + rng.choices(topics[other], k=2) + rng.choices(FILLER, k=6)
+        rng.shuffle(words)
+        entries.append(" ".join(words))
+    return entries
+
+
+def timed_search(index: UserVectorIndex, queries, k: int):
+    started = time.perf_counter()
+    results = [[entry_id for entry_id, _ in index.search(query, k)] for query in queries]
+    return results, (time.perf_counter() - started) / len(queries)
+
+
+async def run(n: int, n_queries: int, k: int, probes: int):
+    embedder = HashingEmbedder()
+    texts = synthetic_entries(n)
+    started = time.perf_counter()
+    vectors = await embedder.embed(texts)
+    print(f"🧮 Embedded {n} entries in {time.perf_counter() - started:.2f}s ({embedder.name})")
+
+    ids = [str(i) for i in range(n)]
+    dates = [""] * n
+    exact = UserVectorIndex(ann_min_entries=n + 1)
+    exact.add(ids, dates, vectors)
+
+    started = time.perf_counter()
+    ivf = UserVectorIndex(ann_min_entries=1, probes=probes)
+    ivf.add(ids, dates, vectors)
+    print(f"🏗️  Built IVF index with {len(ivf.lists)} lists in {time.perf_counter() - started:.2f}s")
+
+    queries = await embedder.embed(synthetic_entries(n_queries, seed=1))
+    exact_results, exact_latency = timed_search(exact, queries, k)
+    ivf_results, ivf_latency = timed_search(ivf, queries, k)
+    recall = sum(len(set(a) & set(b)) for a, b in zip(exact_results, ivf_results)) / (k * n_queries)
+
+    print(f"📊 Exact: {exact_latency * 1000:.2f} ms/query")
+    print(f"📊 IVF ({probes} probes): {ivf_latency * 1000:.2f} ms/query, recall@{k} = {recall:.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similarity index benchmark")
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--probes", type=int, default=8)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.entries, args.queries, args.k, args.probes))
+
+
+if __name__ == "__main__":
+    main()
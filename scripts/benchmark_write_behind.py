@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the write-behind buffer on /record-thought.
+
+Runs the backend in-process against the Supabase project from the environment
+and fires the same concurrent /record-thought load twice: once writing through
+(quota RPC + insert per request) and once through WriteBehindBuffer. Reports
+throughput and latency for each, then checks that every accepted write landed.
+Requires create_write_behind_schema.sql to be applied.
+
+Usage:
+    python scripts/benchmark_write_behind.py [--email bench@example.com] [--requests 200] [--concurrency 50]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fastapi_backend as backend  # noqa: E402
+
+
+async def fire(client: httpx.AsyncClient, email: str, count: int, concurrency: int, label: str):
+    """Send `count` /record-thought requests, at most `concurrency` at a time; return per-request latencies"""
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = []
+
+    async def one(i: int):
+        async with gate:
+            started = time.perf_counter()
+            r = await client.post("/record-thought", json={
+                "userEmail": email,
+                "journalEntry": f"Write-behind benchmark ({label}) #{i}",
+            })
+            latencies.append(time.perf_counter() - started)
+            if r.status_code != 200:
+                failures.append(r.status_code)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(count)])
+    return time.perf_counter() - started, latencies, failures
+
+
+def report(label: str, elapsed: float, latencies, failures):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"📊 {label}: {len(latencies) / elapsed:.1f} req/s, "
+          f"p50 {statistics.median(latencies) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, "
+          f"{len(failures)} failed {sorted(set(failures)) if failures else ''}")
+
+
+async def count_entries(email: str) -> int:
+    result = await backend.run_query(
+        backend.supabase.table("journal_entries").select("id", count="exact").eq("user_email", email).limit(1)
+    )
+    return result.count or 0
+
+
+async def run(email: str, n: int, concurrency: int) -> bool:
+    transport = httpx.ASGITransport(app=backend.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        tier = (await client.get(f"/user-tier/{email}")).json()
+        original_used = tier["messages_used_this_month"]
+        if tier["messages_limit"] < 2 * n:
+            print(f"❌ {email} has a limit of {tier['messages_limit']}; need at least {2 * n}. Upgrade the tier first.")
+            return False
+
+        passed = True
+        try:
+            await client.post(f"/test/set-messages/{email}/0")
+            backend.tier_cache.clear()
+
+            elapsed, latencies, failures = await fire(client, email, n, concurrency, "write-through")
+            report("Write-through", elapsed, latencies, failures)
+
+            backend.write_buffer = backend.WriteBehindBuffer()
+            backend.write_buffer.start()
+            elapsed, latencies, failures = await fire(client, email, n, concurrency, "write-behind")
+            await backend.write_buffer.stop()
+            report("Write-behind", elapsed, latencies, failures)
+            print(f"   buffer: {backend.write_buffer.stats()}")
+            backend.write_buffer = None
+
+            backend.tier_cache.clear()
+            used = (await client.get(f"/user-tier/{email}")).json()["messages_used_this_month"]
+            stored = await count_entries(email)
+            if used != 2 * n or stored != 2 * n:
+                print(f"❌ Expected {2 * n} entries and usage, found {stored} entries and usage {used}")
+                passed = False
+            else:
+                print(f"✅ All {2 * n} writes stored and counted")
+        finally:
+            if backend.write_buffer is not None:
+                await backend.write_buffer.stop()
+                backend.write_buffer = None
+            await backend.run_query(backend.supabase.table("journal_entries").delete().eq("user_email", email))
+            await client.post(f"/test/set-messages/{email}/{original_used}")
+            print(f"🧹 Deleted {email}'s benchmark entries and restored usage to {original_used}")
+
+        return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write-behind buffer benchmark")
+    parser.add_argument("--email", default="bench@example.com", help="dedicated user; all its journal entries are deleted afterwards")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"🚀 Benchmarking /record-thought with {args.requests} requests, {args.concurrency} concurrent")
+    ok = asyncio.run(run(args.email, args.requests, args.concurrency))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+-- Create analysis_cache table: optional shared tier of the journal analysis cache
+-- Enabled with ANALYSIS_CACHE_TABLE_ENABLED=true. Rows are keyed by a SHA-256 of the
+-- normalized (journal entry, goal, prompt version, model), so identical entries
+-- are analyzed once across all backend instances.
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    analysis JSONB NOT NULL,
+    model VARCHAR(50) NOT NULL,
+    prompt_version VARCHAR(50) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- For purging expired rows
+CREATE INDEX IF NOT EXISTS idx_analysis_cache_created_at ON analysis_cache(created_at);
+
+COMMENT ON TABLE analysis_cache IS 'Cached journal analyses keyed by a hash of the normalized request';
+COMMENT ON COLUMN analysis_cache.analysis IS 'AnalysisResponse JSON (limitingBelief, explanation, reframingExercise)';
+
+-- Rows older than ANALYSIS_CACHE_TTL_SECONDS are ignored by the backend; purge them periodically:
+-- DELETE FROM analysis_cache WHERE created_at < NOW() - INTERVAL '1 day';
@@ -0,0 +1,25 @@
+-- Create analysis_jobs table for background personality analysis jobs
+-- Used when the backend runs with JOB_STORE=supabase, so job status survives
+-- instance restarts and can be polled through any instance.
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id SERIAL PRIMARY KEY,
+    job_id UUID UNIQUE NOT NULL,
+    job_type VARCHAR(50) NOT NULL,
+    user_email VARCHAR(255) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'succeeded', 'failed')),
+    status_code INTEGER,
+    result JSONB,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Polling a user's jobs and finding their active job
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_user_email ON analysis_jobs(user_email, created_at DESC);
+
+-- Recovering queued and abandoned jobs on startup
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs(status, created_at);
+
+COMMENT ON TABLE analysis_jobs IS 'Background analysis jobs queued through /analyze-personality/jobs';
+COMMENT ON COLUMN analysis_jobs.status IS 'queued, running, succeeded or failed';
+COMMENT ON COLUMN analysis_jobs.result IS 'PersonalityAnalysisResponse JSON once the job has succeeded';
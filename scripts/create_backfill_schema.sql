@@ -0,0 +1,40 @@
+-- Support for backfilling analyses of entries saved by /record-thought
+-- (run_analysis_backfill in fastapi_backend.py, scripts/run_analysis_backfill.py).
+
+-- Resumable progress of each backfill, keyed by backfill name
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    name VARCHAR(100) PRIMARY KEY,
+    cursor_created_at TIMESTAMP WITH TIME ZONE,
+    cursor_id TEXT,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+COMMENT ON TABLE backfill_checkpoints IS 'Last (created_at, id) processed by each backfill, so restarted runs resume';
+
+-- Finds unanalyzed entries oldest first without scanning analyzed ones
+CREATE INDEX IF NOT EXISTS idx_journal_entries_unanalyzed
+ON journal_entries(created_at, id)
+WHERE limiting_belief IS NULL;
+
+-- Write a chunk of analyses back in one round trip.
+-- p_rows is a JSON array of {id, limiting_belief, explanation, reframing_exercise}.
+-- Rows analyzed in the meantime are left alone. Returns the number of rows updated
+-- as a one-row table (postgrest-py expects a list of rows from rpc()).
+CREATE OR REPLACE FUNCTION apply_journal_analyses(p_rows JSONB)
+RETURNS TABLE(updated INTEGER) AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    UPDATE journal_entries je
+    SET limiting_belief = r.limiting_belief,
+        explanation = r.explanation,
+        reframing_exercise = r.reframing_exercise
+    FROM jsonb_populate_recordset(NULL::journal_entries, p_rows) r
+    WHERE je.id = r.id
+      AND je.limiting_belief IS NULL;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN QUERY SELECT v_count;
+END;
+$$ LANGUAGE plpgsql;
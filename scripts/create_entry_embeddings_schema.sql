@@ -0,0 +1,22 @@
+-- Embeddings of journal entries for similarity search
+-- (GET /user/entries/{email}/{id}/similar and related entries in personality analysis).
+-- Each entry is embedded once per model; the backend loads a user's vectors into an
+-- in-process index, so no vector extension is needed. Requires EMBEDDINGS_ENABLED=true.
+-- entry_id is TEXT, so there is no foreign key to cascade; the backend deletes an
+-- entry's rows in every path that deletes the entry.
+CREATE TABLE IF NOT EXISTS journal_entry_embeddings (
+    id BIGSERIAL PRIMARY KEY,
+    entry_id TEXT NOT NULL,
+    user_email VARCHAR(255) NOT NULL,
+    model VARCHAR(100) NOT NULL,  -- Embedder.name, e.g. text-embedding-3-small:256
+    embedding REAL[] NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (entry_id, model)
+);
+
+COMMENT ON TABLE journal_entry_embeddings IS 'One embedding per journal entry per embedding model';
+
+-- Loading a user's vectors pages through them in (created_at, id) order
+CREATE INDEX IF NOT EXISTS idx_journal_entry_embeddings_user_model
+ON journal_entry_embeddings(user_email, model, created_at, id);
+
@@ -0,0 +1,62 @@
+-- Full-text search over a user's journal entries (GET /user/entries/search)
+-- An expression GIN index instead of a stored tsvector column, so select=* on
+-- journal_entries doesn't start returning the search document.
+-- btree_gin lets one index cover both the user_email filter and the text match.
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+-- The entry text weighs most, then the goal, then the analysis' limiting belief.
+-- Must stay IMMUTABLE (explicit 'english' config) to be usable in the index.
+CREATE OR REPLACE FUNCTION journal_search_vector(p_entry TEXT, p_goal TEXT, p_belief TEXT)
+RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('english'::regconfig, COALESCE(p_entry, '')), 'A')
+        || setweight(to_tsvector('english'::regconfig, COALESCE(p_goal, '')), 'B')
+        || setweight(to_tsvector('english'::regconfig, COALESCE(p_belief, '')), 'C')
+$$ LANGUAGE SQL IMMUTABLE;
+
+CREATE INDEX IF NOT EXISTS idx_journal_entries_search
+ON journal_entries USING GIN (user_email, journal_search_vector(journal_entry, user_goal, limiting_belief));
+
+-- Ranked, paginated hits for one user. p_query uses web search syntax
+-- ("quoted phrases", or, -excluded). Snippets are only built for the returned page and
+-- mark matches with chr(2)/chr(3), which the backend turns into <mark></mark> after
+-- HTML-escaping the entry text. total_count is the number of hits over all pages.
+CREATE OR REPLACE FUNCTION search_journal_entries(
+    p_user_email VARCHAR,
+    p_query TEXT,
+    p_limit INTEGER DEFAULT 20,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS TABLE(
+    id TEXT,
+    created_at TIMESTAMP WITH TIME ZONE,
+    emotion TEXT,
+    rank REAL,
+    snippet TEXT,
+    total_count BIGINT
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_query tsquery := websearch_to_tsquery('english', p_query);
+BEGIN
+    RETURN QUERY
+    WITH hits AS (
+        SELECT je.id, je.created_at, je.emotion, je.journal_entry, je.user_goal, je.limiting_belief,
+               ts_rank(journal_search_vector(je.journal_entry, je.user_goal, je.limiting_belief), v_query) AS rank,
+               COUNT(*) OVER () AS total_count
+        FROM journal_entries je
+        WHERE je.user_email = p_user_email
+          AND journal_search_vector(je.journal_entry, je.user_goal, je.limiting_belief) @@ v_query
+        ORDER BY rank DESC, je.created_at DESC, je.id DESC
+        LIMIT p_limit OFFSET p_offset
+    )
+    SELECT h.id::TEXT,
+           h.created_at,
+           h.emotion::TEXT,
+           h.rank,
+           ts_headline('english', CONCAT_WS(' … ', h.journal_entry, h.user_goal, h.limiting_belief), v_query,
+                       'StartSel=' || CHR(2) || ', StopSel=' || CHR(3) || ', MaxFragments=2, MaxWords=25, MinWords=8'),
+           h.total_count
+    FROM hits h
+    ORDER BY h.rank DESC, h.created_at DESC, h.id DESC;
+END;
+$$ LANGUAGE plpgsql STABLE;
@@ -0,0 +1,166 @@
+-- Period-keyed message usage
+-- One row per user per month instead of a counter on user_tiers that has to be
+-- reset. A new month starts implicitly (there is no row for it yet), so nothing
+-- is ever reset, and past months stay as usage history.
+-- Apply after create_tier_limits_schema.sql; this replaces the quota functions.
+-- user_tiers.messages_used_this_month and current_month_year are no longer read or written.
+CREATE TABLE IF NOT EXISTS message_usage (
+    user_email VARCHAR(255) NOT NULL,
+    period VARCHAR(7) NOT NULL,  -- YYYY-MM
+    messages_used INTEGER NOT NULL DEFAULT 0 CHECK (messages_used >= 0),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (user_email, period)
+);
+
+COMMENT ON TABLE message_usage IS 'Messages used per user per month (period = YYYY-MM)';
+
+-- Carry over the usage already counted this month
+INSERT INTO message_usage (user_email, period, messages_used)
+SELECT user_email, current_month_year, messages_used_this_month
+FROM user_tiers
+WHERE current_month_year = TO_CHAR(NOW(), 'YYYY-MM') AND messages_used_this_month > 0
+ON CONFLICT (user_email, period) DO NOTHING;
+
+-- A user's tier, limit and usage for the current month in one round trip.
+-- Creates the free-tier row on first use; otherwise read-only.
+CREATE OR REPLACE FUNCTION get_user_quota(p_user_email VARCHAR)
+RETURNS TABLE(
+    user_email VARCHAR,
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_month VARCHAR(7) := TO_CHAR(NOW(), 'YYYY-MM');
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM user_tiers ut WHERE ut.user_email = p_user_email) THEN
+        INSERT INTO user_tiers (user_email, tier) VALUES (p_user_email, 'free')
+        ON CONFLICT (user_email) DO NOTHING;
+    END IF;
+
+    RETURN QUERY
+    SELECT ut.user_email,
+           ut.tier,
+           COALESCE(mu.messages_used, 0),
+           COALESCE(ut.messages_limit, tl.messages_limit, 100),
+           v_month
+    FROM user_tiers ut
+    LEFT JOIN tier_limits tl ON tl.tier = ut.tier
+    LEFT JOIN message_usage mu ON mu.user_email = ut.user_email AND mu.period = v_month
+    WHERE ut.user_email = p_user_email;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reserve p_amount messages in the current month, atomically.
+-- The conditional upsert takes the usage row's lock, so concurrent reservations
+-- can neither lose an increment nor overshoot the limit.
+CREATE OR REPLACE FUNCTION reserve_message_quota(p_user_email VARCHAR, p_amount INTEGER DEFAULT 1)
+RETURNS TABLE(
+    reserved BOOLEAN,
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR
+) AS $$
+DECLARE
+    v_month VARCHAR(7) := TO_CHAR(NOW(), 'YYYY-MM');
+    v_quota RECORD;
+    v_used INTEGER;
+BEGIN
+    SELECT * INTO v_quota FROM get_user_quota(p_user_email);
+
+    INSERT INTO message_usage AS mu (user_email, period, messages_used)
+    SELECT p_user_email, v_month, p_amount
+    WHERE p_amount <= v_quota.messages_limit
+    ON CONFLICT (user_email, period) DO UPDATE
+    SET messages_used = mu.messages_used + EXCLUDED.messages_used,
+        updated_at = NOW()
+    WHERE mu.messages_used + EXCLUDED.messages_used <= v_quota.messages_limit
+    RETURNING mu.messages_used INTO v_used;
+
+    IF FOUND THEN
+        RETURN QUERY SELECT TRUE, v_quota.tier, v_used, v_quota.messages_limit, v_month;
+    ELSE
+        SELECT COALESCE(
+            (SELECT m.messages_used FROM message_usage m WHERE m.user_email = p_user_email AND m.period = v_month), 0
+        ) INTO v_used;
+        RETURN QUERY SELECT FALSE, v_quota.tier, v_used, v_quota.messages_limit, v_month;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Give back p_amount messages reserved by a request that failed, in the month
+-- the reservation was made in.
+CREATE OR REPLACE FUNCTION refund_message_quota(
+    p_user_email VARCHAR,
+    p_amount INTEGER DEFAULT 1,
+    p_month_year VARCHAR DEFAULT NULL
+)
+RETURNS TABLE(
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR
+) AS $$
+BEGIN
+    RETURN QUERY
+    WITH refunded AS (
+        UPDATE message_usage mu
+        SET messages_used = GREATEST(mu.messages_used - p_amount, 0),
+            updated_at = NOW()
+        WHERE mu.user_email = p_user_email
+          AND mu.period = COALESCE(p_month_year, TO_CHAR(NOW(), 'YYYY-MM'))
+        RETURNING mu.user_email, mu.messages_used, mu.period
+    )
+    SELECT ut.tier, r.messages_used, COALESCE(ut.messages_limit, tl.messages_limit, 100), r.period
+    FROM refunded r
+    JOIN user_tiers ut ON ut.user_email = r.user_email
+    LEFT JOIN tier_limits tl ON tl.tier = ut.tier;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Set a user's usage for the current month (admin/test tooling)
+CREATE OR REPLACE FUNCTION set_message_usage(p_user_email VARCHAR, p_count INTEGER)
+RETURNS TABLE(
+    user_email VARCHAR,
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR
+) AS $$
+#variable_conflict use_column
+BEGIN
+    PERFORM get_user_quota(p_user_email);
+    INSERT INTO message_usage (user_email, period, messages_used)
+    VALUES (p_user_email, TO_CHAR(NOW(), 'YYYY-MM'), p_count)
+    ON CONFLICT (user_email, period) DO UPDATE
+    SET messages_used = EXCLUDED.messages_used, updated_at = NOW();
+    RETURN QUERY SELECT * FROM get_user_quota(p_user_email);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Kept for existing callers; no longer resets every user's counter on each call
+CREATE OR REPLACE FUNCTION get_or_create_user_tier_with_reset(p_user_email VARCHAR)
+RETURNS TABLE(
+    id INTEGER,
+    user_email VARCHAR,
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR,
+    created_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT ut.id, q.user_email, q.tier, q.messages_used_this_month,
+           q.messages_limit, q.current_month_year, ut.created_at, ut.updated_at
+    FROM get_user_quota(p_user_email) q
+    JOIN user_tiers ut ON ut.user_email = q.user_email;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Monthly resets are implicit now; the full-table reset is no longer needed
+DROP FUNCTION IF EXISTS reset_monthly_message_counts();
@@ -0,0 +1,21 @@
+-- Log of journal analysis model routing decisions
+-- Written when the backend runs with MODEL_ROUTE_LOG_TABLE_ENABLED=true: one row
+-- per model attempt, including attempts that fell back to another model.
+CREATE TABLE IF NOT EXISTS model_route_log (
+    id BIGSERIAL PRIMARY KEY,
+    endpoint VARCHAR(50) NOT NULL,
+    policy VARCHAR(50) NOT NULL,
+    model VARCHAR(100) NOT NULL,
+    outcome VARCHAR(20) NOT NULL CHECK (outcome IN ('ok', 'unavailable', 'invalid_json')),
+    latency_ms INTEGER NOT NULL,
+    entry_tokens INTEGER,
+    tier VARCHAR(20),
+    fallback_from VARCHAR(100),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Per-model latency and outcome over recent time windows
+CREATE INDEX IF NOT EXISTS idx_model_route_log_model_created ON model_route_log(model, created_at DESC);
+
+COMMENT ON TABLE model_route_log IS 'One row per model attempt made by the journal analysis router';
+COMMENT ON COLUMN model_route_log.fallback_from IS 'Model tried just before this one, when this attempt is a fallback';
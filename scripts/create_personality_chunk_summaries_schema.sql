@@ -0,0 +1,22 @@
+-- Create personality_chunk_summaries table for incremental personality analysis
+-- Journal entries are summarized once in fixed-size chunks (map step); each
+-- /analyze-personality run only summarizes chunks completed since the previous
+-- run and then reduces over all stored summaries.
+CREATE TABLE IF NOT EXISTS personality_chunk_summaries (
+    id SERIAL PRIMARY KEY,
+    user_email VARCHAR(255) NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    entry_count INTEGER NOT NULL,
+    first_entry_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_entry_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_entry_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (user_email, chunk_index)
+);
+
+-- The unique constraint's index also serves lookups by user ordered by chunk
+COMMENT ON TABLE personality_chunk_summaries IS 'Per-chunk summaries of journal entries used as the map step of personality analysis';
+COMMENT ON COLUMN personality_chunk_summaries.chunk_index IS 'Position of the chunk in the user''s chronological history, starting at 0';
+COMMENT ON COLUMN personality_chunk_summaries.last_entry_at IS 'created_at of the last entry in the chunk; with last_entry_id, the resume point for the next chunk';
+COMMENT ON COLUMN personality_chunk_summaries.last_entry_id IS 'id of the last entry in the chunk';
@@ -0,0 +1,95 @@
+-- Central monthly message limits per tier
+-- user_tiers.messages_limit becomes an optional per-user override: NULL means
+-- "use the tier's limit from tier_limits", so changing a tier's limit is a
+-- one-row update instead of a rewrite of every user row.
+-- Apply after add_quota_reservation_functions.sql; this replaces both functions.
+CREATE TABLE IF NOT EXISTS tier_limits (
+    tier VARCHAR(20) PRIMARY KEY,
+    messages_limit INTEGER NOT NULL CHECK (messages_limit >= 0),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+INSERT INTO tier_limits (tier, messages_limit) VALUES ('free', 100), ('premium', 500)
+ON CONFLICT (tier) DO NOTHING;
+
+COMMENT ON TABLE tier_limits IS 'Monthly message limit for each tier; read by the backend and the quota functions';
+
+-- Per-user limits are now overrides only
+ALTER TABLE user_tiers ALTER COLUMN messages_limit DROP NOT NULL;
+ALTER TABLE user_tiers ALTER COLUMN messages_limit DROP DEFAULT;
+
+-- Rows that just carry their tier's limit follow the tier from now on
+UPDATE user_tiers ut
+SET messages_limit = NULL
+FROM tier_limits tl
+WHERE tl.tier = ut.tier AND ut.messages_limit = tl.messages_limit;
+
+COMMENT ON COLUMN user_tiers.messages_limit IS 'Per-user override of the tier limit; NULL uses tier_limits';
+
+-- Same as add_quota_reservation_functions.sql, but the limit is the user's
+-- override or else their tier's configured limit.
+CREATE OR REPLACE FUNCTION reserve_message_quota(p_user_email VARCHAR, p_amount INTEGER DEFAULT 1)
+RETURNS TABLE(
+    reserved BOOLEAN,
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR
+) AS $$
+DECLARE
+    v_month VARCHAR(7) := TO_CHAR(NOW(), 'YYYY-MM');
+    v_row user_tiers%ROWTYPE;
+    v_limit INTEGER;
+BEGIN
+    INSERT INTO user_tiers (user_email, tier, messages_used_this_month, current_month_year)
+    VALUES (p_user_email, 'free', 0, v_month)
+    ON CONFLICT (user_email) DO NOTHING;
+
+    -- The row lock taken by this UPDATE serializes concurrent reservations
+    UPDATE user_tiers ut
+    SET messages_used_this_month =
+            (CASE WHEN ut.current_month_year = v_month THEN ut.messages_used_this_month ELSE 0 END) + p_amount,
+        current_month_year = v_month
+    WHERE ut.user_email = p_user_email
+      AND (CASE WHEN ut.current_month_year = v_month THEN ut.messages_used_this_month ELSE 0 END) + p_amount
+          <= COALESCE(ut.messages_limit, (SELECT tl.messages_limit FROM tier_limits tl WHERE tl.tier = ut.tier), 100)
+    RETURNING ut.* INTO v_row;
+
+    IF FOUND THEN
+        v_limit := COALESCE(v_row.messages_limit, (SELECT tl.messages_limit FROM tier_limits tl WHERE tl.tier = v_row.tier), 100);
+        RETURN QUERY SELECT TRUE, v_row.tier, v_row.messages_used_this_month, v_limit, v_row.current_month_year;
+    ELSE
+        SELECT ut.* INTO v_row FROM user_tiers ut WHERE ut.user_email = p_user_email;
+        v_limit := COALESCE(v_row.messages_limit, (SELECT tl.messages_limit FROM tier_limits tl WHERE tl.tier = v_row.tier), 100);
+        RETURN QUERY SELECT
+            FALSE,
+            v_row.tier,
+            (CASE WHEN v_row.current_month_year = v_month THEN v_row.messages_used_this_month ELSE 0 END),
+            v_limit,
+            v_month;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION refund_message_quota(
+    p_user_email VARCHAR,
+    p_amount INTEGER DEFAULT 1,
+    p_month_year VARCHAR DEFAULT NULL
+)
+RETURNS TABLE(
+    tier VARCHAR,
+    messages_used_this_month INTEGER,
+    messages_limit INTEGER,
+    current_month_year VARCHAR
+) AS $$
+BEGIN
+    RETURN QUERY
+    UPDATE user_tiers ut
+    SET messages_used_this_month = GREATEST(ut.messages_used_this_month - p_amount, 0)
+    WHERE ut.user_email = p_user_email
+      AND ut.current_month_year = COALESCE(p_month_year, TO_CHAR(NOW(), 'YYYY-MM'))
+    RETURNING ut.tier, ut.messages_used_this_month,
+              COALESCE(ut.messages_limit, (SELECT tl.messages_limit FROM tier_limits tl WHERE tl.tier = ut.tier), 100),
+              ut.current_month_year;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,116 @@
+-- Per-user daily rollup of journal activity for /user/stats/{email}
+-- Kept up to date by statement-level triggers on journal_entries, so every write
+-- path (/record-thought, /analyze-journal, batches, backfills, deletes) updates it
+-- with one upsert per statement, and stats are read in O(days) instead of O(entries).
+-- Days are UTC dates of created_at.
+CREATE TABLE IF NOT EXISTS user_daily_stats (
+    user_email VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 0,
+    analyzed INTEGER NOT NULL DEFAULT 0,  -- entries with an analysis (limiting_belief set)
+    emotion_counts JSONB NOT NULL DEFAULT '{}',  -- {"happy": 2, "sad": 1}
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (user_email, day)
+);
+
+COMMENT ON TABLE user_daily_stats IS 'Entries, analyses and emotions per user per UTC day, maintained by triggers on journal_entries';
+
+-- Add two {"emotion": count} objects, dropping emotions that net out to zero
+CREATE OR REPLACE FUNCTION merge_emotion_counts(p_a JSONB, p_b JSONB)
+RETURNS JSONB AS $$
+    SELECT COALESCE(jsonb_object_agg(key, total) FILTER (WHERE total <> 0), '{}'::JSONB)
+    FROM (
+        SELECT key, SUM(value::INTEGER) AS total
+        FROM (SELECT * FROM jsonb_each_text(p_a) UNION ALL SELECT * FROM jsonb_each_text(p_b)) counts
+        GROUP BY key
+    ) totals
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Add (p_sign = 1) or remove (p_sign = -1) a set of journal_entries rows (as JSON) from the rollup
+CREATE OR REPLACE FUNCTION apply_user_daily_stats(p_rows JSONB, p_sign INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    IF p_rows IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO user_daily_stats AS s (user_email, day, entries, analyzed, emotion_counts)
+    SELECT user_email, day, SUM(n) * p_sign, SUM(n_analyzed) * p_sign,
+           COALESCE(jsonb_object_agg(emotion, n * p_sign) FILTER (WHERE emotion IS NOT NULL), '{}'::JSONB)
+    FROM (
+        SELECT r.user_email, (r.created_at AT TIME ZONE 'UTC')::DATE AS day, r.emotion,
+               COUNT(*) AS n, COUNT(*) FILTER (WHERE r.limiting_belief IS NOT NULL) AS n_analyzed
+        FROM jsonb_to_recordset(p_rows) AS r(user_email VARCHAR, created_at TIMESTAMPTZ, emotion VARCHAR, limiting_belief TEXT)
+        GROUP BY 1, 2, 3
+    ) per_emotion
+    GROUP BY user_email, day
+    ON CONFLICT (user_email, day) DO UPDATE
+    SET entries = s.entries + EXCLUDED.entries,
+        analyzed = s.analyzed + EXCLUDED.analyzed,
+        emotion_counts = merge_emotion_counts(s.emotion_counts, EXCLUDED.emotion_counts),
+        updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_user_daily_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM apply_user_daily_stats((SELECT jsonb_agg(to_jsonb(n)) FROM new_rows n), 1);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM apply_user_daily_stats((SELECT jsonb_agg(to_jsonb(o)) FROM old_rows o), -1);
+    ELSE
+        -- Only rows whose rolled-up fields changed, so plain text edits cost nothing
+        PERFORM apply_user_daily_stats((
+            SELECT jsonb_agg(to_jsonb(o)) FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE o.user_email IS DISTINCT FROM n.user_email
+               OR o.created_at IS DISTINCT FROM n.created_at
+               OR o.emotion IS DISTINCT FROM n.emotion
+               OR (o.limiting_belief IS NULL) <> (n.limiting_belief IS NULL)
+        ), -1);
+        PERFORM apply_user_daily_stats((
+            SELECT jsonb_agg(to_jsonb(n)) FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE o.user_email IS DISTINCT FROM n.user_email
+               OR o.created_at IS DISTINCT FROM n.created_at
+               OR o.emotion IS DISTINCT FROM n.emotion
+               OR (o.limiting_belief IS NULL) <> (n.limiting_belief IS NULL)
+        ), 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS journal_entries_daily_stats_insert ON journal_entries;
+CREATE TRIGGER journal_entries_daily_stats_insert
+    AFTER INSERT ON journal_entries
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_user_daily_stats();
+
+DROP TRIGGER IF EXISTS journal_entries_daily_stats_update ON journal_entries;
+CREATE TRIGGER journal_entries_daily_stats_update
+    AFTER UPDATE ON journal_entries
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_user_daily_stats();
+
+DROP TRIGGER IF EXISTS journal_entries_daily_stats_delete ON journal_entries;
+CREATE TRIGGER journal_entries_daily_stats_delete
+    AFTER DELETE ON journal_entries
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_user_daily_stats();
+
+-- Build the rollup from existing entries (rerunning the script rebuilds it)
+TRUNCATE user_daily_stats;
+INSERT INTO user_daily_stats (user_email, day, entries, analyzed, emotion_counts)
+SELECT user_email, day, SUM(n), SUM(n_analyzed),
+       COALESCE(jsonb_object_agg(emotion, n) FILTER (WHERE emotion IS NOT NULL), '{}'::JSONB)
+FROM (
+    SELECT user_email, (created_at AT TIME ZONE 'UTC')::DATE AS day, emotion,
+           COUNT(*) AS n, COUNT(*) FILTER (WHERE limiting_belief IS NOT NULL) AS n_analyzed
+    FROM journal_entries
+    GROUP BY 1, 2, 3
+) per_emotion
+GROUP BY user_email, day;
@@ -0,0 +1,68 @@
+-- User directory for /admin/search-users
+-- One row per email, added by triggers the first time an email shows up in
+-- user_tiers or journal_entries, so search no longer scans journal_entries.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE IF NOT EXISTS user_directory (
+    user_email VARCHAR(255) PRIMARY KEY,
+    email_lower VARCHAR(255) NOT NULL,
+    first_seen_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Trigram index serves substring (ILIKE '%q%') matches; the btree serves prefix matches
+CREATE INDEX IF NOT EXISTS idx_user_directory_email_trgm ON user_directory USING GIN (email_lower gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_user_directory_email_prefix ON user_directory(email_lower varchar_pattern_ops);
+
+COMMENT ON TABLE user_directory IS 'Every known user email, maintained by triggers on user_tiers and journal_entries';
+
+-- Add the row's email to the directory if it isn't there yet
+CREATE OR REPLACE FUNCTION add_to_user_directory()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_directory (user_email, email_lower)
+    VALUES (NEW.user_email, LOWER(NEW.user_email))
+    ON CONFLICT (user_email) DO NOTHING;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_tiers_user_directory ON user_tiers;
+CREATE TRIGGER user_tiers_user_directory
+    AFTER INSERT ON user_tiers
+    FOR EACH ROW
+    EXECUTE FUNCTION add_to_user_directory();
+
+DROP TRIGGER IF EXISTS journal_entries_user_directory ON journal_entries;
+CREATE TRIGGER journal_entries_user_directory
+    AFTER INSERT ON journal_entries
+    FOR EACH ROW
+    EXECUTE FUNCTION add_to_user_directory();
+
+-- Backfill existing users
+INSERT INTO user_directory (user_email, email_lower)
+SELECT user_email, LOWER(user_email) FROM (
+    SELECT user_email FROM user_tiers
+    UNION
+    SELECT DISTINCT user_email FROM journal_entries
+) existing
+ON CONFLICT (user_email) DO NOTHING;
+
+-- Case-insensitive substring search with a stable ranking:
+-- prefix matches first, then earlier matches, then shorter emails, then alphabetical.
+CREATE OR REPLACE FUNCTION search_user_directory(p_query TEXT, p_limit INTEGER DEFAULT 10)
+RETURNS TABLE(user_email VARCHAR) AS $$
+DECLARE
+    v_query TEXT := LOWER(REPLACE(REPLACE(REPLACE(p_query, '\', '\\'), '%', '\%'), '_', '\_'));
+BEGIN
+    RETURN QUERY
+    SELECT ud.user_email
+    FROM user_directory ud
+    WHERE ud.email_lower LIKE '%' || v_query || '%'
+    ORDER BY
+        ud.email_lower LIKE v_query || '%' DESC,
+        POSITION(LOWER(p_query) IN ud.email_lower),
+        LENGTH(ud.email_lower),
+        ud.email_lower
+    LIMIT p_limit;
+END;
+$$ LANGUAGE plpgsql STABLE;
@@ -0,0 +1,24 @@
+-- Batched usage updates for the write-behind buffer (WRITE_BEHIND_ENABLED=true)
+-- Applies many users' accumulated message counts in one round trip. Quota was
+-- already checked by the backend when each message was accepted, so this adds
+-- the deltas unconditionally. Apply after create_message_usage_schema.sql.
+CREATE OR REPLACE FUNCTION apply_usage_deltas(p_deltas JSONB)
+RETURNS TABLE(
+    user_email VARCHAR,
+    period VARCHAR,
+    messages_used INTEGER
+) AS $$
+#variable_conflict use_column
+BEGIN
+    -- p_deltas: [{"user_email": ..., "period": "YYYY-MM", "delta": n}, ...]
+    RETURN QUERY
+    INSERT INTO message_usage AS mu (user_email, period, messages_used)
+    SELECT d.user_email, d.period, d.delta
+    FROM jsonb_to_recordset(p_deltas) AS d(user_email VARCHAR, period VARCHAR, delta INTEGER)
+    WHERE d.delta > 0
+    ON CONFLICT (user_email, period) DO UPDATE
+    SET messages_used = mu.messages_used + EXCLUDED.messages_used,
+        updated_at = NOW()
+    RETURNING mu.user_email, mu.period, mu.messages_used;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,14 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from openai import OpenAI
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from openai import AsyncOpenAI
+import openai
 import os
 import json
 import uuid
+import time
+import threading
+import base64
+import asyncio
+import re
+import random
+import hashlib
+import html
+import io
+import csv
+import zlib
+import codecs
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from dotenv import load_dotenv
 from typing import List, Dict, Any, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from supabase import create_client
+from postgrest.types import ReturnMethod
+import anyio
+import tiktoken
+import numpy as np
 
 # Load environment variables from .env file
 load_dotenv()
@@ -37,7 +57,8 @@ openai_api_key = os.getenv("OPENAI_API_KEY")
 if not openai_api_key:
     raise ValueError("OPENAI_API_KEY environment variable is required but not set")
 
-openai_client = OpenAI(api_key=openai_api_key)
+# Retries are handled by ResilientOpenAI (openai_chat below), not the SDK
+openai_client = AsyncOpenAI(api_key=openai_api_key, max_retries=0)
 
 # Initialize Supabase client
 supabase_url = os.getenv("SUPABASE_URL")
@@ -48,42 +69,220 @@ if not supabase_url or not supabase_key:
 
 supabase = create_client(supabase_url, supabase_key)
 
+# The Supabase client is synchronous, so queries run on a bounded thread pool
+# instead of blocking the event loop while PostgREST responds.
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "40"))
+_db_limiter: Optional[anyio.CapacityLimiter] = None
+
+def get_db_limiter() -> anyio.CapacityLimiter:
+    """Lazily create the DB thread limiter (it must be created inside the event loop)"""
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(DB_MAX_CONCURRENCY)
+    return _db_limiter
+
+async def run_query(query):
+    """Execute a Supabase query builder off the event loop and return its response"""
+    return await anyio.to_thread.run_sync(query.execute, limiter=get_db_limiter())
+
+def keyset_page(query, cursor: Optional[tuple] = None, limit: int = 50, desc: bool = True):
+    """Order a query by (created_at, id) and restrict it to one page after the cursor.
+
+    postgrest-py has no or_() or multi-column order(), so the PostgREST params are
+    added directly. The selected columns must include created_at and id.
+    """
+    direction, op = ("desc", "lt") if desc else ("asc", "gt")
+    if cursor is not None:
+        created_at, entry_id = cursor
+        query.params = query.params.add(
+            "or", f'(created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{entry_id}))'
+        )
+    query.params = query.params.add("order", f"created_at.{direction},id.{direction}")
+    return query.limit(limit)
+
+async def iter_keyset_pages(build_query, page_size: int, cursor: Optional[tuple] = None, desc: bool = True):
+    """Yield successive pages of rows, one round trip each, starting after the cursor.
+
+    build_query must return a fresh (unexecuted) select builder on every call.
+    """
+    while True:
+        result = await run_query(keyset_page(build_query(), cursor, page_size, desc))
+        rows = result.data or []
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        cursor = (rows[-1]["created_at"], rows[-1]["id"])
+
+def encode_cursor(row: dict) -> str:
+    """Opaque pagination cursor pointing just past this row"""
+    raw = json.dumps([row["created_at"], row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, entry_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return created_at, entry_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after ttl_seconds.
+
+    Only touched from the event loop, so it needs no locking.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key onto one in-flight computation.
+
+    The computation runs as its own task, so it finishes (and persists its result)
+    even if the caller that started it disconnects.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Task] = {}
+
+    def _finished(self, key, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every caller went away
+
+    async def do(self, key, fn) -> tuple[Any, bool]:
+        """Run fn() unless a call with this key is in flight; returns (result, shared)"""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda finished: self._finished(key, finished))
+        return await asyncio.shield(task), shared
+
+    def __len__(self):
+        return len(self._inflight)
+
+# Duplicate analysis requests (double clicks, frontend retries) share one run
+request_coalescer = SingleFlight()
+
+class TokenBucket:
+    """Async rate limiter: acquire() waits until a token is available.
+
+    Tokens refill continuously at rate_per_second up to capacity (the allowed burst).
+    """
+
+    def __init__(self, rate_per_second: float, capacity: float = 1):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+# Per-instance cache of user_tiers rows keyed by email. Every write to a tier row
+# made by this instance goes through cache_tier_info(); the TTL bounds how stale a
+# row can get when another instance changes it.
+tier_cache = TTLCache(
+    maxsize=int(os.getenv("TIER_CACHE_MAX_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("TIER_CACHE_TTL_SECONDS", "60"))
+)
+
+# Monthly message limit per tier, from the tier_limits table (create_tier_limits_schema.sql).
+# user_tiers.messages_limit is only a per-user override; NULL means the tier's limit.
+# The table is re-read at most every TIER_LIMITS_TTL_SECONDS per instance.
+DEFAULT_TIER_LIMITS = {"free": 100, "premium": 500}
+TIER_LIMITS_TTL_SECONDS = float(os.getenv("TIER_LIMITS_TTL_SECONDS", "60"))
+tier_limits = dict(DEFAULT_TIER_LIMITS)
+tier_limits_loaded_at: Optional[float] = None
+
+async def load_tier_limits(force: bool = False) -> dict:
+    """Current limits by tier, refreshed from tier_limits when the cached copy is stale"""
+    global tier_limits_loaded_at
+    if not force and tier_limits_loaded_at is not None and time.monotonic() - tier_limits_loaded_at < TIER_LIMITS_TTL_SECONDS:
+        return tier_limits
+    try:
+        result = await run_query(supabase.table("tier_limits").select("tier, messages_limit"))
+        tier_limits.update({row["tier"]: row["messages_limit"] for row in result.data or []})
+    except Exception as e:
+        # Keep the last known limits; retry after the TTL rather than on every request
+        print(f"DEBUG: Error loading tier limits: {e}")
+    tier_limits_loaded_at = time.monotonic()
+    return tier_limits
+
+def resolve_messages_limit(tier_info: dict) -> dict:
+    """Fill in the tier's configured limit unless the row carries a per-user override"""
+    if tier_info.get("messages_limit") is not None:
+        return tier_info
+    limit = tier_limits.get(tier_info.get("tier"), DEFAULT_TIER_LIMITS["free"])
+    return {**tier_info, "messages_limit": limit}
+
+def cache_tier_info(tier_info: dict) -> dict:
+    """Write a fresh user_tiers row through to the tier cache; returns it with its limit resolved"""
+    cached = tier_cache.get(tier_info["user_email"]) or {}
+    tier_cache.set(tier_info["user_email"], {**cached, **tier_info})
+    return resolve_messages_limit(tier_info)
+
+def apply_monthly_reset(tier_info: dict) -> dict:
+    """Present a row from a previous month as an unused current month, without writing"""
+    current_month = datetime.now().strftime("%Y-%m")
+    if tier_info.get("current_month_year") == current_month:
+        return dict(tier_info)
+    return {**tier_info, "messages_used_this_month": 0, "current_month_year": current_month}
+
 # Helper functions for user tier management
-def get_or_create_user_tier(user_email: str) -> dict:
-    """Get user tier info with monthly reset logic, create default if doesn't exist"""
+async def get_or_create_user_tier(user_email: str) -> dict:
+    """Get user tier info and this month's usage, create default if doesn't exist"""
+    cached = tier_cache.get(user_email)
+    if cached is not None:
+        return resolve_messages_limit(apply_monthly_reset(cached))
+    
     try:
-        # First, reset monthly counts for all users if needed
-        current_month = datetime.now().strftime("%Y-%m")
-        
-        # Get user tier info
-        result = supabase.table("user_tiers").select("*").eq("user_email", user_email).execute()
-        
-        if result.data:
-            user_tier = result.data[0]
-            # Check if we need to reset for new month
-            if user_tier.get("current_month_year") != current_month:
-                # Reset monthly count
-                updated_tier = {
-                    "messages_used_this_month": 0,
-                    "current_month_year": current_month
-                }
-                result = supabase.table("user_tiers").update(updated_tier).eq("user_email", user_email).execute()
-                user_tier = result.data[0] if result.data else user_tier
-            
-            return user_tier
-        else:
-            # Create default free tier for new user
-            # For testing: use 2 messages for free tier
-            # For production: use 100 messages for free tier
-            new_tier = {
-                "user_email": user_email,
-                "tier": "free",
-                "messages_used_this_month": 0,
-                "messages_limit": 100,  # Production limit
-                "current_month_year": current_month
-            }
-            result = supabase.table("user_tiers").insert(new_tier).execute()
-            return result.data[0]
+        # Usage is kept per month in message_usage, so a new month needs no reset write
+        # (see create_message_usage_schema.sql); this only writes for a brand-new user
+        result = await run_query(supabase.rpc("get_user_quota", {"p_user_email": user_email}))
+        return cache_tier_info(result.data[0])
     except Exception as e:
         print(f"DEBUG: Error getting/creating user tier: {e}")
         # Return default values if database fails
@@ -95,36 +294,388 @@ def get_or_create_user_tier(user_email: str) -> dict:
             "current_month_year": datetime.now().strftime("%Y-%m")
         }
 
-def check_message_limit(user_email: str) -> tuple[bool, dict]:
-    """Check if user can send more messages this month. Returns (can_send, tier_info)"""
-    tier_info = get_or_create_user_tier(user_email)
-    can_send = tier_info["messages_used_this_month"] < tier_info["messages_limit"]
-    print(f"DEBUG: Checking limit for {user_email}: {tier_info['messages_used_this_month']}/{tier_info['messages_limit']} - Can send: {can_send}")
-    return can_send, tier_info
+QUOTA_EXHAUSTED_MESSAGE = "You've exhausted your quota for the month. If you need more, upgrade your tier by sending an email request to mindsetosai@gmail.com"
+
+def quota_exhausted_response(user_email: str):
+    """Plain-text 429 returned when a user has no messages left this month"""
+    print(f"DEBUG: User {user_email} has reached limit, returning 429 error")
+    from fastapi import Response
+    return Response(
+        content=QUOTA_EXHAUSTED_MESSAGE,
+        status_code=429,
+        media_type="text/plain"
+    )
+
+class QuotaReservation:
+    """Messages reserved for a request before any work is done; refund() gives them back on failure"""
+
+    def __init__(self, user_email: str, granted: bool, tier_info: dict, amount: int = 1):
+        self.user_email = user_email
+        self.granted = granted
+        self.tier_info = tier_info
+        self.amount = amount
+        self.refunded = 0
+
+    async def refund(self, amount: Optional[int] = None):
+        """Give back `amount` reserved messages (default: all not yet refunded)"""
+        remaining = self.amount - self.refunded
+        amount = remaining if amount is None else min(amount, remaining)
+        if not self.granted or amount <= 0:
+            return
+        self.refunded += amount
+        try:
+            result = await run_query(supabase.rpc("refund_message_quota", {
+                "p_user_email": self.user_email,
+                "p_amount": amount,
+                "p_month_year": self.tier_info.get("current_month_year")
+            }))
+            if result.data:
+                cache_tier_info({"user_email": self.user_email, **result.data[0]})
+            print(f"DEBUG: Refunded {amount} message(s) to {self.user_email}")
+        except Exception as e:
+            print(f"DEBUG: Error refunding message quota: {e}")
 
-def increment_message_count(user_email: str) -> dict:
-    """Increment user's monthly message count"""
+async def reserve_message_quota(user_email: str, amount: int = 1) -> QuotaReservation:
+    """Atomically reserve messages in a single round trip (see add_quota_reservation_functions.sql)"""
     try:
-        # Get current count and increment
-        current_tier = get_or_create_user_tier(user_email)
-        old_count = current_tier["messages_used_this_month"]
-        new_count = old_count + 1
-        
-        print(f"DEBUG: Incrementing message count for {user_email}: {old_count} -> {new_count}")
-        
-        result = supabase.table("user_tiers").update({
-            "messages_used_this_month": new_count
-        }).eq("user_email", user_email).execute()
-        
-        if result.data:
-            print(f"DEBUG: Successfully updated message count to {new_count}")
-            return result.data[0]
-        else:
-            print(f"DEBUG: Failed to update message count, returning current tier")
-            return get_or_create_user_tier(user_email)
+        result = await run_query(supabase.rpc("reserve_message_quota", {
+            "p_user_email": user_email,
+            "p_amount": amount
+        }))
+        row = result.data[0]
+        granted = bool(row.pop("reserved"))
+        tier_info = cache_tier_info({"user_email": user_email, **row})
+        print(f"DEBUG: Reserve {amount} for {user_email}: {tier_info['messages_used_this_month']}/{tier_info['messages_limit']} - Granted: {granted}")
+        return QuotaReservation(user_email, granted, tier_info, amount)
     except Exception as e:
-        print(f"DEBUG: Error incrementing message count: {e}")
-        return get_or_create_user_tier(user_email)
+        print(f"DEBUG: Error reserving message quota: {e}")
+        # Don't block users if the database is unavailable
+        return QuotaReservation(user_email, True, {
+            "user_email": user_email,
+            "tier": "free",
+            "messages_used_this_month": 0,
+            "messages_limit": 2,  # Testing limit
+            "current_month_year": datetime.now().strftime("%Y-%m")
+        }, amount)
+
+def parse_json_response(analysis_text: str) -> dict:
+    """Parse a model's JSON reply, unwrapping a ```json code block if present"""
+    try:
+        return json.loads(analysis_text)
+    except json.JSONDecodeError:
+        # Try to extract JSON if it's wrapped in markdown code blocks
+        if "```json" in analysis_text:
+            json_start = analysis_text.find("```json") + 7
+            json_end = analysis_text.find("```", json_start)
+            if json_end > json_start:
+                return json.loads(analysis_text[json_start:json_end].strip())
+        raise
+
+# Prompt building with token budgets
+# Token counts are computed locally with tiktoken. Budgets cap the tokens sent to
+# the model per endpoint and tier; PROMPT_BUDGET_<ENDPOINT>_<TIER> overrides one,
+# e.g. PROMPT_BUDGET_ANALYZE_PERSONALITY_FREE=8000.
+PROMPT_TOKEN_BUDGETS = {
+    "analyze_journal": {"free": 2000, "premium": 4000},
+    "analyze_personality": {"free": 12000, "premium": 24000},
+}
+PROMPT_MAX_SECTION_TOKENS = int(os.getenv("PROMPT_MAX_SECTION_TOKENS", "1500"))
+_token_encoder = None
+_token_encoder_failed = False
+
+def get_token_encoder():
+    """Load the gpt-4o tokenizer once; None if it can't be loaded (e.g. no network for the BPE file)"""
+    global _token_encoder, _token_encoder_failed
+    if _token_encoder is None and not _token_encoder_failed:
+        try:
+            _token_encoder = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"DEBUG: Falling back to estimated token counts: {e}")
+            _token_encoder_failed = True
+    return _token_encoder
+
+def count_tokens(text: str) -> int:
+    encoder = get_token_encoder()
+    if encoder is None:
+        # Roughly 4 characters per token for English text
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Deterministically shorten text to max_tokens, keeping its beginning and end"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    marker = " [...] "
+    keep = max(max_tokens - count_tokens(marker), 2)
+    head, tail = keep * 2 // 3, keep - keep * 2 // 3
+    encoder = get_token_encoder()
+    if encoder is None:
+        return text[:head * 4] + marker + text[-tail * 4:]
+    tokens = encoder.encode(text, disallowed_special=())
+    return encoder.decode(tokens[:head]) + marker + encoder.decode(tokens[-tail:])
+
+def get_prompt_budget(endpoint: str, tier: str) -> int:
+    budgets = PROMPT_TOKEN_BUDGETS[endpoint]
+    default = budgets.get(tier, budgets["free"])
+    return int(os.getenv(f"PROMPT_BUDGET_{endpoint.upper()}_{tier.upper()}", default))
+
+def fit_sections_to_budget(sections: List[str], budget: int, strategy: str = "recency",
+                           max_section_tokens: int = PROMPT_MAX_SECTION_TOKENS) -> tuple[List[str], dict]:
+    """Choose which chronologically ordered sections fit in a token budget.
+
+    Each section is first truncated to max_section_tokens. "recency" keeps the
+    newest sections that fit; "sample" spends half the budget on the newest
+    sections and the rest on an evenly spaced sample of the older ones. The
+    newest section is always kept, truncated further if it alone is over budget.
+    Returns (kept sections in their original order, token accounting).
+    """
+    input_counts = [count_tokens(section) for section in sections]
+    fitted = [
+        truncate_to_tokens(section, max_section_tokens) if count > max_section_tokens else section
+        for section, count in zip(sections, input_counts)
+    ]
+    counts = [count_tokens(section) for section in fitted]
+    if fitted and counts[-1] > budget:
+        fitted[-1] = truncate_to_tokens(fitted[-1], budget)
+        counts[-1] = min(count_tokens(fitted[-1]), budget)
+    
+    kept = set()
+    used = 0
+    recent_budget = budget if strategy == "recency" else budget // 2
+    for i in range(len(fitted) - 1, -1, -1):
+        if used + counts[i] > recent_budget and kept:
+            break
+        kept.add(i)
+        used += counts[i]
+    
+    older = [i for i in range(len(fitted)) if i not in kept]
+    if strategy == "sample" and older:
+        # Evenly spaced picks over the older sections so coverage spans the whole history
+        average = max(sum(counts[i] for i in older) // len(older), 1)
+        step = max(len(older) // max((budget - used) // average, 1), 1)
+        for i in older[::step]:
+            if used + counts[i] <= budget:
+                kept.add(i)
+                used += counts[i]
+    
+    stats = {
+        "budget": budget,
+        "input_tokens": sum(input_counts),
+        "section_tokens": used,
+        "sections_total": len(sections),
+        "sections_kept": len(kept),
+        "sections_truncated": sum(1 for section, original in zip(fitted, sections) if section is not original),
+        "strategy": strategy
+    }
+    return [fitted[i] for i in sorted(kept)], stats
+
+def fair_share_cap(counts: List[int], budget: int) -> int:
+    """Largest per-section token cap under which all sections together fit the budget.
+
+    Sections shorter than the cap keep their full length, so only the long ones are cut.
+    """
+    remaining, left = budget, len(counts)
+    for count in sorted(counts):
+        if count * left > remaining:
+            return max(remaining // left, 1)
+        remaining -= count
+        left -= 1
+    return max(counts, default=1)
+
+def set_prompt_token_headers(http_response: Response, stats: dict):
+    """Expose the token accounting of the prompt that was sent"""
+    http_response.headers["X-Prompt-Tokens"] = str(stats["prompt_tokens"])
+    http_response.headers["X-Prompt-Token-Budget"] = str(stats["budget"])
+    http_response.headers["X-Prompt-Input-Tokens"] = str(stats["input_tokens"])
+    http_response.headers["X-Prompt-Sections-Kept"] = f"{stats['sections_kept']}/{stats['sections_total']}"
+    if stats.get("model"):
+        http_response.headers["X-Analysis-Model"] = stats["model"]
+
+# Shared guard around OpenAI calls; every handler goes through openai_chat.create()
+# (embeddings through openai_embeddings.embed(), which has its own limits and breaker).
+# Requests and tokens per minute are rate limited per instance, retryable errors
+# (429, 5xx, timeouts, connection errors) are retried with jittered exponential
+# backoff, and a circuit breaker fails fast with 503 + Retry-After while OpenAI
+# is unhealthy instead of piling more requests onto it.
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "150000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_BACKOFF_BASE_SECONDS = float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5"))
+OPENAI_BACKOFF_MAX_SECONDS = float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "20"))
+OPENAI_MAX_QUEUE_SECONDS = float(os.getenv("OPENAI_MAX_QUEUE_SECONDS", "30"))
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+OPENAI_BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+OPENAI_UNAVAILABLE_MESSAGE = "The analysis service is temporarily overloaded. Please try again shortly."
+
+class CircuitBreaker:
+    """Fails fast while a dependency is unhealthy.
+
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_seconds, then lets a single trial call through (half-open); the trial's
+    outcome closes the circuit again or reopens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if self.retry_after() > 0 else "half_open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(self.opened_at + self.reset_seconds - time.monotonic(), 0)
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.retry_after() > 0 or self.trial_in_flight:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f"DEBUG: Circuit breaker opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """The call ended without telling us anything about the dependency (e.g. cancelled)"""
+        self.trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, "retry_after": round(self.retry_after(), 1)}
+
+class ResilientOpenAI:
+    """Wraps an AsyncOpenAI client's chat completions with rate limits, retries and a circuit breaker"""
+
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APITimeoutError, openai.APIConnectionError)
+
+    def __init__(self, client: AsyncOpenAI, requests_per_minute: float = OPENAI_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = OPENAI_TOKENS_PER_MINUTE, max_retries: int = OPENAI_MAX_RETRIES,
+                 timeout_seconds: float = OPENAI_TIMEOUT_SECONDS, backoff_base: float = OPENAI_BACKOFF_BASE_SECONDS,
+                 backoff_max: float = OPENAI_BACKOFF_MAX_SECONDS, max_queue_seconds: float = OPENAI_MAX_QUEUE_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.client = client
+        # A limit of 0 disables that bucket; each bucket allows up to a minute's worth of burst
+        self.request_bucket = TokenBucket(requests_per_minute / 60, requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_retries = max_retries
+        self.timeout_seconds = timeout_seconds
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_queue_seconds = max_queue_seconds
+        self.breaker = breaker or CircuitBreaker(OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET_SECONDS)
+        self.counters = {"calls": 0, "retries": 0, "rejected": 0, "failed": 0}
+
+    def unavailable(self, retry_after: float) -> HTTPException:
+        self.counters["rejected"] += 1
+        return HTTPException(
+            status_code=503,
+            detail=OPENAI_UNAVAILABLE_MESSAGE,
+            headers={"Retry-After": str(max(int(retry_after + 0.999), 1))}
+        )
+
+    def estimate_tokens(self, kwargs: dict) -> int:
+        """Prompt plus the completion allowance, which is what OpenAI counts against the limit"""
+        prompt_tokens = sum(count_tokens(message.get("content") or "") for message in kwargs.get("messages", []))
+        return prompt_tokens + (kwargs.get("max_tokens") or 0)
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Full-jitter exponential backoff, but never sooner than the server's Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                if response.headers.get("retry-after-ms"):
+                    delay = max(delay, float(response.headers["retry-after-ms"]) / 1000)
+                elif response.headers.get("retry-after"):
+                    delay = max(delay, float(response.headers["retry-after"]))
+            except ValueError:
+                pass
+        return min(delay, self.backoff_max)
+
+    async def wait_for_capacity(self, tokens: int):
+        try:
+            if self.request_bucket:
+                await asyncio.wait_for(self.request_bucket.acquire(), self.max_queue_seconds)
+            if self.token_bucket:
+                tokens = min(tokens, self.token_bucket.capacity)
+                await asyncio.wait_for(self.token_bucket.acquire(tokens), self.max_queue_seconds)
+        except asyncio.TimeoutError:
+            print("DEBUG: OpenAI rate limit queue is full, rejecting call")
+            raise self.unavailable(self.max_queue_seconds)
+
+    async def create(self, max_retries: Optional[int] = None, **kwargs):
+        """chat.completions.create() with the same arguments; raises HTTPException(503) when OpenAI is unavailable"""
+        tokens = self.estimate_tokens(kwargs) if self.token_bucket else 0
+        return await self.call(self.client.chat.completions.create, tokens, max_retries, kwargs)
+
+    async def embed(self, max_retries: Optional[int] = None, **kwargs):
+        """embeddings.create() with the same arguments and the same guards as create()"""
+        tokens = sum(count_tokens(text) for text in kwargs.get("input", [])) if self.token_bucket else 0
+        return await self.call(self.client.embeddings.create, tokens, max_retries, kwargs)
+
+    async def call(self, method, tokens: int, max_retries: Optional[int], kwargs: dict):
+        max_retries = self.max_retries if max_retries is None else max_retries
+        kwargs.setdefault("timeout", self.timeout_seconds)
+        for attempt in range(max_retries + 1):
+            if not self.breaker.allow():
+                raise self.unavailable(self.breaker.retry_after())
+            try:
+                # Inside the try so a queue timeout or cancellation releases a half-open trial slot
+                await self.wait_for_capacity(tokens)
+                self.counters["calls"] += 1
+                response = await method(**kwargs)
+            except self.RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                delay = self.backoff(attempt, e)
+                if attempt == max_retries or self.breaker.state == "open":
+                    self.counters["failed"] += 1
+                    print(f"DEBUG: OpenAI call failed after {attempt + 1} attempts: {e}")
+                    raise self.unavailable(max(delay, self.breaker.retry_after())) from e
+                self.counters["retries"] += 1
+                print(f"DEBUG: OpenAI call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except openai.APIStatusError:
+                # A 4xx means OpenAI is up and rejected this request; don't retry it
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                self.breaker.abandon()
+                raise
+            self.breaker.record_success()
+            return response
+
+    def stats(self) -> dict:
+        return {**self.counters, "circuit_breaker": self.breaker.stats()}
+
+openai_chat = ResilientOpenAI(openai_client)
+# OpenAI rate limits embedding models separately from chat models, so embeddings get their own
+# buckets, and a breaker of their own so an embeddings outage doesn't fail analyses
+openai_embeddings = ResilientOpenAI(
+    openai_client,
+    requests_per_minute=float(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "500")),
+    tokens_per_minute=float(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "500000")),
+    breaker=CircuitBreaker(OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET_SECONDS)
+)
 
 class JournalRequest(BaseModel):
     journalEntry: str
@@ -167,19 +718,256 @@ class UpdateTierRequest(BaseModel):
     userEmail: str
     tier: str
 
+# Optional write-behind for /record-thought (WRITE_BEHIND_ENABLED=true).
+# The request is accepted once it is in memory; journal rows are flushed as one
+# multi-row insert and usage as aggregated per-user deltas (apply_usage_deltas in
+# create_write_behind_schema.sql) when WRITE_BEHIND_MAX_BATCH rows are pending or
+# every WRITE_BEHIND_FLUSH_SECONDS. Quota is checked against the cached usage plus
+# this instance's unflushed deltas, so with several instances a user can overshoot
+# by what other instances accepted within TIER_CACHE_TTL_SECONDS.
+# Without a spool, rows accepted but not yet flushed are lost if the process dies;
+# WRITE_BEHIND_SPOOL_PATH appends each accepted row to a local file that is replayed
+# on startup (at-least-once). Pending writes are flushed on shutdown.
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "100"))
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "0.5"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "5000"))
+WRITE_BEHIND_SPOOL_PATH = os.getenv("WRITE_BEHIND_SPOOL_PATH")
+
+class WriteBehindBuffer:
+    """Buffers journal inserts and usage deltas and writes them in batches.
+
+    Durability hooks, all optional:
+      on_accept(entry, usage_key)  awaited before a write is acknowledged
+      on_flushed(entries, deltas)  called after a batch has been written
+      on_failure(entries, deltas, error)  called when a flush fails; the batch is requeued
+    """
+
+    def __init__(self, max_batch: int = WRITE_BEHIND_MAX_BATCH, flush_seconds: float = WRITE_BEHIND_FLUSH_SECONDS,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING, on_accept=None, on_flushed=None, on_failure=None):
+        self.max_batch = max_batch
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.on_accept = on_accept
+        self.on_flushed = on_flushed
+        self.on_failure = on_failure
+        self.entries: List[dict] = []
+        self.deltas: Dict[tuple, int] = {}
+        # Deltas swapped out by a running flush still count until the cache reflects them
+        self.inflight_deltas: Dict[tuple, int] = {}
+        # Rows swapped out by a running flush, so reads still wait for them (read-your-writes)
+        self.inflight_entries: List[dict] = []
+        # Rows whose on_accept hook is still running; they count against quota and max_pending
+        self.accepting: Dict[tuple, int] = {}
+        self.accepting_rows = 0
+        self.flush_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.task: Optional[asyncio.Task] = None
+        self.counters = {"accepted": 0, "flushes": 0, "rows_written": 0, "flush_failures": 0}
+
+    def pending_usage(self, user_email: str, period: str) -> int:
+        key = (user_email, period)
+        return self.deltas.get(key, 0) + self.inflight_deltas.get(key, 0) + self.accepting.get(key, 0)
+
+    def has_pending(self, user_email: str) -> bool:
+        return any(entry["user_email"] == user_email for entry in self.entries + self.inflight_entries)
+
+    async def accept(self, entry: dict, usage_key: Optional[tuple] = None):
+        """Queue one journal row (and one message of usage); raises 503 when the buffer is full"""
+        if len(self.entries) + self.accepting_rows >= self.max_pending:
+            raise HTTPException(status_code=503, detail="Too many pending writes, please retry shortly", headers={"Retry-After": "1"})
+        if self.on_accept:
+            # Hold the usage while the hook runs so concurrent quota checks still see it
+            self.accepting_rows += 1
+            if usage_key:
+                self.accepting[usage_key] = self.accepting.get(usage_key, 0) + 1
+            try:
+                await self.on_accept(entry, usage_key)
+            finally:
+                self.accepting_rows -= 1
+                if usage_key:
+                    self.accepting[usage_key] -= 1
+                    if not self.accepting[usage_key]:
+                        del self.accepting[usage_key]
+        self.enqueue(entry, usage_key)
+
+    def enqueue(self, entry: dict, usage_key: Optional[tuple] = None):
+        """Add a row to the buffer without the on_accept hook (used when replaying a spool)"""
+        self.entries.append(entry)
+        if usage_key:
+            self.deltas[usage_key] = self.deltas.get(usage_key, 0) + 1
+        self.counters["accepted"] += 1
+        if len(self.entries) >= self.max_batch:
+            self.wakeup.set()
+
+    async def flush(self):
+        """Write everything pending now; on failure the batch goes back to the front of the queue"""
+        async with self.flush_lock:
+            entries, self.entries = self.entries, []
+            deltas, self.deltas = self.deltas, {}
+            if not entries and not deltas:
+                return
+            self.inflight_deltas = deltas
+            self.inflight_entries = entries
+            written: List[dict] = []
+            try:
+                while entries:
+                    batch = entries[:self.max_batch]
+                    await run_query(supabase.table("journal_entries").insert(batch))
+                    # Drop written rows right away so a later failure doesn't requeue them
+                    entries = entries[self.max_batch:]
+                    written += batch
+                    self.counters["rows_written"] += len(batch)
+                if deltas:
+                    result = await run_query(supabase.rpc("apply_usage_deltas", {"p_deltas": [
+                        {"user_email": user_email, "period": period, "delta": delta}
+                        for (user_email, period), delta in deltas.items()
+                    ]}))
+                    # Write the new totals through so quota checks see them once inflight is cleared
+                    for row in result.data or []:
+                        if tier_cache.get(row["user_email"]) is not None:
+                            cache_tier_info({"user_email": row["user_email"], "messages_used_this_month": row["messages_used"], "current_month_year": row["period"]})
+                self.counters["flushes"] += 1
+                if self.on_flushed:
+                    self.on_flushed(written, deltas)
+            except Exception as e:
+                print(f"DEBUG: Write-behind flush failed, requeueing {len(entries)} rows: {e}")
+                self.counters["flush_failures"] += 1
+                self.requeue(entries, deltas)
+                if self.on_failure:
+                    self.on_failure(entries, deltas, e)
+            except BaseException:
+                # Cancelled mid-flush: keep the unwritten rows and the usage they carry
+                self.requeue(entries, deltas)
+                raise
+            finally:
+                self.inflight_deltas = {}
+                self.inflight_entries = []
+
+    def requeue(self, entries: List[dict], deltas: Dict[tuple, int]):
+        self.entries = entries + self.entries
+        for key, delta in deltas.items():
+            self.deltas[key] = self.deltas.get(key, 0) + delta
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self.stopping = False
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Let the flush loop finish its current batch, then write whatever is still pending"""
+        self.stopping = True
+        self.wakeup.set()
+        if self.task:
+            await self.task
+            self.task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending_rows": len(self.entries), "pending_users": len(self.deltas)}
+
+class WriteBehindSpool:
+    """Durability hooks that keep accepted-but-unflushed rows in a local JSONL file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.writing = 0
+
+    def append(self, line: str):
+        with self.lock, open(self.path, "a") as spool:
+            spool.write(line)
+
+    async def on_accept(self, entry: dict, usage_key: Optional[tuple]):
+        # File I/O runs on the thread pool, like run_query, so it doesn't stall the event loop
+        self.writing += 1
+        try:
+            await anyio.to_thread.run_sync(self.append, json.dumps({"entry": entry, "usage_key": usage_key}) + "\n")
+        finally:
+            self.writing -= 1
+
+    def on_flushed(self, entries: List[dict], deltas: Dict[tuple, int]):
+        # Only truncate once nothing is pending or being spooled, so the file always covers every unflushed row
+        if write_buffer is not None and not write_buffer.entries and not self.writing:
+            with self.lock:
+                open(self.path, "w").close()
+
+    def replay(self, buffer: WriteBehindBuffer) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        count = 0
+        with open(self.path) as spool:
+            for line in spool:
+                if line.strip():
+                    record = json.loads(line)
+                    buffer.enqueue(record["entry"], tuple(record["usage_key"]) if record["usage_key"] else None)
+                    count += 1
+        return count
+
+write_buffer: Optional[WriteBehindBuffer] = None
+
+@app.on_event("startup")
+async def start_write_buffer():
+    global write_buffer
+    if not WRITE_BEHIND_ENABLED:
+        return
+    spool = WriteBehindSpool(WRITE_BEHIND_SPOOL_PATH) if WRITE_BEHIND_SPOOL_PATH else None
+    write_buffer = WriteBehindBuffer(
+        on_accept=spool.on_accept if spool else None,
+        on_flushed=spool.on_flushed if spool else None
+    )
+    if spool:
+        replayed = spool.replay(write_buffer)
+        if replayed:
+            print(f"DEBUG: Replaying {replayed} spooled writes")
+    write_buffer.start()
+
+@app.on_event("shutdown")
+async def stop_write_buffer():
+    if write_buffer is not None:
+        await write_buffer.stop()
+
+async def flush_pending_writes(user_email: str):
+    """Read-your-writes: flush before reading a user's entries if any are still buffered"""
+    if write_buffer is not None and write_buffer.has_pending(user_email):
+        await write_buffer.flush()
+
+async def record_thought_write_behind(request: RecordThoughtRequest, journal_entry: dict):
+    tier_info = await get_or_create_user_tier(request.userEmail)
+    usage_key = (request.userEmail, tier_info["current_month_year"])
+    used = tier_info["messages_used_this_month"] + write_buffer.pending_usage(*usage_key)
+    if used >= tier_info["messages_limit"]:
+        return quota_exhausted_response(request.userEmail)
+    
+    entry = {**journal_entry, "created_at": datetime.now(timezone.utc).isoformat()}
+    await write_buffer.accept(entry, usage_key)
+    return {"message": "Thought recorded successfully", "entry": entry, "queued": True}
+
 @app.post("/record-thought")
 async def record_thought(request: RecordThoughtRequest):
     """Save a journal entry without analysis."""
-    # Check message limit before processing
-    can_send, tier_info = check_message_limit(request.userEmail)
-    if not can_send:
-        print(f"DEBUG: User {request.userEmail} has reached limit, returning 429 error")
-        from fastapi import Response
-        return Response(
-            content="You've exhausted your quota for the month. If you need more, upgrade your tier by sending an email request to mindsetosai@gmail.com",
-            status_code=429,
-            media_type="text/plain"
-        )
+    if write_buffer is not None:
+        journal_entry = {
+            "user_email": request.userEmail,
+            "journal_entry": request.journalEntry.strip(),
+            "user_goal": request.goal.strip() if request.goal and request.goal.strip() else None,
+            "emotion": request.emotion if request.emotion else None,
+        }
+        return await record_thought_write_behind(request, journal_entry)
+    
+    # Reserve quota up front; it is refunded below if the request fails
+    reservation = await reserve_message_quota(request.userEmail)
+    if not reservation.granted:
+        return quota_exhausted_response(request.userEmail)
     
     try:
         
@@ -190,40 +978,36 @@ async def record_thought(request: RecordThoughtRequest):
             "emotion": request.emotion if request.emotion else None,
         }
         
-        result = supabase.table("journal_entries").insert(journal_entry).execute()
+        result = await run_query(supabase.table("journal_entries").insert(journal_entry))
         
         if result.data:
-            # Increment message count after successful recording
-            increment_message_count(request.userEmail)
             return {"message": "Thought recorded successfully", "entry": result.data[0]}
         else:
             raise HTTPException(status_code=500, detail="Failed to record thought")
             
     except HTTPException:
+        await reservation.refund()
         # Re-raise HTTPExceptions (like 429) without modification
         raise
     except Exception as e:
         print(f"DEBUG: Error recording thought: {e}")
+        await reservation.refund()
         raise HTTPException(status_code=500, detail=f"Failed to record thought: {str(e)}")
 
-@app.post("/analyze-journal", response_model=AnalysisResponse)
-async def analyze_journal(request: JournalRequest):
-    # Check message limit before processing
-    can_send, tier_info = check_message_limit(request.userEmail)
-    if not can_send:
-        print(f"DEBUG: User {request.userEmail} has reached limit, returning 429 error")
-        from fastapi import Response
-        return Response(
-            content="You've exhausted your quota for the month. If you need more, upgrade your tier by sending an email request to mindsetosai@gmail.com",
-            status_code=429,
-            media_type="text/plain"
-        )
+JOURNAL_SYSTEM_PROMPT = "You are a helpful mindset coach. Always respond with valid JSON."
+# Bump JOURNAL_PROMPT_VERSION whenever the journal prompt changes so cached analyses are not reused
+JOURNAL_PROMPT_VERSION = "journal-v1"
+JOURNAL_ANALYSIS_MODEL = "gpt-4o"
+JOURNAL_FAST_MODEL = os.getenv("JOURNAL_FAST_MODEL", "gpt-4o-mini")
+JOURNAL_GOAL_MAX_TOKENS = 200
+
+def build_journal_prompt(journal_entry: str, user_goal: str = "", tier: str = "free") -> tuple[str, dict]:
+    """Craft the mindset coaching prompt, shortening the entry to fit the tier's token budget"""
+    user_goal = truncate_to_tokens(user_goal, JOURNAL_GOAL_MAX_TOKENS) if user_goal else ""
+    goal_context = f"The user's primary goal is \"{user_goal}\". " if user_goal else ""
     
-    try:
-        # Craft the mindset coaching prompt
-        goal_context = f"The user's primary goal is \"{request.userGoal}\". " if request.userGoal else ""
-        
-        prompt = f"""You are a world-class mindset coach specializing in cognitive reframing. {goal_context}
+    def render(entry_text: str) -> str:
+        return f"""You are a world-class mindset coach specializing in cognitive reframing. {goal_context}
 
 Analyze the following journal entry and provide insights in this exact JSON format:
 
@@ -233,124 +1017,1590 @@ Analyze the following journal entry and provide insights in this exact JSON form
   "reframingExercise": "Provide ONE simple, actionable reframing exercise they can do right now (be specific and practical)"
 }}
 
-Journal Entry: "{request.journalEntry}"
+Journal Entry: "{entry_text}"
 
 Speak in a supportive and empowering tone. Focus on actionable insights. Be encouraging but honest."""
+    
+    budget = get_prompt_budget("analyze_journal", tier)
+    overhead = count_tokens(render("")) + count_tokens(JOURNAL_SYSTEM_PROMPT)
+    entry_budget = max(budget - overhead, 1)
+    sections, stats = fit_sections_to_budget([journal_entry], entry_budget, max_section_tokens=entry_budget)
+    prompt = render(sections[0])
+    stats["budget"] = budget
+    stats["prompt_tokens"] = count_tokens(prompt) + count_tokens(JOURNAL_SYSTEM_PROMPT)
+    return prompt, stats
 
-        # Call OpenAI API
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful mindset coach. Always respond with valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500
+# Content-addressed cache of journal analyses, so resubmitting the same entry
+# (frontend retries, double clicks, light edits) doesn't call the model again.
+# Entries live in memory per instance and, optionally, in the analysis_cache table.
+# Hits don't use up quota unless ANALYSIS_CACHE_CHARGES_QUOTA=true.
+analysis_cache = TTLCache(
+    maxsize=int(os.getenv("ANALYSIS_CACHE_MAX_SIZE", "5000")),
+    ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+)
+ANALYSIS_CACHE_TABLE_ENABLED = os.getenv("ANALYSIS_CACHE_TABLE_ENABLED", "false").lower() == "true"
+ANALYSIS_CACHE_CHARGES_QUOTA = os.getenv("ANALYSIS_CACHE_CHARGES_QUOTA", "false").lower() == "true"
+analysis_cache_table_stats = {"hits": 0, "misses": 0}
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of user text used for cache keys"""
+    return " ".join(text.split()).lower()
+
+def analysis_cache_key(journal_entry: str, user_goal: str = "", model: str = JOURNAL_ANALYSIS_MODEL, tier: str = "free") -> str:
+    # The tier is part of the key because its prompt budget decides how much of the entry is sent
+    payload = json.dumps([normalize_text(journal_entry), normalize_text(user_goal or ""), JOURNAL_PROMPT_VERSION, model, tier])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+async def get_cached_analysis(cache_key: str) -> Optional[AnalysisResponse]:
+    """Look the analysis up in memory, then in the analysis_cache table if enabled"""
+    cached = analysis_cache.get(cache_key)
+    if cached is not None or not ANALYSIS_CACHE_TABLE_ENABLED:
+        return cached
+    
+    try:
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=analysis_cache.ttl_seconds)).isoformat()
+        result = await run_query(
+            supabase.table("analysis_cache").select("analysis")
+            .eq("cache_key", cache_key).gte("created_at", cutoff).limit(1)
         )
-        
-        # Parse the response
-        analysis_text = response.choices[0].message.content
-        print(f"DEBUG: AI response: {analysis_text}")  # Debug logging
-        
-        # Try to extract JSON from the response
+        if not result.data:
+            analysis_cache_table_stats["misses"] += 1
+            return None
+        analysis_cache_table_stats["hits"] += 1
+        cached = AnalysisResponse(**result.data[0]["analysis"])
+        analysis_cache.set(cache_key, cached)
+        return cached
+    except Exception as e:
+        print(f"DEBUG: Error reading analysis cache table: {e}")
+        return None
+
+async def store_cached_analysis(cache_key: str, analysis_response: AnalysisResponse, model: str = JOURNAL_ANALYSIS_MODEL):
+    analysis_cache.set(cache_key, analysis_response)
+    if not ANALYSIS_CACHE_TABLE_ENABLED:
+        return
+    try:
+        await run_query(supabase.table("analysis_cache").upsert({
+            "cache_key": cache_key,
+            "analysis": dict(analysis_response),
+            "model": model,
+            "prompt_version": JOURNAL_PROMPT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }, on_conflict="cache_key"))
+    except Exception as e:
+        print(f"DEBUG: Error writing analysis cache table: {e}")
+
+def analysis_cache_stats() -> dict:
+    return {
+        "memory": analysis_cache.stats(),
+        "table_enabled": ANALYSIS_CACHE_TABLE_ENABLED,
+        "table": dict(analysis_cache_table_stats),
+        "hits_charge_quota": ANALYSIS_CACHE_CHARGES_QUOTA
+    }
+
+# Model routing for journal analysis. A routing policy orders the candidate models
+# for each entry; generate_journal_analysis tries them in turn, falling back to the
+# next one when a model times out or returns JSON that doesn't parse. Every attempt
+# is recorded in model_route_stats (and optionally the model_route_log table) so
+# the policy can be tuned. Pick the policy with JOURNAL_ROUTING_POLICY.
+JOURNAL_ROUTER_SHORT_ENTRY_TOKENS = int(os.getenv("JOURNAL_ROUTER_SHORT_ENTRY_TOKENS", "150"))
+JOURNAL_ROUTER_LATENCY_BUDGET_SECONDS = float(os.getenv("JOURNAL_ROUTER_LATENCY_BUDGET_SECONDS", "8"))
+JOURNAL_ROUTER_LATENCY_WINDOW_SECONDS = float(os.getenv("JOURNAL_ROUTER_LATENCY_WINDOW_SECONDS", "300"))
+JOURNAL_FALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOURNAL_FALLBACK_TIMEOUT_SECONDS", "20"))
+MODEL_ROUTE_LOG_TABLE_ENABLED = os.getenv("MODEL_ROUTE_LOG_TABLE_ENABLED", "false").lower() == "true"
+
+class ModelRouteStats:
+    """Per-model call counts and an exponentially weighted moving average of latency.
+
+    A latency not refreshed within window_seconds is ignored, so a model that was
+    demoted for being slow gets tried first again once the window has passed.
+    """
+
+    def __init__(self, alpha: float = 0.2, window_seconds: float = JOURNAL_ROUTER_LATENCY_WINDOW_SECONDS):
+        self.alpha = alpha
+        self.window_seconds = window_seconds
+        self.models: Dict[str, dict] = {}
+        self.updated_at: Dict[str, float] = {}
+
+    def record(self, model: str, latency: float, outcome: str):
+        stats = self.models.setdefault(model, {"calls": 0, "ok": 0, "unavailable": 0, "invalid_json": 0, "ewma_latency": None})
+        stats["calls"] += 1
+        stats[outcome] += 1
+        # Fast rejections (rate limit queue, open circuit) say nothing about the model's latency
+        if outcome == "unavailable" and latency < JOURNAL_FALLBACK_TIMEOUT_SECONDS:
+            return
+        if stats["ewma_latency"] is None or self.latency(model) is None:
+            stats["ewma_latency"] = latency
+        else:
+            stats["ewma_latency"] += self.alpha * (latency - stats["ewma_latency"])
+        self.updated_at[model] = time.monotonic()
+
+    def latency(self, model: str) -> Optional[float]:
+        if time.monotonic() - self.updated_at.get(model, float("-inf")) > self.window_seconds:
+            return None
+        return self.models[model]["ewma_latency"]
+
+    def stats(self) -> dict:
+        return {
+            model: {**stats, "ewma_latency": round(stats["ewma_latency"], 3) if stats["ewma_latency"] is not None else None}
+            for model, stats in self.models.items()
+        }
+
+model_route_stats = ModelRouteStats()
+
+class RoutingPolicy(ABC):
+    """Orders the (model, max_tokens) candidates for one journal analysis, first choice first"""
+    name = "base"
+
+    @abstractmethod
+    def route(self, entry_tokens: int, tier: str) -> List[tuple[str, int]]:
+        ...
+
+class FixedRoutingPolicy(RoutingPolicy):
+    """Always the default model, no fallback (the behaviour before routing)"""
+    name = "fixed"
+
+    def route(self, entry_tokens: int, tier: str) -> List[tuple[str, int]]:
+        return [(JOURNAL_ANALYSIS_MODEL, 500)]
+
+class LengthTierRoutingPolicy(RoutingPolicy):
+    """Short free-tier entries go to the fast model first; everything else to the default model.
+
+    A model whose recent latency is over JOURNAL_ROUTER_LATENCY_BUDGET_SECONDS is
+    moved behind the other candidate until it speeds up again.
+    """
+    name = "length_tier"
+
+    def route(self, entry_tokens: int, tier: str) -> List[tuple[str, int]]:
+        if entry_tokens <= JOURNAL_ROUTER_SHORT_ENTRY_TOKENS and tier != "premium":
+            models, max_tokens = [JOURNAL_FAST_MODEL, JOURNAL_ANALYSIS_MODEL], 350
+        else:
+            models, max_tokens = [JOURNAL_ANALYSIS_MODEL, JOURNAL_FAST_MODEL], 500
+        models.sort(key=lambda model: (model_route_stats.latency(model) or 0) > JOURNAL_ROUTER_LATENCY_BUDGET_SECONDS)
+        return [(model, max_tokens) for model in models]
+
+JOURNAL_ROUTING_POLICIES = {policy.name: policy for policy in (FixedRoutingPolicy(), LengthTierRoutingPolicy())}
+journal_router: RoutingPolicy = JOURNAL_ROUTING_POLICIES[os.getenv("JOURNAL_ROUTING_POLICY", "length_tier")]
+background_tasks = set()
+
+def record_model_route(model: str, latency: float, outcome: str, entry_tokens: int, tier: str,
+                       fallback_from: Optional[str] = None, endpoint: str = "analyze_journal"):
+    """Record one model attempt in memory and, if enabled, in the model_route_log table"""
+    model_route_stats.record(model, latency, outcome)
+    print(f"DEBUG: Model route {journal_router.name}: {model} {outcome} in {latency:.2f}s (entry {entry_tokens} tokens, {tier})")
+    if not MODEL_ROUTE_LOG_TABLE_ENABLED:
+        return
+    
+    async def log():
         try:
-            analysis = json.loads(analysis_text)
-        except json.JSONDecodeError:
-            # Try to extract JSON if it's wrapped in markdown code blocks
-            if "```json" in analysis_text:
-                json_start = analysis_text.find("```json") + 7
-                json_end = analysis_text.find("```", json_start)
-                if json_end > json_start:
-                    analysis_text = analysis_text[json_start:json_end].strip()
-                    analysis = json.loads(analysis_text)
-                else:
-                    raise
-            else:
+            await run_query(supabase.table("model_route_log").insert({
+                "endpoint": endpoint,
+                "policy": journal_router.name,
+                "model": model,
+                "outcome": outcome,
+                "latency_ms": int(latency * 1000),
+                "entry_tokens": entry_tokens,
+                "tier": tier,
+                "fallback_from": fallback_from
+            }))
+        except Exception as e:
+            print(f"DEBUG: Error writing model route log: {e}")
+    
+    # Fire and forget so logging never adds to the request's latency
+    task = asyncio.create_task(log())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+def routed_analysis_cache_key(journal_entry: str, user_goal: str, tier: str) -> str:
+    """Cache key to look an analysis up under: the model this entry is routed to first at this tier.
+
+    Analyses are stored under the model that actually answered, so one produced by a
+    fallback model is only served when routing would pick that model first.
+    """
+    model = journal_router.route(count_tokens(journal_entry), tier)[0][0]
+    return analysis_cache_key(journal_entry, user_goal, model, tier)
+
+async def generate_journal_analysis(journal_entry: str, user_goal: str, tier: str) -> tuple[AnalysisResponse, dict]:
+    """Analyze one journal entry with the routed model; returns the analysis and prompt/model stats"""
+    prompt, prompt_stats = build_journal_prompt(journal_entry, user_goal, tier)
+    print(f"DEBUG: Journal prompt tokens: {prompt_stats}")
+    entry_tokens = count_tokens(journal_entry)
+    routes = journal_router.route(entry_tokens, tier)
+    
+    fallback_from = None
+    for index, (model, max_tokens) in enumerate(routes):
+        # Earlier candidates get a short timeout and no retries so a slow model falls back quickly
+        last = index == len(routes) - 1
+        options = {} if last else {"timeout": JOURNAL_FALLBACK_TIMEOUT_SECONDS, "max_retries": 0}
+        started = time.monotonic()
+        try:
+            response = await openai_chat.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": JOURNAL_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                max_tokens=max_tokens,
+                **options
+            )
+            
+            # Parse the response
+            analysis_text = response.choices[0].message.content
+            print(f"DEBUG: AI response: {analysis_text}")  # Debug logging
+            
+            # Try to extract JSON from the response
+            analysis = AnalysisResponse(**parse_json_response(analysis_text))
+        except (HTTPException, json.JSONDecodeError, ValidationError) as e:
+            outcome = "unavailable" if isinstance(e, HTTPException) else "invalid_json"
+            record_model_route(model, time.monotonic() - started, outcome, entry_tokens, tier, fallback_from)
+            if last:
                 raise
+            fallback_from = model
+            continue
         
-        analysis_response = AnalysisResponse(**analysis)
-        
-        # Save to Supabase database
-        journal_entry = {
-            "user_email": request.userEmail,
-            "journal_entry": request.journalEntry.strip(),
-            "user_goal": request.userGoal.strip() if request.userGoal.strip() else None,
-            "limiting_belief": analysis_response.limitingBelief,
-            "explanation": analysis_response.explanation,
-            "reframing_exercise": analysis_response.reframingExercise
-        }
-        
+        latency = time.monotonic() - started
+        record_model_route(model, latency, "ok", entry_tokens, tier, fallback_from)
+        prompt_stats.update(model=model, latency_ms=int(latency * 1000), fallback_from=fallback_from)
+        return analysis, prompt_stats
+
+def journal_analysis_row(user_email: str, journal_entry: str, user_goal: str, analysis_response: AnalysisResponse) -> dict:
+    """journal_entries row for an analyzed entry"""
+    return {
+        "user_email": user_email,
+        "journal_entry": journal_entry.strip(),
+        "user_goal": user_goal.strip() if user_goal and user_goal.strip() else None,
+        "limiting_belief": analysis_response.limitingBelief,
+        "explanation": analysis_response.explanation,
+        "reframing_exercise": analysis_response.reframingExercise
+    }
+
+# Semantic similarity over journal entries (create_entry_embeddings_schema.sql).
+# Each entry is embedded once and stored in journal_entry_embeddings, tagged with
+# the embedder's name so vectors from different models are never compared. A
+# user's vectors are loaded into an in-process index on first use. Entries with no
+# vector yet (saved before this feature existed, imported, or whose embedding
+# failed) are embedded by a background task started at that point, at most
+# EMBEDDING_BACKFILL_CONCURRENCY users at a time, so a request never waits on a
+# user's whole history; until it finishes they are missing from results.
+# Editing an entry's text re-embeds it.
+# EMBEDDER=hashing is a deterministic local embedder for tests and benchmarks.
+EMBEDDINGS_ENABLED = os.getenv("EMBEDDINGS_ENABLED", "false").lower() == "true"
+EMBEDDER = os.getenv("EMBEDDER", "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "256"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BACKFILL_CONCURRENCY = int(os.getenv("EMBEDDING_BACKFILL_CONCURRENCY", "2"))
+# Users with at least this many entries get an IVF index instead of exact search
+EMBEDDING_ANN_MIN_ENTRIES = int(os.getenv("EMBEDDING_ANN_MIN_ENTRIES", "5000"))
+EMBEDDING_ANN_PROBES = int(os.getenv("EMBEDDING_ANN_PROBES", "8"))
+SIMILAR_ENTRIES_DEFAULT = 5
+SIMILAR_ENTRIES_MAX = 20
+
+def embedding_text(entry: dict) -> str:
+    return "\n".join(part for part in (entry.get("user_goal"), entry.get("journal_entry")) if part)
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class Embedder(ABC):
+    """Turns texts into vectors. name is stored with every vector, so it must change with the model or size."""
+
+    name = "base"
+    dimensions = 0
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        ...
+
+class OpenAIEmbedder(Embedder):
+    def __init__(self, model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.model = model
+        self.dimensions = dimensions
+        self.name = f"{model}:{dimensions}"
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        response = await openai_embeddings.embed(model=self.model, input=texts, dimensions=self.dimensions)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+class HashingEmbedder(Embedder):
+    """Bag-of-words feature hashing: no API calls, same text always gives the same vector"""
+
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"hashing:{dimensions}"
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in re.findall(r"[a-z0-9']+", text.lower()):
+                digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vectors
+
+EMBEDDERS = {"openai": OpenAIEmbedder, "hashing": HashingEmbedder}
+embedder: Embedder = EMBEDDERS[EMBEDDER]()
+
+class UserVectorIndex:
+    """One user's entry vectors, searched by cosine similarity.
+
+    Exact (brute force) below ann_min_entries. At or above it, an IVF index is
+    built: k-means splits the vectors into ~sqrt(n) lists and a query only scans
+    the `probes` lists nearest to it, plus anything added since the last build.
+    """
+
+    def __init__(self, ann_min_entries: int = EMBEDDING_ANN_MIN_ENTRIES, probes: int = EMBEDDING_ANN_PROBES):
+        self.ann_min_entries = ann_min_entries
+        self.probes = probes
+        self.ids: List[str] = []
+        self.created_at: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        self.indexed = 0  # Vectors [0, indexed) are in the IVF lists; the rest are scanned exactly
+        # Deleted entries keep their slot until the index is reloaded, but never come back from search
+        self.removed: set = set()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, ids: List[str], created_at: List[str], vectors: np.ndarray):
+        """Add vectors; ids already present have their vector replaced (re-embedded after an edit)"""
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        fresh = []
+        for i, entry_id in enumerate(ids):
+            position = self.positions.get(entry_id)
+            if position is None:
+                self.removed.discard(entry_id)
+                fresh.append(i)
+            else:
+                # Stays in its IVF list until the next rebuild, which only costs some recall
+                self.vectors[position] = vectors[i]
+        if not fresh:
+            return
+        for i in fresh:
+            self.positions[ids[i]] = len(self.ids)
+            self.ids.append(ids[i])
+            self.created_at.append(created_at[i])
+        self.vectors = vectors[fresh] if not self.vectors.size else np.vstack([self.vectors, vectors[fresh]])
+        # Rebuild once the unindexed tail is a quarter of the index, so queries stay sublinear
+        if len(self.ids) >= self.ann_min_entries and len(self.ids) - self.indexed > max(self.indexed // 4, 0):
+            self.build_ivf()
+
+    def remove(self, ids: List[str]):
+        for entry_id in ids:
+            if self.positions.pop(entry_id, None) is not None:
+                self.removed.add(entry_id)
+
+    def vector(self, entry_id: str) -> Optional[np.ndarray]:
+        position = self.positions.get(entry_id)
+        return None if position is None else self.vectors[position]
+
+    def build_ivf(self, iterations: int = 10):
+        n = len(self.ids)
+        n_lists = max(int(np.sqrt(n)), 1)
+        rng = np.random.default_rng(0)
+        sample = self.vectors[rng.choice(n, min(n, n_lists * 40), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize_rows(centroids)
+        assignment = np.argmax(self.vectors @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+        self.indexed = n
+
+    def candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Positions worth scoring for this query; None means all of them"""
+        if self.centroids is None:
+            return None
+        nearest = np.argsort(self.centroids @ query)[::-1][:self.probes]
+        tail = np.arange(self.indexed, len(self.ids))
+        return np.concatenate([self.lists[c] for c in nearest] + [tail])
+
+    def search(self, query: np.ndarray, k: int, exclude: Optional[set] = None) -> List[tuple[str, float]]:
+        """Top-k (entry_id, cosine similarity), best first"""
+        if not self.positions:
+            return []
+        if self.removed:
+            exclude = (exclude or set()) | self.removed
+        query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        candidates = self.candidates(query)
+        scores = self.vectors @ query if candidates is None else self.vectors[candidates] @ query
+        # Take enough extra to still have k after dropping excluded ids
+        wanted = min(k + len(exclude or ()), len(scores))
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        top = top[np.argsort(-scores[top])]
+        positions = top if candidates is None else candidates[top]
+        hits = [(self.ids[p], float(scores[i])) for i, p in zip(top, positions)]
+        return [hit for hit in hits if not exclude or hit[0] not in exclude][:k]
+
+# Loaded indexes, per user; writes by this instance go through add_entry_embeddings(),
+# entries embedded by other instances show up once the TTL reloads the index
+embedding_indexes = TTLCache(
+    maxsize=int(os.getenv("EMBEDDING_INDEX_CACHE_USERS", "500")),
+    ttl_seconds=float(os.getenv("EMBEDDING_INDEX_TTL_SECONDS", "600"))
+)
+embedding_loads = SingleFlight()
+
+def embedding_unavailable() -> HTTPException:
+    return HTTPException(status_code=503, detail="Similarity search is not enabled")
+
+async def embed_and_store(user_email: str, entries: List[dict]) -> np.ndarray:
+    """Embed entries (dicts with id, created_at and text columns) in batches and store the vectors"""
+    vectors = []
+    for start in range(0, len(entries), EMBEDDING_BATCH_SIZE):
+        batch = entries[start:start + EMBEDDING_BATCH_SIZE]
+        batch_vectors = await embedder.embed([embedding_text(entry) for entry in batch])
+        await run_query(supabase.table("journal_entry_embeddings").upsert([{
+            "entry_id": str(entry["id"]),
+            "user_email": user_email,
+            "model": embedder.name,
+            "embedding": [round(float(x), 6) for x in vector]
+        } for entry, vector in zip(batch, batch_vectors)], on_conflict="entry_id,model"))
+        vectors.append(batch_vectors)
+    return np.vstack(vectors) if vectors else np.zeros((0, embedder.dimensions), dtype=np.float32)
+
+async def load_embedding_index(user_email: str) -> UserVectorIndex:
+    """Build a user's index from stored vectors; entries with none yet are embedded in the background"""
+    entries = []
+    async for page in iter_keyset_pages(
+        lambda: supabase.table("journal_entries").select("id, created_at").eq("user_email", user_email), page_size=1000
+    ):
+        entries.extend(page)
+    stored: Dict[str, list] = {}
+    async for page in iter_keyset_pages(
+        lambda: supabase.table("journal_entry_embeddings").select("id, created_at, entry_id, embedding")
+        .eq("user_email", user_email).eq("model", embedder.name), page_size=500
+    ):
+        stored.update((row["entry_id"], row["embedding"]) for row in page)
+    
+    index = UserVectorIndex()
+    # Vectors of deleted entries are skipped, so they never show up as neighbours
+    known = [entry for entry in entries if str(entry["id"]) in stored]
+    if known:
+        index.add([str(entry["id"]) for entry in known], [entry["created_at"] for entry in known],
+                  np.array([stored[str(entry["id"])] for entry in known], dtype=np.float32))
+    
+    missing_ids = [entry["id"] for entry in entries if str(entry["id"]) not in stored]
+    if missing_ids:
+        schedule_missing_embeddings(user_email, missing_ids)
+    return index
+
+# Users whose missing embeddings are being filled in, so a reload doesn't start a second run
+embedding_backfills: set = set()
+_embedding_backfill_limiter: Optional[asyncio.Semaphore] = None
+
+def schedule_missing_embeddings(user_email: str, entry_ids: list):
+    """Embed entries that have no vector yet in the background, adding them to the cached index"""
+    global _embedding_backfill_limiter
+    if user_email in embedding_backfills:
+        return
+    if _embedding_backfill_limiter is None:
+        _embedding_backfill_limiter = asyncio.Semaphore(EMBEDDING_BACKFILL_CONCURRENCY)
+    embedding_backfills.add(user_email)
+    async def embed():
         try:
-            result = supabase.table("journal_entries").insert(journal_entry).execute()
-            print(f"DEBUG: Saved to Supabase: {result.data}")
-        except Exception as db_error:
-            print(f"DEBUG: Failed to save to Supabase: {db_error}")
-            # Continue anyway - don't fail the analysis if database save fails
+            async with _embedding_backfill_limiter:
+                for start in range(0, len(entry_ids), 200):
+                    result = await run_query(
+                        supabase.table("journal_entries").select("id, created_at, user_goal, journal_entry")
+                        .in_("id", entry_ids[start:start + 200])
+                    )
+                    await add_entry_embeddings(user_email, result.data or [])
+            print(f"DEBUG: Embedded {len(entry_ids)} entries for {user_email}")
+        except Exception as e:
+            # The next index load retries whatever is still missing
+            print(f"DEBUG: Failed to embed missing entries for {user_email}: {e}")
+        finally:
+            embedding_backfills.discard(user_email)
+    task = asyncio.create_task(embed())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def get_embedding_index(user_email: str) -> UserVectorIndex:
+    index = embedding_indexes.get(user_email)
+    if index is None:
+        index, _ = await embedding_loads.do(("embedding_index", user_email), lambda: load_embedding_index(user_email))
+        embedding_indexes.set(user_email, index)
+    return index
+
+async def add_entry_embeddings(user_email: str, entries: List[dict]) -> np.ndarray:
+    """Embed newly saved entries and add them to the user's index if it is loaded"""
+    vectors = await embed_and_store(user_email, entries)
+    index = embedding_indexes.get(user_email)
+    if index is not None:
+        index.add([str(entry["id"]) for entry in entries], [entry["created_at"] for entry in entries], vectors)
+    return vectors
+
+async def drop_entry_embeddings(user_email: str, entry_ids: List[str]):
+    """Delete the stored vectors of deleted entries and take them out of the loaded index"""
+    if not EMBEDDINGS_ENABLED or not entry_ids:
+        return
+    index = embedding_indexes.get(user_email)
+    if index is not None:
+        index.remove(entry_ids)
+    try:
+        await run_query(supabase.table("journal_entry_embeddings").delete().in_("entry_id", entry_ids))
+    except Exception as e:
+        # load_embedding_index() skips vectors whose entry is gone, so this only leaves dead rows
+        print(f"DEBUG: Error deleting embeddings for {user_email}: {e}")
+
+def schedule_entry_embeddings(user_email: str, entries: List[dict], replace: bool = False):
+    """Embed saved entries in the background, so embedding never adds to request latency.
+
+    replace=True is for entries whose text changed: if re-embedding fails, the stale
+    vectors are deleted so the next index load embeds them again.
+    """
+    if not EMBEDDINGS_ENABLED or not entries:
+        return
+    async def embed():
+        try:
+            await add_entry_embeddings(user_email, entries)
+        except Exception as e:
+            # load_embedding_index() picks up entries that failed here
+            print(f"DEBUG: Failed to embed entries for {user_email}: {e}")
+            if replace:
+                try:
+                    await run_query(supabase.table("journal_entry_embeddings").delete()
+                                    .in_("entry_id", [str(entry["id"]) for entry in entries]))
+                    embedding_indexes.pop(user_email)
+                except Exception as db_error:
+                    print(f"DEBUG: Failed to drop stale embeddings for {user_email}: {db_error}")
+    task = asyncio.create_task(embed())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def find_similar_entries(user_email: str, query: np.ndarray, k: int, exclude: set, columns: str) -> List[dict]:
+    """Nearest entries to a query vector, best first, each with a similarity score"""
+    index = await get_embedding_index(user_email)
+    # Ask for a few extra in case some were deleted since the index was loaded
+    neighbours = index.search(query, k + 5, exclude)
+    if not neighbours:
+        return []
+    result = await run_query(
+        supabase.table("journal_entries").select(columns).eq("user_email", user_email)
+        .in_("id", [entry_id for entry_id, _ in neighbours])
+    )
+    rows = {str(row["id"]): row for row in result.data or []}
+    return [{**rows[entry_id], "similarity": round(score, 4)} for entry_id, score in neighbours if entry_id in rows][:k]
+
+async def save_journal_analysis(request: JournalRequest, analysis_response: AnalysisResponse) -> Optional[dict]:
+    """Store an analyzed entry; returns the saved row, or None if the save failed"""
+    journal_entry = journal_analysis_row(request.userEmail, request.journalEntry, request.userGoal, analysis_response)
+    
+    try:
+        result = await run_query(supabase.table("journal_entries").insert(journal_entry))
+        print(f"DEBUG: Saved to Supabase: {result.data}")
+        schedule_entry_embeddings(request.userEmail, result.data or [])
+        return result.data[0] if result.data else None
+    except Exception as db_error:
+        print(f"DEBUG: Failed to save to Supabase: {db_error}")
+        # Continue anyway - don't fail the analysis if database save fails
+        return None
+
+@app.post("/analyze-journal", response_model=AnalysisResponse)
+async def analyze_journal(request: JournalRequest, http_response: Response):
+    # Identical concurrent submissions from the same user share one analysis
+    tier = (await get_or_create_user_tier(request.userEmail))["tier"]
+    cache_key = routed_analysis_cache_key(request.journalEntry, request.userGoal, tier)
+    result, shared = await request_coalescer.do(
+        ("analyze_journal", request.userEmail, cache_key),
+        lambda: run_journal_analysis(request, http_response, cache_key)
+    )
+    if shared:
+        http_response.headers["X-Coalesced"] = "true"
+    return result
+
+async def run_journal_analysis(request: JournalRequest, http_response: Response, cache_key: str):
+    # Check the analysis cache before reserving, since hits are free by default
+    cached = await get_cached_analysis(cache_key)
+    http_response.headers["X-Analysis-Cache"] = "hit" if cached is not None else "miss"
+    if cached is not None and not ANALYSIS_CACHE_CHARGES_QUOTA:
+        await save_journal_analysis(request, cached)
+        return cached
+    
+    # Reserve quota up front; it is refunded below if the request fails
+    reservation = await reserve_message_quota(request.userEmail)
+    if not reservation.granted:
+        return quota_exhausted_response(request.userEmail)
+    if cached is not None:
+        await save_journal_analysis(request, cached)
+        return cached
+    
+    try:
+        tier = reservation.tier_info["tier"]
+        analysis_response, prompt_stats = await generate_journal_analysis(request.journalEntry, request.userGoal, tier)
+        set_prompt_token_headers(http_response, prompt_stats)
+        await store_cached_analysis(
+            analysis_cache_key(request.journalEntry, request.userGoal, prompt_stats["model"], tier),
+            analysis_response, prompt_stats["model"]
+        )
         
-        # Increment message count after successful analysis
-        increment_message_count(request.userEmail)
+        # Save to Supabase database
+        await save_journal_analysis(request, analysis_response)
         
         return analysis_response
         
     except HTTPException:
+        await reservation.refund()
         # Re-raise HTTPExceptions (like 429) without modification
         raise
     except json.JSONDecodeError:
+        await reservation.refund()
         raise HTTPException(status_code=500, detail="Failed to parse AI response")
     except Exception as e:
+        await reservation.refund()
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+class BatchJournalItem(BaseModel):
+    journalEntry: str
+    userGoal: str = ""
+
+class BatchJournalRequest(BaseModel):
+    userEmail: str
+    entries: List[BatchJournalItem]
+
+JOURNAL_BATCH_MAX_SIZE = int(os.getenv("JOURNAL_BATCH_MAX_SIZE", "50"))
+JOURNAL_BATCH_CONCURRENCY = int(os.getenv("JOURNAL_BATCH_CONCURRENCY", "5"))
+
+@app.post("/analyze-journal/batch")
+async def analyze_journal_batch(request: BatchJournalRequest):
+    """Analyze many journal entries in one call.
+
+    Model calls run concurrently (at most JOURNAL_BATCH_CONCURRENCY at a time),
+    quota for the whole batch is reserved up front in one round trip, and the
+    analyzed entries are saved with a single bulk insert. Each item gets its own
+    result or error; messages for failed items are refunded.
+    """
+    if not request.entries:
+        raise HTTPException(status_code=400, detail="No entries to analyze")
+    if len(request.entries) > JOURNAL_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {JOURNAL_BATCH_MAX_SIZE} entries per batch")
+    
+    # Identical entries in one batch share an analysis; cache hits are free by default
+    tier = (await get_or_create_user_tier(request.userEmail))["tier"]
+    keys = [routed_analysis_cache_key(item.journalEntry, item.userGoal, tier) for item in request.entries]
+    unique = {}
+    for key, item in zip(keys, request.entries):
+        unique.setdefault(key, item)
+    analyses = {}
+    for key in unique:
+        cached = await get_cached_analysis(key)
+        if cached is not None:
+            analyses[key] = cached
+    to_generate = [key for key in unique if key not in analyses]
+    charged = len(unique) if ANALYSIS_CACHE_CHARGES_QUOTA else len(to_generate)
+    
+    reservation = None
+    if charged:
+        reservation = await reserve_message_quota(request.userEmail, charged)
+        if not reservation.granted:
+            return quota_exhausted_response(request.userEmail)
+    tier = reservation.tier_info["tier"] if reservation else tier
+    
+    errors = {}
+    limiter = asyncio.Semaphore(JOURNAL_BATCH_CONCURRENCY)
+    
+    async def analyze(key: str):
+        item = unique[key]
+        async with limiter:
+            try:
+                analyses[key], stats = await generate_journal_analysis(item.journalEntry, item.userGoal, tier)
+                await store_cached_analysis(analysis_cache_key(item.journalEntry, item.userGoal, stats["model"], tier),
+                                            analyses[key], stats["model"])
+            except HTTPException as e:
+                errors[key] = e.detail
+            except json.JSONDecodeError:
+                errors[key] = "Failed to parse AI response"
+            except Exception as e:
+                print(f"DEBUG: Batch item analysis failed: {e}")
+                errors[key] = f"Analysis failed: {str(e)}"
+    
+    try:
+        await asyncio.gather(*[analyze(key) for key in to_generate])
+    except BaseException:
+        if reservation:
+            await reservation.refund()
+        raise
+    if reservation and errors:
+        await reservation.refund(len(errors))
+    
+    # Save every analyzed entry in one bulk insert
+    rows, saved_indexes = [], []
+    for index, (key, item) in enumerate(zip(keys, request.entries)):
+        if key in analyses:
+            rows.append(journal_analysis_row(request.userEmail, item.journalEntry, item.userGoal, analyses[key]))
+            saved_indexes.append(index)
+    saved = {}
+    if rows:
+        try:
+            result = await run_query(supabase.table("journal_entries").insert(rows))
+            saved = dict(zip(saved_indexes, result.data or []))
+            schedule_entry_embeddings(request.userEmail, result.data or [])
+        except Exception as db_error:
+            print(f"DEBUG: Failed to bulk save batch to Supabase: {db_error}")
+            # Continue anyway - don't fail the analyses if the database save fails
+    
+    results = []
+    for index, key in enumerate(keys):
+        if key in analyses:
+            results.append({
+                "index": index,
+                "status": "ok",
+                "analysis": dict(analyses[key]),
+                "entry_id": saved.get(index, {}).get("id")
+            })
+        else:
+            results.append({"index": index, "status": "error", "error": errors[key]})
+    
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    print(f"DEBUG: Batch for {request.userEmail}: {succeeded}/{len(results)} analyzed, {charged - len(errors)} message(s) charged")
+    return {
+        "results": results,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "messages_charged": charged - len(errors)
+    }
+
+# Backfill of entries saved by /record-thought without an analysis.
+# Walks unanalyzed rows oldest first in keyset chunks, analyzes them at a bounded
+# rate, writes each chunk back in one apply_journal_analyses call and checkpoints
+# the cursor in backfill_checkpoints so a restarted run resumes where it stopped.
+# See create_backfill_schema.sql. Run it with scripts/run_analysis_backfill.py,
+# POST /admin/backfill-analyses, or the in-app worker (BACKFILL_WORKER_ENABLED=true).
+# Backfilled analyses don't use quota: the entry was already counted when recorded.
+# Imported entries were not, so they are skipped (add_entry_imported_flag.sql).
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "50"))
+BACKFILL_RATE_PER_MINUTE = float(os.getenv("BACKFILL_RATE_PER_MINUTE", "60"))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "3"))
+BACKFILL_WORKER_ENABLED = os.getenv("BACKFILL_WORKER_ENABLED", "false").lower() == "true"
+BACKFILL_INTERVAL_SECONDS = int(os.getenv("BACKFILL_INTERVAL_SECONDS", "300"))
+BACKFILL_CHECKPOINT_NAME = "journal_analyses"
+BACKFILL_COLUMNS = "id, user_email, journal_entry, user_goal, created_at"
+
+backfill_status = {"running": False, "last_run": None}
+backfill_task: Optional[asyncio.Task] = None
+
+async def load_backfill_checkpoint(name: str) -> Optional[dict]:
+    try:
+        result = await run_query(supabase.table("backfill_checkpoints").select("*").eq("name", name))
+        return result.data[0] if result.data else None
+    except Exception as e:
+        print(f"DEBUG: Error loading backfill checkpoint: {e}")
+        return None
+
+async def save_backfill_checkpoint(name: str, cursor: Optional[tuple], processed: int, failed: int):
+    try:
+        await run_query(supabase.table("backfill_checkpoints").upsert({
+            "name": name,
+            "cursor_created_at": cursor[0] if cursor else None,
+            "cursor_id": str(cursor[1]) if cursor else None,
+            "processed": processed,
+            "failed": failed,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }, on_conflict="name"))
+    except Exception as e:
+        print(f"DEBUG: Error saving backfill checkpoint: {e}")
+
+async def run_analysis_backfill(
+    max_entries: Optional[int] = None,
+    rate_per_minute: float = BACKFILL_RATE_PER_MINUTE,
+    chunk_size: int = BACKFILL_CHUNK_SIZE,
+    restart: bool = False
+) -> dict:
+    """Analyze unanalyzed journal entries, resuming from the saved checkpoint unless restart is set"""
+    checkpoint = None if restart else await load_backfill_checkpoint(BACKFILL_CHECKPOINT_NAME)
+    cursor = None
+    processed = failed = 0
+    if checkpoint:
+        processed, failed = checkpoint.get("processed") or 0, checkpoint.get("failed") or 0
+        if checkpoint.get("cursor_created_at"):
+            cursor = (checkpoint["cursor_created_at"], checkpoint["cursor_id"])
+    
+    stats = {"analyzed": 0, "failed": 0, "written": 0, "started_at": datetime.now(timezone.utc).isoformat()}
+    rate_limiter = TokenBucket(rate_per_minute / 60, capacity=BACKFILL_CONCURRENCY)
+    limiter = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    
+    async def analyze(row: dict) -> Optional[dict]:
+        async with limiter:
+            await rate_limiter.acquire()
+            try:
+                analysis, _ = await generate_journal_analysis(row["journal_entry"], row.get("user_goal") or "", "free")
+                return {
+                    "id": row["id"],
+                    "limiting_belief": analysis.limitingBelief,
+                    "explanation": analysis.explanation,
+                    "reframing_exercise": analysis.reframingExercise
+                }
+            except HTTPException:
+                # OpenAI is unavailable; stop here so the chunk is retried from the checkpoint
+                raise
+            except Exception as e:
+                print(f"DEBUG: Backfill analysis failed for entry {row['id']}: {e}")
+                return None
+    
+    def build_query():
+        return (supabase.table("journal_entries").select(BACKFILL_COLUMNS)
+                .is_("limiting_belief", "null").is_("imported", "false"))
+    
+    async for rows in iter_keyset_pages(build_query, chunk_size, cursor, desc=False):
+        if max_entries is not None:
+            rows = rows[:max_entries - stats["analyzed"] - stats["failed"]]
+            if not rows:
+                break
+        updates = [update for update in await asyncio.gather(*[analyze(row) for row in rows]) if update]
+        if updates:
+            result = await run_query(supabase.rpc("apply_journal_analyses", {"p_rows": updates}))
+            stats["written"] += result.data[0]["updated"] if result.data else 0
+        stats["analyzed"] += len(updates)
+        stats["failed"] += len(rows) - len(updates)
+        
+        # Failed rows stay NULL but are skipped by the cursor; restart=True retries them
+        cursor = (rows[-1]["created_at"], rows[-1]["id"])
+        await save_backfill_checkpoint(
+            BACKFILL_CHECKPOINT_NAME, cursor, processed + stats["analyzed"], failed + stats["failed"]
+        )
+        print(f"DEBUG: Backfill progress: {stats}")
+        if max_entries is not None and stats["analyzed"] + stats["failed"] >= max_entries:
+            break
+    
+    stats["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return stats
+
+async def run_tracked_backfill(**kwargs) -> dict:
+    """run_analysis_backfill, recording progress in backfill_status for the admin endpoint"""
+    backfill_status["running"] = True
+    try:
+        stats = await run_analysis_backfill(**kwargs)
+        backfill_status["last_run"] = stats
+        return stats
+    except Exception as e:
+        print(f"DEBUG: Backfill failed: {e}")
+        backfill_status["last_run"] = {"error": str(e), "finished_at": datetime.now(timezone.utc).isoformat()}
+        raise
+    finally:
+        backfill_status["running"] = False
+
+async def backfill_worker():
+    """Periodically pick up entries recorded since the last pass"""
+    while True:
+        if not backfill_status["running"]:
+            try:
+                await run_tracked_backfill()
+            except Exception:
+                pass
+        await asyncio.sleep(BACKFILL_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_backfill_worker():
+    global backfill_task
+    if BACKFILL_WORKER_ENABLED:
+        backfill_task = asyncio.create_task(backfill_worker())
+
+@app.on_event("shutdown")
+async def stop_backfill_worker():
+    if backfill_task:
+        backfill_task.cancel()
+
+class BackfillRequest(BaseModel):
+    maxEntries: Optional[int] = None
+    ratePerMinute: float = BACKFILL_RATE_PER_MINUTE
+    restart: bool = False
+
+@app.post("/admin/backfill-analyses", status_code=202)
+async def start_analysis_backfill(request: BackfillRequest):
+    """Start a backfill pass in the background (one at a time per instance)"""
+    global backfill_task
+    if backfill_status["running"]:
+        raise HTTPException(status_code=409, detail="A backfill is already running")
+    if request.ratePerMinute <= 0:
+        raise HTTPException(status_code=400, detail="ratePerMinute must be positive")
+    if request.maxEntries is not None and request.maxEntries <= 0:
+        raise HTTPException(status_code=400, detail="maxEntries must be positive")
+    backfill_status["running"] = True
+    backfill_task = asyncio.create_task(run_tracked_backfill(
+        max_entries=request.maxEntries,
+        rate_per_minute=request.ratePerMinute,
+        restart=request.restart
+    ))
+    return {"message": "Backfill started"}
+
+@app.get("/admin/backfill-analyses")
+async def get_analysis_backfill_status():
+    """Progress of this instance's backfill and the shared checkpoint"""
+    return {
+        **backfill_status,
+        "checkpoint": await load_backfill_checkpoint(BACKFILL_CHECKPOINT_NAME)
+    }
+
+class IncrementalJSONFields:
+    """Pull top-level string fields out of a JSON object while it is still streaming in"""
+
+    def __init__(self, fields):
+        self.buffer = ""
+        self.pending = {
+            field: re.compile(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)"' % re.escape(field))
+            for field in fields
+        }
+
+    def feed(self, text: str) -> List[tuple[str, str]]:
+        """Add streamed text; return the (field, value) pairs that just became complete"""
+        self.buffer += text
+        completed = []
+        for field, pattern in list(self.pending.items()):
+            match = pattern.search(self.buffer)
+            if match:
+                completed.append((field, json.loads(f'"{match.group(1)}"')))
+                del self.pending[field]
+        return completed
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/analyze-journal/stream")
+async def analyze_journal_stream(request: JournalRequest):
+    """Streaming variant of /analyze-journal.
+
+    Sends server-sent events: "start" right away, one "field" event per analysis
+    field as soon as the model has finished writing it, then "done" with the full
+    analysis once it is saved (or "error"). Quota is refunded if the stream fails.
+    """
+    tier = (await get_or_create_user_tier(request.userEmail))["tier"]
+    cached = await get_cached_analysis(routed_analysis_cache_key(request.journalEntry, request.userGoal, tier))
+    if cached is None or ANALYSIS_CACHE_CHARGES_QUOTA:
+        # Reserve quota up front; it is refunded if the stream doesn't complete
+        reservation = await reserve_message_quota(request.userEmail)
+        if not reservation.granted:
+            return quota_exhausted_response(request.userEmail)
+    
+    sse_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if cached is not None:
+        async def generate_cached():
+            yield sse_event("start", {"prompt_tokens": 0, "cached": True})
+            for field, value in dict(cached).items():
+                yield sse_event("field", {"field": field, "value": value})
+            saved = await save_journal_analysis(request, cached)
+            yield sse_event("done", {"analysis": dict(cached), "entry_id": saved["id"] if saved else None})
+        
+        return StreamingResponse(generate_cached(), media_type="text/event-stream",
+                                 headers={**sse_headers, "X-Analysis-Cache": "hit"})
+    
+    tier = reservation.tier_info["tier"]
+    prompt, prompt_stats = build_journal_prompt(request.journalEntry, request.userGoal, tier)
+    # Output is already on its way to the client, so a stream can't fall back: use the first choice
+    entry_tokens = count_tokens(request.journalEntry)
+    model, max_tokens = journal_router.route(entry_tokens, tier)[0]
+    started = time.monotonic()
+    try:
+        stream = await openai_chat.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": JOURNAL_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True
+        )
+    except HTTPException:
+        await reservation.refund()
+        raise
+    except Exception as e:
+        await reservation.refund()
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    
+    async def generate():
+        completed = False
+        try:
+            yield sse_event("start", {"prompt_tokens": prompt_stats["prompt_tokens"]})
+            parser = IncrementalJSONFields(("limitingBelief", "explanation", "reframingExercise"))
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    for field, value in parser.feed(delta):
+                        yield sse_event("field", {"field": field, "value": value})
+            
+            print(f"DEBUG: AI streamed response: {parser.buffer}")
+            analysis_response = AnalysisResponse(**parse_json_response(parser.buffer))
+            record_model_route(model, time.monotonic() - started, "ok", entry_tokens, tier, endpoint="analyze_journal_stream")
+            await store_cached_analysis(analysis_cache_key(request.journalEntry, request.userGoal, model, tier),
+                                        analysis_response, model)
+            saved = await save_journal_analysis(request, analysis_response)
+            completed = True
+            yield sse_event("done", {"analysis": dict(analysis_response), "entry_id": saved["id"] if saved else None})
+        except json.JSONDecodeError:
+            record_model_route(model, time.monotonic() - started, "invalid_json", entry_tokens, tier, endpoint="analyze_journal_stream")
+            yield sse_event("error", {"detail": "Failed to parse AI response"})
+        except Exception as e:
+            print(f"DEBUG: Error streaming analysis: {e}")
+            yield sse_event("error", {"detail": f"Analysis failed: {str(e)}"})
+        finally:
+            if not completed:
+                # Also runs when the client disconnects, so shield it from cancellation
+                with anyio.CancelScope(shield=True):
+                    await stream.response.aclose()
+                    await reservation.refund()
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            **sse_headers,
+            "X-Analysis-Cache": "miss",
+            "X-Analysis-Model": model,
+            "X-Prompt-Tokens": str(prompt_stats["prompt_tokens"])
+        }
+    )
+
+HISTORY_PAGE_DEFAULT = 50
+HISTORY_PAGE_MAX = 100
+HISTORY_LIST_UNBOUNDED = os.getenv("HISTORY_LIST_UNBOUNDED", "false").lower() == "true"
+HISTORY_STREAM_BATCH = 200
+
+def format_history_entry(entry: dict) -> dict:
+    """Transform a journal_entries row to match the frontend expectations"""
+    # created_at is ISO 8601 (YYYY-MM-DD...), so the date can be sliced instead of parsed
+    created_at = entry["created_at"]
+    history_entry = {
+        "id": str(entry["id"]),
+        "date": f"{created_at[5:7]}/{created_at[8:10]}/{created_at[0:4]}",
+        "goal": entry["user_goal"],
+        "journalEntry": entry["journal_entry"],
+        "emotion": entry.get("emotion"),
+        "analysis": None
+    }
+    
+    if entry.get("limiting_belief"):
+        history_entry["analysis"] = {
+            "limitingBelief": entry["limiting_belief"],
+            "explanation": entry["explanation"],
+            "reframingExercise": entry["reframing_exercise"]
+        }
+    
+    return history_entry
+
+HISTORY_COLUMNS = "id, created_at, user_goal, journal_entry, emotion, limiting_belief, explanation, reframing_exercise"
+
+# Listings take ?summary=true to return only these columns; the full text and analysis are
+# then fetched per entry from the detail endpoints. preview and has_analysis are computed
+# fields from add_entry_summary_fields.sql (preview is the first 160 characters).
+ENTRY_SUMMARY_COLUMNS = "id, created_at, emotion, preview, has_analysis"
+PERSONALITY_SUMMARY_COLUMNS = "id, analysis_id, analysis_date, total_entries, preview"
+
+def format_history_summary(entry: dict) -> dict:
+    """Summary counterpart of format_history_entry"""
+    created_at = entry["created_at"]
+    return {
+        "id": str(entry["id"]),
+        "date": f"{created_at[5:7]}/{created_at[8:10]}/{created_at[0:4]}",
+        "emotion": entry.get("emotion"),
+        "preview": entry["preview"],
+        "hasAnalysis": entry["has_analysis"]
+    }
+
+def history_query(user_email: str, summary: bool = False):
+    columns = ENTRY_SUMMARY_COLUMNS if summary else HISTORY_COLUMNS
+    return supabase.table("journal_entries").select(columns).eq("user_email", user_email)
+
+@app.get("/user-history/{user_email}")
+async def get_user_history(user_email: str, http_response: Response, limit: int = HISTORY_PAGE_MAX,
+                           cursor: Optional[str] = None, summary: bool = False):
+    """Get journal history for a specific user, newest first.
+
+    Returns at most HISTORY_PAGE_MAX entries as a bare list; when there are more, the
+    X-Next-Cursor header holds the cursor to continue with (here or on /page).
+    HISTORY_LIST_UNBOUNDED=true restores the old everything-in-one-response behaviour.
+    """
+    format_entry = format_history_summary if summary else format_history_entry
+    try:
+        await flush_pending_writes(user_email)
+        if HISTORY_LIST_UNBOUNDED:
+            result = await run_query(history_query(user_email, summary).order("created_at", desc=True))
+            return [format_entry(entry) for entry in result.data]
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+        after = decode_cursor(cursor) if cursor else None
+        result = await run_query(keyset_page(history_query(user_email, summary), after, limit))
+        rows = result.data or []
+        if len(rows) == limit:
+            http_response.headers["X-Next-Cursor"] = encode_cursor(rows[-1])
+        return [format_entry(entry) for entry in rows]
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"DEBUG: Error fetching history: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch history: {str(e)}")
+
+@app.get("/user-history/{user_email}/page")
+async def get_user_history_page(user_email: str, limit: int = HISTORY_PAGE_DEFAULT, cursor: Optional[str] = None, summary: bool = False):
+    """Get one page of journal history, newest first. Pass next_cursor back to get the following page."""
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    after = decode_cursor(cursor) if cursor else None
+    format_entry = format_history_summary if summary else format_history_entry
+    try:
+        await flush_pending_writes(user_email)
+        result = await run_query(keyset_page(history_query(user_email, summary), after, limit))
+        rows = result.data or []
+        return {
+            "entries": [format_entry(entry) for entry in rows],
+            "next_cursor": encode_cursor(rows[-1]) if len(rows) == limit else None
+        }
+    except Exception as e:
+        print(f"DEBUG: Error fetching history page: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch history: {str(e)}")
 
-@app.get("/user-history/{user_email}")
-async def get_user_history(user_email: str):
-    """Get journal history for a specific user"""
-    try:
-        result = supabase.table("journal_entries").select("*").eq("user_email", user_email).order("created_at", desc=True).execute()
-        
-        # Transform the data to match the frontend expectations
-        history = []
-        for entry in result.data:
-            history_entry = {
-                "id": str(entry["id"]),
-                "date": datetime.fromisoformat(entry["created_at"].replace('Z', '+00:00')).strftime("%m/%d/%Y"),
-                "goal": entry["user_goal"],
-                "journalEntry": entry["journal_entry"],
-                "emotion": entry.get("emotion"),
-                "analysis": None
-            }
-            
-            if entry.get("limiting_belief"):
-                history_entry["analysis"] = {
-                    "limitingBelief": entry["limiting_belief"],
-                    "explanation": entry["explanation"],
-                    "reframingExercise": entry["reframing_exercise"]
-                }
-            
-            history.append(history_entry)
-        
-        return history
+@app.get("/user-history/{user_email}/stream")
+async def stream_user_history(user_email: str, summary: bool = False):
+    """Stream journal history as NDJSON (one entry per line, newest first) as pages arrive from Supabase"""
+    pages = iter_keyset_pages(lambda: history_query(user_email, summary), HISTORY_STREAM_BATCH)
+    format_entry = format_history_summary if summary else format_history_entry
+    try:
+        await flush_pending_writes(user_email)
+        # Fetch the first page up front so database errors still produce a 500
+        first_page = await anext(pages, [])
     except Exception as e:
-        print(f"DEBUG: Error fetching history: {e}")
+        print(f"DEBUG: Error streaming history: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch history: {str(e)}")
+    
+    async def generate():
+        for entry in first_page:
+            yield json.dumps(format_entry(entry)) + "\n"
+        try:
+            async for page in pages:
+                yield "".join(json.dumps(format_entry(entry)) + "\n" for entry in page)
+        except Exception as e:
+            print(f"DEBUG: Error streaming history: {e}")
+            yield json.dumps({"error": f"Failed to fetch history: {str(e)}"}) + "\n"
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@app.get("/user-history/{user_email}/{entry_id}")
+async def get_history_entry(user_email: str, entry_id: str):
+    """Full text and analysis of one history entry (the detail view for ?summary=true listings)"""
+    try:
+        result = await run_query(history_query(user_email).eq("id", entry_id))
+    except Exception as e:
+        print(f"DEBUG: Error fetching history entry: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch entry: {str(e)}")
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Entry not found")
+    return format_history_entry(result.data[0])
 
 @app.delete("/user-history/{user_email}/{entry_id}")
 async def delete_history_entry(user_email: str, entry_id: str):
     """Delete a specific history entry"""
     try:
-        result = supabase.table("journal_entries").delete().eq("id", entry_id).eq("user_email", user_email).execute()
+        result = await run_query(supabase.table("journal_entries").delete().eq("id", entry_id).eq("user_email", user_email))
         
         if result.data:
+            await drop_chunk_summaries(user_email, result.data)
+            await drop_entry_embeddings(user_email, [str(row["id"]) for row in result.data])
             return {"message": "Entry deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Entry not found or you don't have permission to delete it")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"DEBUG: Error deleting entry: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to delete entry: {str(e)}")
 
+# Full data export: every row is read in keyset pages and written out as it arrives,
+# so memory use doesn't grow with the size of the history
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+EXPORT_TABLES = {
+    "journal_entries": HISTORY_COLUMNS,
+    "personality_analyses": "id, analysis_id, created_at, analysis_date, total_entries, value_system, motivators, "
+                            "demotivators, emotional_triggers, mindset_blocks, growth_opportunities, overall_summary",
+}
+
+def export_pages(table: str, user_email: str):
+    """Oldest first, one page of rows per round trip"""
+    return iter_keyset_pages(
+        lambda: supabase.table(table).select(EXPORT_TABLES[table]).eq("user_email", user_email),
+        EXPORT_PAGE_SIZE, desc=False
+    )
+
+def csv_lines(rows: List[dict], columns: List[str], header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    for row in rows:
+        writer.writerow(["" if row.get(column) is None else row[column] for column in columns])
+    return buffer.getvalue()
+
+async def gzip_chunks(chunks):
+    """gzip an async stream of text chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes the gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk.encode())
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@app.get("/user/export/{user_email}")
+async def export_user_data(user_email: str, request: Request, format: str = "ndjson", table: Optional[str] = None):
+    """Download all of a user's journal entries and personality analyses, oldest first.
+
+    NDJSON has one object per line, tagged with its table. CSV holds one table
+    (journal_entries unless table= says otherwise). The body is gzipped when the
+    client sends Accept-Encoding: gzip.
+    """
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    if table is not None and table not in EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"table must be one of: {', '.join(EXPORT_TABLES)}")
+    tables = [table] if table else (["journal_entries"] if format == "csv" else list(EXPORT_TABLES))
+    
+    try:
+        await flush_pending_writes(user_email)
+        # Fetch the first page up front so database errors still produce a 500
+        pages = export_pages(tables[0], user_email)
+        first_page = await anext(pages, [])
+    except Exception as e:
+        print(f"DEBUG: Error exporting data: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to export data: {str(e)}")
+    
+    async def table_pages(i: int, name: str):
+        if i > 0:
+            async for page in export_pages(name, user_email):
+                yield page
+            return
+        if first_page:
+            yield first_page
+        async for page in pages:
+            yield page
+    
+    async def generate():
+        exported = 0
+        try:
+            for i, name in enumerate(tables):
+                columns = [column.strip() for column in EXPORT_TABLES[name].split(",")]
+                if format == "csv":
+                    yield csv_lines([], columns, header=True)
+                async for page in table_pages(i, name):
+                    exported += len(page)
+                    if format == "csv":
+                        yield csv_lines(page, columns)
+                    else:
+                        yield "".join(json.dumps({"table": name, **row}) + "\n" for row in page)
+            print(f"DEBUG: Exported {exported} rows for {user_email}")
+        except Exception as e:
+            print(f"DEBUG: Error exporting data after {exported} rows: {e}")
+            if format == "ndjson":
+                yield json.dumps({"error": f"Export incomplete: {str(e)}"}) + "\n"
+            # Abort the response (no final chunk, no gzip trailer) so the download fails visibly
+            raise
+    
+    filename = f"journal-export.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    body = generate()
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+# Bulk import for users moving from other journaling apps. The upload (NDJSON or CSV,
+# optionally gzipped) is read from the request stream and parsed as it arrives;
+# valid, non-duplicate rows are written in multi-row inserts of IMPORT_BATCH_SIZE.
+# Progress is kept in memory under import_id (pass your own to poll while uploading).
+# IMPORT_QUOTA_POLICY: "per_import" charges one message per upload, "per_entry" one
+# per imported entry (reserved a batch at a time), "free" charges nothing.
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "200"))
+IMPORT_MAX_ENTRIES = int(os.getenv("IMPORT_MAX_ENTRIES", "10000"))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+IMPORT_MAX_ENTRY_CHARS = int(os.getenv("IMPORT_MAX_ENTRY_CHARS", "20000"))
+IMPORT_MAX_ERRORS = 50
+IMPORT_QUOTA_POLICY = os.getenv("IMPORT_QUOTA_POLICY", "per_import")
+IMPORT_EMOTIONS = {"very_sad", "sad", "neutral", "happy", "very_happy"}
+# Accepted column names per journal_entries field, so exports from other apps need little editing
+IMPORT_FIELD_ALIASES = {
+    "journal_entry": ("journal_entry", "journalEntry", "entry", "text", "content"),
+    "user_goal": ("user_goal", "userGoal", "goal"),
+    "emotion": ("emotion", "mood"),
+    "created_at": ("created_at", "createdAt", "date"),
+    "limiting_belief": ("limiting_belief",),
+    "explanation": ("explanation",),
+    "reframing_exercise": ("reframing_exercise",),
+}
+
+import_progress = TTLCache(maxsize=1000, ttl_seconds=24 * 3600)
+
+def parse_import_timestamp(value: str) -> str:
+    """ISO date or datetime -> UTC ISO timestamp; naive values are taken as UTC"""
+    parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    parsed = parsed.astimezone(timezone.utc)
+    if parsed > datetime.now(timezone.utc) + timedelta(days=1):
+        raise ValueError("date is in the future")
+    return parsed.isoformat()
+
+def parse_import_row(user_email: str, raw: dict) -> dict:
+    """Map one uploaded record onto a journal_entries row; raises ValueError if it isn't valid"""
+    row = {"user_email": user_email, "imported": True}
+    for field, aliases in IMPORT_FIELD_ALIASES.items():
+        value = next((raw[alias] for alias in aliases if raw.get(alias) not in (None, "")), None)
+        row[field] = value.strip() if isinstance(value, str) else value
+    
+    if not isinstance(row["journal_entry"], str) or not row["journal_entry"]:
+        raise ValueError("missing journal entry text")
+    if len(row["journal_entry"]) > IMPORT_MAX_ENTRY_CHARS:
+        raise ValueError(f"entry is longer than {IMPORT_MAX_ENTRY_CHARS} characters")
+    if row["emotion"] is not None:
+        row["emotion"] = str(row["emotion"]).lower().replace(" ", "_")
+        if row["emotion"] not in IMPORT_EMOTIONS:
+            raise ValueError(f"unknown emotion; use one of: {', '.join(sorted(IMPORT_EMOTIONS))}")
+    if row["created_at"] is not None:
+        try:
+            row["created_at"] = parse_import_timestamp(str(row["created_at"]))
+        except ValueError as e:
+            raise ValueError(f"invalid date: {e}")
+    return row
+
+def import_dedupe_key(row: dict) -> tuple:
+    """(UTC day, or None if undated, md5 of the text); md5 matches content_hash in add_entry_content_hash.sql"""
+    return (row["created_at"] or "")[:10] or None, hashlib.md5(row["journal_entry"].encode()).hexdigest()
+
+async def load_existing_entry_keys(user_email: str) -> set:
+    keys = set()
+    async for page in iter_keyset_pages(
+        lambda: supabase.table("journal_entries").select("id, created_at, content_hash").eq("user_email", user_email),
+        page_size=1000
+    ):
+        for row in page:
+            keys.add((row["created_at"][:10], row["content_hash"]))
+            keys.add((None, row["content_hash"]))
+    return keys
+
+async def iter_upload_lines(request: Request):
+    """(line number, text) for each line of the request body, decoded as it streams in"""
+    decompressor = zlib.decompressobj(31) if "gzip" in request.headers.get("content-encoding", "") else None
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    received = 0
+    line_number = 0
+    pending = ""
+    async for chunk in request.stream():
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        received += len(chunk)
+        if received > IMPORT_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Uploads are limited to {IMPORT_MAX_BYTES // (1024 * 1024)} MB")
+        *lines, pending = (pending + decoder.decode(chunk)).split("\n")
+        for line in lines:
+            line_number += 1
+            yield line_number, line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield line_number + 1, pending.rstrip("\r")
+
+async def iter_upload_records(request: Request, format: str):
+    """(line number, dict or parse error) per record. CSV records can span lines inside quotes."""
+    lines = iter_upload_lines(request)
+    if format == "ndjson":
+        async for line_number, line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield line_number, record if isinstance(record, dict) else ValueError("line is not a JSON object")
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f"invalid JSON: {e.msg}")
+        return
+    
+    header = None
+    record, start = [], None
+    async for line_number, line in lines:
+        record.append(line)
+        start = start or line_number
+        text = "\n".join(record)
+        # An odd number of quotes means a quoted field continues on the next line
+        if text.count('"') % 2:
+            continue
+        record, record_start, start = [], start, None
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        yield record_start, dict(zip(header, values))
+    if record:
+        yield start, ValueError("unterminated quoted field")
+
+class ImportRun:
+    """Validates, dedupes, batches and inserts one upload, keeping progress in import_progress"""
+
+    def __init__(self, import_id: str, user_email: str, existing_keys: set):
+        self.user_email = user_email
+        self.existing_keys = existing_keys
+        self.batch: List[dict] = []
+        # Oldest written row, for rewind_after_import()
+        self.earliest_at: Optional[datetime] = None
+        self.progress = {
+            "import_id": import_id, "user_email": user_email, "status": "running",
+            "processed": 0, "imported": 0, "duplicates": 0, "invalid": 0, "errors": [],
+            "started_at": datetime.now(timezone.utc).isoformat(), "finished_at": None
+        }
+        import_progress.set(import_id, self.progress)
+
+    def error(self, line_number: int, message: str):
+        self.progress["invalid"] += 1
+        if len(self.progress["errors"]) < IMPORT_MAX_ERRORS:
+            self.progress["errors"].append({"line": line_number, "error": message})
+
+    def add(self, line_number: int, record) -> bool:
+        """Queue one record; returns True when a batch is ready to write"""
+        self.progress["processed"] += 1
+        if isinstance(record, Exception):
+            self.error(line_number, str(record))
+            return False
+        # Lines from our own NDJSON export that aren't journal entries
+        if record.get("table", "journal_entries") != "journal_entries":
+            self.progress["processed"] -= 1
+            return False
+        try:
+            row = parse_import_row(self.user_email, record)
+        except ValueError as e:
+            self.error(line_number, str(e))
+            return False
+        # Dated rows match the same text on the same day; undated rows match the same text on any day
+        key = import_dedupe_key(row)
+        if key in self.existing_keys:
+            self.progress["duplicates"] += 1
+            return False
+        self.existing_keys.add(key)
+        self.existing_keys.add((None, key[1]))
+        # Every row in a multi-row insert needs the same columns, so undated rows get "now" here
+        row["created_at"] = row["created_at"] or datetime.now(timezone.utc).isoformat()
+        self.batch.append(row)
+        return len(self.batch) >= IMPORT_BATCH_SIZE
+
+    async def flush(self) -> bool:
+        """Insert the queued rows, charging quota per IMPORT_QUOTA_POLICY; False once quota runs out"""
+        rows, self.batch = self.batch, []
+        if not rows:
+            return True
+        reservation = None
+        if IMPORT_QUOTA_POLICY == "per_entry":
+            reservation = await reserve_message_quota(self.user_email, len(rows))
+            if not reservation.granted:
+                # Import as many as the remaining quota covers, then stop
+                self.progress["status"] = "quota_exhausted"
+                tier_info = reservation.tier_info
+                rows = rows[:max(tier_info["messages_limit"] - tier_info["messages_used_this_month"], 0)]
+                reservation = await reserve_message_quota(self.user_email, len(rows)) if rows else None
+                if reservation is None or not reservation.granted:
+                    return False
+        try:
+            # No need to send the rows back
+            await run_query(supabase.table("journal_entries").insert(rows, returning=ReturnMethod.minimal))
+        except Exception:
+            if reservation is not None:
+                await reservation.refund()
+            raise
+        self.progress["imported"] += len(rows)
+        for row in rows:
+            created_at = datetime.fromisoformat(row["created_at"])
+            self.earliest_at = min(self.earliest_at or created_at, created_at)
+        print(f"DEBUG: Imported {self.progress['imported']} entries for {self.user_email}")
+        return self.progress["status"] != "quota_exhausted"
+
+async def rewind_after_import(run: ImportRun):
+    """Make backdated imported rows visible to this user's personality analysis.
+
+    Chunk summaries resume after the last stored chunk, so rows imported with an
+    older created_at would never be summarized. Drop this user's chunks from the
+    earliest imported row on; they are re-summarized with the imported rows on the
+    next analysis, which is charged as usual. The analysis backfill skips imported
+    rows, so its shared checkpoint is left alone.
+    """
+    if run.earliest_at is None:
+        return
+    await drop_chunk_summaries(run.user_email, [{"created_at": run.earliest_at.isoformat()}])
+    embedding_indexes.pop(run.user_email)
+
+@app.post("/user/import/{user_email}")
+async def import_user_entries(user_email: str, request: Request, format: str = "ndjson", import_id: Optional[str] = None):
+    """Import journal entries from an NDJSON or CSV upload (the raw request body).
+
+    Columns/keys: journal_entry (or entry, text, content), and optionally user_goal,
+    emotion, created_at (ISO date or datetime) and the analysis fields, so our own
+    export can be imported back. Entries already present (same text on the same
+    day) are skipped. Send Content-Encoding: gzip to upload compressed. Poll
+    GET /user/import/{user_email}/{import_id} for progress. Imported rows are
+    folded into the next personality analysis; the free analysis backfill skips
+    them, so entries imported without analysis fields stay unanalyzed.
+    """
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    import_id = import_id or str(uuid.uuid4())
+    
+    reservation = None
+    if IMPORT_QUOTA_POLICY == "per_import":
+        reservation = await reserve_message_quota(user_email)
+        if not reservation.granted:
+            return quota_exhausted_response(user_email)
+    
+    run = None
+    try:
+        await flush_pending_writes(user_email)
+        run = ImportRun(import_id, user_email, await load_existing_entry_keys(user_email))
+        async for line_number, record in iter_upload_records(request, format):
+            if run.progress["processed"] >= IMPORT_MAX_ENTRIES:
+                run.error(line_number, f"only the first {IMPORT_MAX_ENTRIES} entries of an upload are imported")
+                run.progress["status"] = "truncated"
+                break
+            if run.add(line_number, record) and not await run.flush():
+                break
+        if run.progress["status"] != "quota_exhausted":
+            await run.flush()
+    except HTTPException:
+        if run is not None:
+            await rewind_after_import(run)
+        if reservation is not None:
+            await reservation.refund()
+        raise
+    except Exception as e:
+        print(f"DEBUG: Error importing entries: {e}")
+        if run is not None:
+            await rewind_after_import(run)
+        progress = import_progress.get(import_id)
+        if progress is not None:
+            progress.update(status="failed", finished_at=datetime.now(timezone.utc).isoformat())
+        if reservation is not None and not (progress and progress["imported"]):
+            await reservation.refund()
+        imported = progress["imported"] if progress else 0
+        raise HTTPException(status_code=500, detail=f"Import failed after {imported} entries: {str(e)}")
+    
+    if reservation is not None and not run.progress["imported"]:
+        await reservation.refund()
+    await rewind_after_import(run)
+    if run.progress["status"] == "running":
+        run.progress["status"] = "done"
+    run.progress["finished_at"] = datetime.now(timezone.utc).isoformat()
+    return run.progress
+
+@app.get("/user/import/{user_email}/{import_id}")
+async def get_import_progress(user_email: str, import_id: str):
+    """Progress of an import started on this instance"""
+    progress = import_progress.get(import_id)
+    if progress is None or progress["user_email"] != user_email:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return progress
+
 @app.get("/user-tier/{user_email}", response_model=UserTierResponse)
 async def get_user_tier(user_email: str):
     """Get user's tier information and monthly message usage"""
     try:
-        tier_info = get_or_create_user_tier(user_email)
+        tier_info = await get_or_create_user_tier(user_email)
         return UserTierResponse(
             tier=tier_info["tier"],
             messages_used_this_month=tier_info["messages_used_this_month"],
@@ -362,6 +2612,92 @@ async def get_user_tier(user_email: str):
         print(f"DEBUG: Error getting user tier: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get user tier: {str(e)}")
 
+@app.get("/user-usage/{user_email}")
+async def get_user_usage(user_email: str, months: int = 12):
+    """Messages used per month, newest first; months with no usage are omitted"""
+    try:
+        result = await run_query(
+            supabase.table("message_usage").select("period, messages_used")
+            .eq("user_email", user_email).order("period", desc=True).limit(min(months, 120))
+        )
+        return {"usage": result.data or []}
+    except Exception as e:
+        print(f"DEBUG: Error getting usage history: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get usage history: {str(e)}")
+
+# Rows are read in pages of this many days (PostgREST caps a single response)
+USER_STATS_PAGE_DAYS = 1000
+
+def journal_streaks(active_days: List[str], today: str) -> tuple[int, int]:
+    """(current, longest) runs of consecutive active days, given ISO dates in ascending order.
+
+    The current streak is still alive if its last day is today or yesterday.
+    """
+    current = longest = run = 0
+    previous = None
+    for day in active_days:
+        date = datetime.fromisoformat(day).date()
+        run = run + 1 if previous is not None and (date - previous).days == 1 else 1
+        longest = max(longest, run)
+        previous = date
+    if previous is not None and (datetime.fromisoformat(today).date() - previous).days <= 1:
+        current = run
+    return current, longest
+
+@app.get("/user/stats/{user_email}")
+async def get_user_stats(user_email: str, days: int = 90):
+    """Totals, emotion counts, streaks and the last `days` of daily activity.
+
+    Served from the user_daily_stats rollup (create_user_daily_stats_schema.sql),
+    so the cost grows with the number of active days, not entries. Days are UTC.
+    """
+    days = max(1, min(days, 3660))
+    rows = []
+    try:
+        await flush_pending_writes(user_email)
+        last_day = None
+        while True:
+            query = (supabase.table("user_daily_stats").select("day, entries, analyzed, emotion_counts")
+                     .eq("user_email", user_email).gt("entries", 0).order("day"))
+            if last_day is not None:
+                query = query.gt("day", last_day)
+            page = (await run_query(query.limit(USER_STATS_PAGE_DAYS))).data or []
+            rows.extend(page)
+            if len(page) < USER_STATS_PAGE_DAYS:
+                break
+            last_day = page[-1]["day"]
+    except Exception as e:
+        print(f"DEBUG: Error getting user stats: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get stats: {str(e)}")
+    
+    emotion_counts: Dict[str, int] = {}
+    for row in rows:
+        for emotion, count in row["emotion_counts"].items():
+            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + count
+    today = datetime.now(timezone.utc).date()
+    current_streak, longest_streak = journal_streaks([row["day"] for row in rows], today.isoformat())
+    since = (today - timedelta(days=days - 1)).isoformat()
+    total_entries = sum(row["entries"] for row in rows)
+    analyzed_entries = sum(row["analyzed"] for row in rows)
+    
+    return {
+        "total_entries": total_entries,
+        "analyzed_entries": analyzed_entries,
+        "recorded_entries": total_entries - analyzed_entries,
+        "emotion_counts": emotion_counts,
+        "active_days": len(rows),
+        "current_streak": current_streak,
+        "longest_streak": longest_streak,
+        "first_entry_day": rows[0]["day"] if rows else None,
+        "last_entry_day": rows[-1]["day"] if rows else None,
+        "daily": [{
+            "date": row["day"],
+            "entries": row["entries"],
+            "analyzed": row["analyzed"],
+            "emotions": row["emotion_counts"]
+        } for row in rows if row["day"] >= since]
+    }
+
 @app.post("/update-tier")
 async def update_user_tier(request: UpdateTierRequest):
     """Update user's subscription tier"""
@@ -370,30 +2706,18 @@ async def update_user_tier(request: UpdateTierRequest):
         if request.tier not in ["free", "premium"]:
             raise HTTPException(status_code=400, detail="Invalid tier. Must be 'free' or 'premium'")
         
-        # Set appropriate message limits
-        # For testing: use 2 messages for free tier, 5 for premium
-        # For production: use 100 for free tier, 500 for premium
-        messages_limit = 100 if request.tier == "free" else 500
-        
-        # Update or create user tier
-        current_month = datetime.now().strftime("%Y-%m")
+        # Update or create user tier; clearing messages_limit makes the user follow the new tier's limit
         tier_data = {
             "user_email": request.userEmail,
             "tier": request.tier,
-            "messages_limit": messages_limit,
-            "current_month_year": current_month
+            "messages_limit": None
         }
-        
-        # Try to update existing record first
-        result = supabase.table("user_tiers").update(tier_data).eq("user_email", request.userEmail).execute()
-        
-        # If no existing record, create new one
-        if not result.data:
-            tier_data["messages_used_this_month"] = 0
-            result = supabase.table("user_tiers").insert(tier_data).execute()
+        result = await run_query(supabase.table("user_tiers").upsert(tier_data, on_conflict="user_email"))
         
         if result.data:
-            return {"message": f"Tier updated to {request.tier} successfully", "tier_info": result.data[0]}
+            # Usage lives in message_usage; re-read so the response carries this month's count
+            tier_cache.pop(request.userEmail)
+            return {"message": f"Tier updated to {request.tier} successfully", "tier_info": await get_or_create_user_tier(request.userEmail)}
         else:
             raise HTTPException(status_code=500, detail="Failed to update tier")
             
@@ -405,12 +2729,10 @@ async def update_user_tier(request: UpdateTierRequest):
 async def reset_user_messages(user_email: str):
     """TEST ENDPOINT: Reset user's message count to 0"""
     try:
-        result = supabase.table("user_tiers").update({
-            "messages_used_this_month": 0
-        }).eq("user_email", user_email).execute()
+        result = await run_query(supabase.rpc("set_message_usage", {"p_user_email": user_email, "p_count": 0}))
         
         if result.data:
-            return {"message": f"Reset messages for {user_email}", "tier_info": result.data[0]}
+            return {"message": f"Reset messages for {user_email}", "tier_info": cache_tier_info(result.data[0])}
         else:
             raise HTTPException(status_code=404, detail="User not found")
     except Exception as e:
@@ -421,12 +2743,10 @@ async def reset_user_messages(user_email: str):
 async def set_user_messages(user_email: str, count: int):
     """TEST ENDPOINT: Set user's message count to specific number"""
     try:
-        result = supabase.table("user_tiers").update({
-            "messages_used_this_month": count
-        }).eq("user_email", user_email).execute()
+        result = await run_query(supabase.rpc("set_message_usage", {"p_user_email": user_email, "p_count": count}))
         
         if result.data:
-            return {"message": f"Set messages to {count} for {user_email}", "tier_info": result.data[0]}
+            return {"message": f"Set messages to {count} for {user_email}", "tier_info": cache_tier_info(result.data[0])}
         else:
             raise HTTPException(status_code=404, detail="User not found")
     except Exception as e:
@@ -437,88 +2757,168 @@ async def set_user_messages(user_email: str, count: int):
 async def debug_user_status(user_email: str):
     """DEBUG ENDPOINT: Get detailed user status"""
     try:
-        tier_info = get_or_create_user_tier(user_email)
+        tier_info = await get_or_create_user_tier(user_email)
         return {
             "user_email": user_email,
             "tier_info": tier_info,
             "can_send": tier_info["messages_used_this_month"] < tier_info["messages_limit"],
+            "tier_cache": tier_cache.stats(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
         return {"error": str(e), "timestamp": datetime.now().isoformat()}
 
+USER_SEARCH_LIMIT = 10
+
 @app.get("/admin/search-users")
 async def search_users(q: str = ""):
-    """Search for users by email (admin only)"""
+    """Search for users by email (admin only).
+
+    One indexed lookup in user_directory (see create_user_directory_schema.sql),
+    ranked with prefix matches first so results stay stable as the query grows.
+    """
     try:
         print(f"DEBUG: Search request for query: '{q}'")
         
         if not q or len(q) < 2:
             return {"users": []}
         
-        # Search for users in user_tiers table
-        result = supabase.table("user_tiers").select("user_email").ilike("user_email", f"%{q}%").limit(10).execute()
-        print(f"DEBUG: user_tiers result: {result.data}")
-        
-        # Also search in journal_entries for users who might not be in user_tiers yet
-        journal_result = supabase.table("journal_entries").select("user_email").ilike("user_email", f"%{q}%").limit(10).execute()
-        print(f"DEBUG: journal_entries result: {journal_result.data}")
-        
-        # Combine and deduplicate
-        emails = set()
-        if result.data:
-            for user in result.data:
-                emails.add(user["user_email"])
-        if journal_result.data:
-            for entry in journal_result.data:
-                emails.add(entry["user_email"])
-        
-        final_users = list(emails)[:10]
+        result = await run_query(supabase.rpc("search_user_directory", {"p_query": q, "p_limit": USER_SEARCH_LIMIT}))
+        final_users = [row["user_email"] for row in result.data or []]
         print(f"DEBUG: Final users list: {final_users}")
         return {"users": final_users}
     except Exception as e:
         print(f"DEBUG: Error searching users: {e}")
         return {"users": []}
 
+# create_journal_search_schema.sql marks matches in snippets with these control characters
+SEARCH_MATCH_START, SEARCH_MATCH_END = "\x02", "\x03"
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 50
+
+def format_search_hit(hit: dict) -> dict:
+    created_at = hit["created_at"]
+    # Escape the user's own text before adding the <mark> tags, so snippets are safe to render as HTML
+    snippet = html.escape(hit["snippet"] or "").replace(SEARCH_MATCH_START, "<mark>").replace(SEARCH_MATCH_END, "</mark>")
+    return {
+        "id": hit["id"],
+        "date": f"{created_at[5:7]}/{created_at[8:10]}/{created_at[0:4]}",
+        "emotion": hit.get("emotion"),
+        "snippet": snippet,
+        "rank": hit["rank"]
+    }
+
+# Declared before /user/entries/{user_email} so "search" isn't taken for an email
+@app.get("/user/entries/search")
+async def search_user_entries(user_email: str, q: str, limit: int = SEARCH_PAGE_DEFAULT, offset: int = 0):
+    """Full-text search over a user's entries, goals and limiting beliefs, best matches first.
+
+    Pass next_offset back as offset to get the following page.
+    """
+    q = q.strip()
+    if len(q) < 2:
+        raise HTTPException(status_code=400, detail="Search query must be at least 2 characters")
+    limit = max(1, min(limit, SEARCH_PAGE_MAX))
+    offset = max(0, offset)
+    
+    try:
+        await flush_pending_writes(user_email)
+        result = await run_query(supabase.rpc("search_journal_entries", {
+            "p_user_email": user_email, "p_query": q, "p_limit": limit, "p_offset": offset
+        }))
+    except Exception as e:
+        print(f"DEBUG: Error searching entries: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to search entries: {str(e)}")
+    
+    hits = result.data or []
+    total = hits[0]["total_count"] if hits else 0
+    return {
+        "results": [format_search_hit(hit) for hit in hits],
+        "total": total,
+        "next_offset": offset + len(hits) if offset + len(hits) < total else None
+    }
+
 @app.get("/user/entries/{user_email}")
-async def get_user_own_entries(user_email: str, limit: int = 50):
+async def get_user_own_entries(user_email: str, limit: int = 50, summary: bool = False):
     """Get journal entries for a specific user (user can only see their own)"""
+    columns = ENTRY_SUMMARY_COLUMNS if summary else "*"
     try:
-        result = supabase.table("journal_entries").select("*").eq("user_email", user_email).order("created_at", desc=True).limit(limit).execute()
+        result = await run_query(supabase.table("journal_entries").select(columns).eq("user_email", user_email).order("created_at", desc=True).limit(limit))
         return {"entries": result.data if result.data else []}
     except Exception as e:
         print(f"DEBUG: Error getting user entries: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get entries: {str(e)}")
 
+async def get_entry_detail(entry_id: str, user_email: Optional[str] = None) -> dict:
+    """One full journal_entries row, optionally restricted to its owner; 404 if there is none"""
+    query = supabase.table("journal_entries").select("*").eq("id", entry_id)
+    if user_email is not None:
+        query = query.eq("user_email", user_email)
+    try:
+        result = await run_query(query)
+    except Exception as e:
+        print(f"DEBUG: Error getting entry: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get entry: {str(e)}")
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Entry not found")
+    return result.data[0]
+
+@app.get("/user/entries/{user_email}/{entry_id}")
+async def get_user_own_entry(user_email: str, entry_id: str):
+    """Get one full journal entry (user can only see their own)"""
+    return {"entry": await get_entry_detail(entry_id, user_email)}
+
+@app.get("/user/entries/{user_email}/{entry_id}/similar")
+async def get_similar_entries(user_email: str, entry_id: str, k: int = SIMILAR_ENTRIES_DEFAULT):
+    """The user's past entries most similar in meaning to this one ("you had a similar thought on ...")"""
+    if not EMBEDDINGS_ENABLED:
+        raise embedding_unavailable()
+    k = max(1, min(k, SIMILAR_ENTRIES_MAX))
+    try:
+        query = (await get_embedding_index(user_email)).vector(entry_id)
+        if query is None:
+            # Saved after the index was loaded and not embedded yet
+            query = (await add_entry_embeddings(user_email, [await get_entry_detail(entry_id, user_email)]))[0]
+        similar = await find_similar_entries(user_email, query, k, {entry_id}, ENTRY_SUMMARY_COLUMNS)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"DEBUG: Error finding similar entries: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to find similar entries: {str(e)}")
+    return {"entries": [{**format_history_summary(entry), "similarity": entry["similarity"]} for entry in similar]}
+
+async def raise_entry_not_changed(entry_id: str, user_email: str, action: str):
+    """A conditional update/delete matched nothing: work out whether it was a 404 or a 403.
+
+    Only runs on the failure path, so successful mutations stay a single round trip.
+    """
+    existing = await run_query(supabase.table("journal_entries").select("user_email").eq("id", entry_id))
+    if not existing.data:
+        raise HTTPException(status_code=404, detail="Entry not found")
+    raise HTTPException(status_code=403, detail=f"You can only {action} your own entries")
+
+def entry_update_data(request: dict, fields: List[str]) -> dict:
+    update_data = {field: request[field] for field in fields if field in request}
+    if not update_data:
+        raise HTTPException(status_code=400, detail=f"Nothing to update; send one of: {', '.join(fields)}")
+    return update_data
+
 @app.put("/user/entries/{entry_id}")
 async def update_user_entry(entry_id: str, request: dict):
     """Update a journal entry (user can only update their own entries)"""
     try:
-        # Get the entry first to verify it exists and belongs to the user
-        existing = supabase.table("journal_entries").select("*").eq("id", entry_id).execute()
-        if not existing.data:
-            raise HTTPException(status_code=404, detail="Entry not found")
-        
-        entry = existing.data[0]
         user_email = request.get("user_email")
+        update_data = entry_update_data(request, ["journal_entry", "user_goal"])
         
-        # Verify the user owns this entry
-        if entry["user_email"] != user_email:
-            raise HTTPException(status_code=403, detail="You can only edit your own entries")
-        
-        # Update the entry
-        update_data = {}
-        if "journal_entry" in request:
-            update_data["journal_entry"] = request["journal_entry"]
-        if "user_goal" in request:
-            update_data["user_goal"] = request["user_goal"]
-        
-        result = supabase.table("journal_entries").update(update_data).eq("id", entry_id).execute()
+        # Ownership is part of the filter, so this is one statement that returns the updated row
+        result = await run_query(supabase.table("journal_entries").update(update_data).eq("id", entry_id).eq("user_email", user_email))
+        if not result.data:
+            await raise_entry_not_changed(entry_id, user_email, "edit")
+        await drop_chunk_summaries(user_email, result.data)
+        # Similarity must follow the new text
+        schedule_entry_embeddings(user_email, result.data, replace=True)
         
-        if result.data:
-            return {"message": "Entry updated successfully", "entry": result.data[0]}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to update entry")
+        return {"message": "Entry updated successfully", "entry": result.data[0]}
             
     except HTTPException:
         raise
@@ -530,22 +2930,15 @@ async def update_user_entry(entry_id: str, request: dict):
 async def delete_user_entry(entry_id: str, request: dict):
     """Delete a journal entry (user can only delete their own entries)"""
     try:
-        # Get the entry first to verify it exists and belongs to the user
-        existing = supabase.table("journal_entries").select("*").eq("id", entry_id).execute()
-        if not existing.data:
-            raise HTTPException(status_code=404, detail="Entry not found")
-        
-        entry = existing.data[0]
         user_email = request.get("user_email")
         
-        # Verify the user owns this entry
-        if entry["user_email"] != user_email:
-            raise HTTPException(status_code=403, detail="You can only delete your own entries")
-        
-        # Delete the entry
-        result = supabase.table("journal_entries").delete().eq("id", entry_id).execute()
+        result = await run_query(supabase.table("journal_entries").delete().eq("id", entry_id).eq("user_email", user_email))
+        if not result.data:
+            await raise_entry_not_changed(entry_id, user_email, "delete")
+        await drop_chunk_summaries(user_email, result.data)
+        await drop_entry_embeddings(user_email, [str(row["id"]) for row in result.data])
         
-        return {"message": "Entry deleted successfully", "deleted_entry": entry}
+        return {"message": "Entry deleted successfully", "deleted_entry": result.data[0]}
         
     except HTTPException:
         raise
@@ -553,6 +2946,43 @@ async def delete_user_entry(entry_id: str, request: dict):
         print(f"DEBUG: Error deleting user entry: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to delete entry: {str(e)}")
 
+# Ids go into the query string (id=in.(...)), so keep requests well under URL length limits
+BULK_DELETE_MAX_IDS = int(os.getenv("BULK_DELETE_MAX_IDS", "500"))
+
+class BulkDeleteRequest(BaseModel):
+    user_email: str
+    entry_ids: List[str]
+
+@app.post("/user/entries/bulk-delete")
+async def bulk_delete_user_entries(request: BulkDeleteRequest):
+    """Delete many of a user's journal entries in one statement.
+
+    Ids that don't exist or belong to someone else are skipped and listed in not_deleted.
+    """
+    entry_ids = list(dict.fromkeys(str(entry_id) for entry_id in request.entry_ids))
+    if not entry_ids:
+        raise HTTPException(status_code=400, detail="No entry_ids given")
+    if len(entry_ids) > BULK_DELETE_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_DELETE_MAX_IDS} entries can be deleted per request")
+    
+    try:
+        query = supabase.table("journal_entries").delete().eq("user_email", request.user_email).in_("id", entry_ids)
+        # Only the ids (and dates, for the chunk summaries) are needed back, not every deleted row
+        query.params = query.params.add("select", "id,created_at")
+        result = await run_query(query)
+        deleted = {str(row["id"]) for row in result.data or []}
+        await drop_chunk_summaries(request.user_email, result.data or [])
+        await drop_entry_embeddings(request.user_email, list(deleted))
+        print(f"DEBUG: Bulk deleted {len(deleted)}/{len(entry_ids)} entries for {request.user_email}")
+        return {
+            "message": f"Deleted {len(deleted)} entries",
+            "deleted_ids": [entry_id for entry_id in entry_ids if entry_id in deleted],
+            "not_deleted": [entry_id for entry_id in entry_ids if entry_id not in deleted]
+        }
+    except Exception as e:
+        print(f"DEBUG: Error bulk deleting entries: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to delete entries: {str(e)}")
+
 @app.get("/")
 async def root():
     return {"message": "MindsetOS AI Journal Backend"}
@@ -563,49 +2993,46 @@ async def test_search():
     return {"message": "Search endpoint is working", "test_users": ["test@example.com", "admin@example.com"]}
 
 @app.get("/admin/entries/{user_email}")
-async def get_user_entries(user_email: str, limit: int = 50):
+async def get_user_entries(user_email: str, limit: int = 50, summary: bool = False):
     """Get all journal entries for a specific user (admin only)"""
+    columns = ENTRY_SUMMARY_COLUMNS + ", user_email" if summary else "*"
     try:
-        result = supabase.table("journal_entries").select("*").eq("user_email", user_email).order("created_at", desc=True).limit(limit).execute()
+        result = await run_query(supabase.table("journal_entries").select(columns).eq("user_email", user_email).order("created_at", desc=True).limit(limit))
         return {"entries": result.data if result.data else []}
     except Exception as e:
         print(f"DEBUG: Error getting user entries: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get entries: {str(e)}")
 
 @app.get("/admin/entries")
-async def get_all_entries(limit: int = 100):
+async def get_all_entries(limit: int = 100, summary: bool = False):
     """Get all journal entries (admin only)"""
+    columns = ENTRY_SUMMARY_COLUMNS + ", user_email" if summary else "*"
     try:
-        result = supabase.table("journal_entries").select("*").order("created_at", desc=True).limit(limit).execute()
+        result = await run_query(supabase.table("journal_entries").select(columns).order("created_at", desc=True).limit(limit))
         return {"entries": result.data if result.data else []}
     except Exception as e:
         print(f"DEBUG: Error getting all entries: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get entries: {str(e)}")
 
+@app.get("/admin/entries/{user_email}/{entry_id}")
+async def get_user_entry(user_email: str, entry_id: str):
+    """Get one full journal entry (admin only)"""
+    return {"entry": await get_entry_detail(entry_id, user_email)}
+
 @app.put("/admin/entries/{entry_id}")
 async def update_entry(entry_id: str, request: dict):
     """Update a journal entry (admin only)"""
     try:
-        # Get the entry first to verify it exists
-        existing = supabase.table("journal_entries").select("*").eq("id", entry_id).execute()
-        if not existing.data:
-            raise HTTPException(status_code=404, detail="Entry not found")
+        update_data = entry_update_data(request, ["journal_entry", "user_goal", "ai_analysis"])
         
-        # Update the entry
-        update_data = {}
-        if "journal_entry" in request:
-            update_data["journal_entry"] = request["journal_entry"]
-        if "user_goal" in request:
-            update_data["user_goal"] = request["user_goal"]
-        if "ai_analysis" in request:
-            update_data["ai_analysis"] = request["ai_analysis"]
-        
-        result = supabase.table("journal_entries").update(update_data).eq("id", entry_id).execute()
+        result = await run_query(supabase.table("journal_entries").update(update_data).eq("id", entry_id))
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Entry not found")
+        if "journal_entry" in update_data or "user_goal" in update_data:
+            await drop_chunk_summaries(result.data[0]["user_email"], result.data)
+            schedule_entry_embeddings(result.data[0]["user_email"], result.data, replace=True)
         
-        if result.data:
-            return {"message": "Entry updated successfully", "entry": result.data[0]}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to update entry")
+        return {"message": "Entry updated successfully", "entry": result.data[0]}
             
     except HTTPException:
         raise
@@ -617,15 +3044,13 @@ async def update_entry(entry_id: str, request: dict):
 async def delete_entry(entry_id: str):
     """Delete a journal entry (admin only)"""
     try:
-        # Get the entry first to verify it exists
-        existing = supabase.table("journal_entries").select("*").eq("id", entry_id).execute()
-        if not existing.data:
+        result = await run_query(supabase.table("journal_entries").delete().eq("id", entry_id))
+        if not result.data:
             raise HTTPException(status_code=404, detail="Entry not found")
+        await drop_chunk_summaries(result.data[0]["user_email"], result.data)
+        await drop_entry_embeddings(result.data[0]["user_email"], [str(row["id"]) for row in result.data])
         
-        # Delete the entry
-        result = supabase.table("journal_entries").delete().eq("id", entry_id).execute()
-        
-        return {"message": "Entry deleted successfully", "deleted_entry": existing.data[0]}
+        return {"message": "Entry deleted successfully", "deleted_entry": result.data[0]}
         
     except HTTPException:
         raise
@@ -633,27 +3058,26 @@ async def delete_entry(entry_id: str):
         print(f"DEBUG: Error deleting entry: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to delete entry: {str(e)}")
 
+@app.get("/admin/cache-stats")
+async def get_cache_stats():
+    """Hit/miss counts for the in-process caches (admin only)"""
+    return {
+        "tier_cache": tier_cache.stats(),
+        "analysis_cache": analysis_cache_stats(),
+        "write_buffer": write_buffer.stats() if write_buffer is not None else None
+    }
+
+@app.get("/admin/openai-status")
+async def get_openai_status():
+    """Call, retry and rejection counts plus circuit breaker state for OpenAI calls (admin only)"""
+    return {**openai_chat.stats(), "routing_policy": journal_router.name, "models": model_route_stats.stats(),
+            "embeddings": {**openai_embeddings.stats(), "backfilling_users": len(embedding_backfills)}}
+
 @app.get("/admin/message-limits")
 async def get_message_limits():
     """Get current message limits for free and premium tiers"""
-    try:
-        # Get current limits from user_tiers table (using a sample user or default values)
-        result = supabase.table("user_tiers").select("tier, messages_limit").execute()
-        
-        # Extract unique limits by tier
-        limits = {"free": 2, "premium": 5}  # Default values
-        
-        if result.data:
-            for user in result.data:
-                if user["tier"] == "free":
-                    limits["free"] = user["messages_limit"]
-                elif user["tier"] == "premium":
-                    limits["premium"] = user["messages_limit"]
-        
-        return {"limits": limits}
-    except Exception as e:
-        print(f"DEBUG: Error getting message limits: {e}")
-        return {"limits": {"free": 100, "premium": 500}}
+    limits = await load_tier_limits()
+    return {"limits": {tier: limits.get(tier, DEFAULT_TIER_LIMITS[tier]) for tier in DEFAULT_TIER_LIMITS}}
 
 class MessageLimitsRequest(BaseModel):
     free_limit: int = 100
@@ -661,34 +3085,38 @@ class MessageLimitsRequest(BaseModel):
 
 @app.post("/admin/update-message-limits")
 async def update_message_limits(request: MessageLimitsRequest):
-    """Update message limits for free and premium tiers"""
+    """Update message limits for free and premium tiers.
+
+    Only the two tier_limits rows change. Quota is enforced by the database functions,
+    which join tier_limits on every call, so users without a per-user override are held
+    to the new limit on their next message on every instance. The tier_limits copy
+    loaded here only feeds displayed limits; other instances refresh it within
+    TIER_LIMITS_TTL_SECONDS.
+    """
     try:
         free_limit = request.free_limit
         premium_limit = request.premium_limit
+        if free_limit < 0 or premium_limit < 0:
+            raise HTTPException(status_code=400, detail="Limits must not be negative")
         
         print(f"DEBUG: Updating limits - Free: {free_limit}, Premium: {premium_limit}")
         
-        # Update all free tier users
-        free_result = supabase.table("user_tiers").update({
-            "messages_limit": free_limit
-        }).eq("tier", "free").execute()
+        now = datetime.now(timezone.utc).isoformat()
+        await run_query(supabase.table("tier_limits").upsert([
+            {"tier": "free", "messages_limit": free_limit, "updated_at": now},
+            {"tier": "premium", "messages_limit": premium_limit, "updated_at": now}
+        ], on_conflict="tier"))
+        await load_tier_limits(force=True)
         
-        # Update all premium tier users
-        premium_result = supabase.table("user_tiers").update({
-            "messages_limit": premium_limit
-        }).eq("tier", "premium").execute()
-        
-        print(f"DEBUG: Updated {len(free_result.data) if free_result.data else 0} free users")
-        print(f"DEBUG: Updated {len(premium_result.data) if premium_result.data else 0} premium users")
+        # Cached rows may carry a limit resolved under the old configuration
+        tier_cache.clear()
         
         return {
             "message": "Message limits updated successfully",
-            "limits": {"free": free_limit, "premium": premium_limit},
-            "updated_users": {
-                "free": len(free_result.data) if free_result.data else 0,
-                "premium": len(premium_result.data) if premium_result.data else 0
-            }
+            "limits": {"free": free_limit, "premium": premium_limit}
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"DEBUG: Error updating message limits: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to update message limits: {str(e)}")
@@ -708,51 +3136,175 @@ class PersonalityAnalysisResponse(BaseModel):
 class PersonalityAnalysisRequest(BaseModel):
     userEmail: str
 
-@app.post("/analyze-personality", response_model=PersonalityAnalysisResponse)
-async def analyze_personality(request: PersonalityAnalysisRequest):
-    """Analyze user's personality based on their journal entries"""
+# Personality analysis is map-reduce: entries are summarized in fixed-size chunks
+# once (personality_chunk_summaries), and each run only summarizes the chunks
+# completed since the last one before reducing over the stored summaries.
+PERSONALITY_CHUNK_SIZE = int(os.getenv("PERSONALITY_CHUNK_SIZE", "20"))
+PERSONALITY_MAP_CONCURRENCY = int(os.getenv("PERSONALITY_MAP_CONCURRENCY", "4"))
+# Token budget of one map (chunk summary) prompt; chunk summaries are shared by every tier
+PERSONALITY_MAP_PROMPT_TOKENS = int(os.getenv("PERSONALITY_MAP_PROMPT_TOKENS", "16000"))
+PERSONALITY_ENTRY_COLUMNS = "id, created_at, user_goal, journal_entry, limiting_belief"
+# With embeddings enabled, the reduce step also gets this many earlier entries closest
+# in meaning to the recent (unsummarized) ones, verbatim; 0 turns this off
+PERSONALITY_RELATED_ENTRIES = int(os.getenv("PERSONALITY_RELATED_ENTRIES", "5"))
+
+def format_entry_for_analysis(entry: dict) -> str:
+    entry_text = f"Date: {entry.get('created_at', 'Unknown')}\n"
+    if entry.get('user_goal'):
+        entry_text += f"Goal: {entry['user_goal']}\n"
+    entry_text += f"Entry: {entry['journal_entry']}\n"
+    if entry.get('limiting_belief'):
+        entry_text += f"Identified Limiting Belief: {entry['limiting_belief']}\n"
+    return entry_text
+
+async def summarize_entry_chunk(entries: List[dict]) -> str:
+    """Map step: condense one chunk of journal entries into a short psychological summary.
+
+    Long entries are truncated so the prompt fits PERSONALITY_MAP_PROMPT_TOKENS, and a
+    chunk with a few very long entries still fits the model's context.
+    """
+    system_prompt = "You are a psychology and mindset expert."
+    separator = "\n---\n"
+    
+    def render(combined_entries: str) -> str:
+        return f"""You are a world-class psychology and mindset expert. Summarize the following {len(entries)} journal entries for a later personality analysis.
+
+Journal Entries:
+{combined_entries}
+
+In at most 200 words, capture: recurring themes, values, motivators, demotivators, emotional triggers, limiting beliefs and self-talk patterns, and any change over the period. Keep concrete details that reveal patterns; drop everything else."""
+    
+    overhead = count_tokens(render("")) + count_tokens(system_prompt) + count_tokens(separator) * len(entries)
+    budget = max(PERSONALITY_MAP_PROMPT_TOKENS - overhead, len(entries))
+    sections = [format_entry_for_analysis(entry) for entry in entries]
+    cap = fair_share_cap([count_tokens(section) for section in sections], budget)
+    sections, stats = fit_sections_to_budget(sections, budget, max_section_tokens=cap)
+    if stats["sections_truncated"] or stats["sections_kept"] < stats["sections_total"]:
+        print(f"DEBUG: Map prompt over budget, fitted chunk: {stats}")
+    prompt = render(separator.join(sections))
+
+    response = await openai_chat.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+        max_tokens=400
+    )
+    return response.choices[0].message.content.strip()
+
+async def drop_chunk_summaries(user_email: str, rows: List[dict]):
+    """Forget the stored chunk holding the earliest of these rows and every chunk after it.
+
+    Called when entries are deleted, edited or imported with an earlier date, so the
+    next analysis re-summarizes from there instead of using the old text.
+    """
+    if not rows:
+        return
+    since = min(row["created_at"] for row in rows)
+    try:
+        await run_query(
+            supabase.table("personality_chunk_summaries").delete()
+            .eq("user_email", user_email).gte("last_entry_at", since)
+        )
+    except Exception as e:
+        print(f"DEBUG: Error dropping chunk summaries for {user_email}: {e}")
+
+async def update_chunk_summaries(user_email: str) -> tuple[List[dict], List[dict]]:
+    """Summarize every full chunk of entries written since the last stored chunk.
+
+    Returns (chunk summaries in chronological order, entries in the trailing
+    partial chunk). Deleting or editing an entry drops its chunk and the ones
+    after it (drop_chunk_summaries), so those are summarized again here.
+    """
+    result = await run_query(
+        supabase.table("personality_chunk_summaries")
+        .select("chunk_index, entry_count, first_entry_at, last_entry_at, last_entry_id, summary")
+        .eq("user_email", user_email)
+        .order("chunk_index")
+    )
+    summaries = result.data or []
+    cursor = (summaries[-1]["last_entry_at"], summaries[-1]["last_entry_id"]) if summaries else None
+    
+    new_entries = []
+    async for page in iter_keyset_pages(
+        lambda: supabase.table("journal_entries").select(PERSONALITY_ENTRY_COLUMNS).eq("user_email", user_email),
+        page_size=200, cursor=cursor, desc=False
+    ):
+        new_entries.extend(page)
+    
+    full = len(new_entries) - len(new_entries) % PERSONALITY_CHUNK_SIZE
+    chunks = [new_entries[i:i + PERSONALITY_CHUNK_SIZE] for i in range(0, full, PERSONALITY_CHUNK_SIZE)]
+    tail = new_entries[full:]
+    if not chunks:
+        return summaries, tail
+    
+    semaphore = asyncio.Semaphore(PERSONALITY_MAP_CONCURRENCY)
+    async def summarize(chunk):
+        async with semaphore:
+            return await summarize_entry_chunk(chunk)
+    texts = await asyncio.gather(*[summarize(chunk) for chunk in chunks])
+    
+    next_index = summaries[-1]["chunk_index"] + 1 if summaries else 0
+    new_rows = [{
+        "user_email": user_email,
+        "chunk_index": next_index + i,
+        "entry_count": len(chunk),
+        "first_entry_at": chunk[0]["created_at"],
+        "last_entry_at": chunk[-1]["created_at"],
+        "last_entry_id": chunk[-1]["id"],
+        "summary": text
+    } for i, (chunk, text) in enumerate(zip(chunks, texts))]
+    print(f"DEBUG: Summarized {len(new_rows)} new chunk(s) for {user_email}")
     
-    # Check message limit before processing
-    can_send, tier_info = check_message_limit(request.userEmail)
-    if not can_send:
-        print(f"DEBUG: User {request.userEmail} has reached limit, returning 429 error")
-        from fastapi import Response
-        return Response(
-            content="You've exhausted your quota for the month. If you need more, upgrade your tier by sending an email request to mindsetosai@gmail.com",
-            status_code=429,
-            media_type="text/plain"
+    try:
+        await run_query(
+            supabase.table("personality_chunk_summaries")
+            .upsert(new_rows, ignore_duplicates=True, on_conflict="user_email,chunk_index")
         )
+    except Exception as db_error:
+        print(f"DEBUG: Failed to save chunk summaries to Supabase: {db_error}")
+        # Continue anyway - the summaries are still used for this run
     
+    return summaries + new_rows, tail
+
+async def find_related_entries(user_email: str, recent_entries: List[dict]) -> List[dict]:
+    """Earlier entries most similar to the recent ones as a whole, oldest first; [] if unavailable"""
+    if not EMBEDDINGS_ENABLED or PERSONALITY_RELATED_ENTRIES <= 0 or not recent_entries:
+        return []
     try:
-        # Get user's journal entries
-        result = supabase.table("journal_entries").select("*").eq("user_email", request.userEmail).order("created_at", desc=False).execute()
-        
-        if not result.data or len(result.data) < 10:
-            raise HTTPException(
-                status_code=400,
-                detail="At least 10 journal entries are needed for meaningful personality analysis."
-            )
-        
-        entries = result.data
-        total_entries = len(entries)
-        
-        # Prepare entries for analysis
-        entry_texts = []
-        for entry in entries:
-            entry_text = f"Date: {entry.get('created_at', 'Unknown')}\n"
-            if entry.get('user_goal'):
-                entry_text += f"Goal: {entry['user_goal']}\n"
-            entry_text += f"Entry: {entry['journal_entry']}\n"
-            if entry.get('limiting_belief'):
-                entry_text += f"Identified Limiting Belief: {entry['limiting_belief']}\n"
-            entry_texts.append(entry_text)
-        
-        combined_entries = "\n---\n".join(entry_texts)
-        
-        # Create comprehensive personality analysis prompt
-        prompt = f"""You are a world-class psychology and mindset expert. Analyze this person's personality, mindset patterns, and psychological profile based on their {total_entries} journal entries.
+        index = await get_embedding_index(user_email)
+        recent_ids = {str(entry["id"]) for entry in recent_entries}
+        vectors = [index.vector(entry_id) for entry_id in recent_ids]
+        vectors = [vector for vector in vectors if vector is not None]
+        if not vectors:
+            return []
+        related = await find_similar_entries(user_email, np.mean(vectors, axis=0), PERSONALITY_RELATED_ENTRIES,
+                                             recent_ids, PERSONALITY_ENTRY_COLUMNS)
+        return sorted(related, key=lambda entry: entry["created_at"])
+    except Exception as e:
+        # The analysis works without them
+        print(f"DEBUG: Failed to find related entries for {user_email}: {e}")
+        return []
 
-Journal Entries:
+PERSONALITY_SYSTEM_PROMPT = "You are a psychology and mindset expert. Always respond with valid JSON."
+
+def build_personality_prompt(summaries: List[dict], recent_entries: List[dict], total_entries: int,
+                             tier: str = "free", related_entries: Optional[List[dict]] = None) -> tuple[str, dict]:
+    """Craft the reduce-step prompt, sampling chunk summaries and entries to fit the tier's token budget"""
+    # Related entries go between the summaries and the recent entries, so the budget keeps them before old summaries
+    sections = [
+        f"Summary of entries {summary['first_entry_at'][:10]} to {summary['last_entry_at'][:10]} ({summary['entry_count']} entries):\n{summary['summary']}"
+        for summary in summaries
+    ] + [
+        "Earlier entry related to recent ones:\n" + format_entry_for_analysis(entry) for entry in related_entries or []
+    ] + [format_entry_for_analysis(entry) for entry in recent_entries]
+    
+    def render(combined_entries: str) -> str:
+        return f"""You are a world-class psychology and mindset expert. Analyze this person's personality, mindset patterns, and psychological profile based on their {total_entries} journal entries.
+
+Journal History (chronological; earlier periods are summarized):
 {combined_entries}
 
 Provide a comprehensive personality analysis in this exact JSON format:
@@ -776,12 +3328,56 @@ Focus on:
 - Growth mindset vs. fixed mindset tendencies
 
 Be insightful, empathetic, and actionable. Avoid generic advice."""
+    
+    budget = get_prompt_budget("analyze_personality", tier)
+    overhead = count_tokens(render("")) + count_tokens(PERSONALITY_SYSTEM_PROMPT)
+    kept, stats = fit_sections_to_budget(sections, max(budget - overhead, 1), strategy="sample")
+    prompt = render("\n---\n".join(kept))
+    stats["budget"] = budget
+    stats["prompt_tokens"] = count_tokens(prompt) + count_tokens(PERSONALITY_SYSTEM_PROMPT)
+    return prompt, stats
+
+@app.post("/analyze-personality", response_model=PersonalityAnalysisResponse)
+async def analyze_personality(request: PersonalityAnalysisRequest, http_response: Response):
+    """Analyze user's personality based on their journal entries"""
+    # Concurrent runs for the same user wait for the one in flight instead of starting another
+    result, shared = await request_coalescer.do(
+        ("analyze_personality", request.userEmail),
+        lambda: run_personality_analysis(request, http_response)
+    )
+    if shared:
+        http_response.headers["X-Coalesced"] = "true"
+    return result
+
+async def run_personality_analysis(request: PersonalityAnalysisRequest, http_response: Response):
+    # Reserve quota up front; it is refunded below if the request fails
+    reservation = await reserve_message_quota(request.userEmail)
+    if not reservation.granted:
+        return quota_exhausted_response(request.userEmail)
+    
+    try:
+        # Summarize any newly completed chunks; older chunks come from the database
+        summaries, recent_entries = await update_chunk_summaries(request.userEmail)
+        total_entries = sum(summary["entry_count"] for summary in summaries) + len(recent_entries)
+        
+        if total_entries < 10:
+            raise HTTPException(
+                status_code=400,
+                detail="At least 10 journal entries are needed for meaningful personality analysis."
+            )
+        
+        # Reduce step input: chunk summaries, related earlier entries and the raw recent entries, fitted to the budget
+        related_entries = await find_related_entries(request.userEmail, recent_entries)
+        prompt, prompt_stats = build_personality_prompt(summaries, recent_entries, total_entries,
+                                                        reservation.tier_info["tier"], related_entries)
+        set_prompt_token_headers(http_response, prompt_stats)
+        print(f"DEBUG: Personality prompt tokens: {prompt_stats}")
 
         # Call OpenAI API for personality analysis
-        response = openai_client.chat.completions.create(
+        response = await openai_chat.create(
             model="gpt-4o",
             messages=[
-                {"role": "system", "content": "You are a psychology and mindset expert. Always respond with valid JSON."},
+                {"role": "system", "content": PERSONALITY_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.7,
@@ -792,20 +3388,7 @@ Be insightful, empathetic, and actionable. Avoid generic advice."""
         print(f"DEBUG: Personality analysis response: {analysis_text}")
         
         # Parse the JSON response
-        try:
-            analysis = json.loads(analysis_text)
-        except json.JSONDecodeError:
-            # Try to extract JSON if it's wrapped in markdown code blocks
-            if "```json" in analysis_text:
-                json_start = analysis_text.find("```json") + 7
-                json_end = analysis_text.find("```", json_start)
-                if json_end > json_start:
-                    analysis_text = analysis_text[json_start:json_end].strip()
-                    analysis = json.loads(analysis_text)
-                else:
-                    raise
-            else:
-                raise
+        analysis = parse_json_response(analysis_text)
         
         # Create analysis record
         analysis_id = str(uuid.uuid4())
@@ -827,15 +3410,12 @@ Be insightful, empathetic, and actionable. Avoid generic advice."""
         }
         
         try:
-            result = supabase.table("personality_analyses").insert(personality_record).execute()
+            result = await run_query(supabase.table("personality_analyses").insert(personality_record))
             print(f"DEBUG: Saved personality analysis to Supabase: {result.data}")
         except Exception as db_error:
             print(f"DEBUG: Failed to save personality analysis to Supabase: {db_error}")
             # Continue anyway - don't fail the analysis if database save fails
         
-        # Increment message count after successful analysis
-        increment_message_count(request.userEmail)
-        
         # Return the analysis
         return PersonalityAnalysisResponse(
             analysis_id=analysis_id,
@@ -851,23 +3431,263 @@ Be insightful, empathetic, and actionable. Avoid generic advice."""
         )
         
     except HTTPException:
+        await reservation.refund()
         raise
     except json.JSONDecodeError:
+        await reservation.refund()
         raise HTTPException(status_code=500, detail="Failed to parse personality analysis response")
     except Exception as e:
         print(f"DEBUG: Error in personality analysis: {e}")
+        await reservation.refund()
         raise HTTPException(status_code=500, detail=f"Personality analysis failed: {str(e)}")
 
+# Background personality analysis jobs
+# POST /analyze-personality/jobs enqueues a job and returns at once; a bounded pool
+# of workers in this instance runs it through the same path as /analyze-personality
+# (so results still land in personality_analyses). Job records live in memory by
+# default, or in the analysis_jobs table with JOB_STORE=supabase so status survives
+# instance restarts and any instance can answer polls.
+PERSONALITY_JOB_WORKERS = int(os.getenv("PERSONALITY_JOB_WORKERS", "2"))
+PERSONALITY_JOB_QUEUE_SIZE = int(os.getenv("PERSONALITY_JOB_QUEUE_SIZE", "100"))
+PERSONALITY_JOB_STALE_SECONDS = int(os.getenv("PERSONALITY_JOB_STALE_SECONDS", "600"))
+
+class InMemoryJobStore:
+    """Job records kept in this instance's memory; lost when the instance recycles"""
+
+    def __init__(self, max_jobs: int = 1000):
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, dict]" = OrderedDict()
+
+    async def create(self, job: dict) -> dict:
+        self.jobs[job["job_id"]] = job
+        # Forget the oldest finished jobs beyond max_jobs
+        for job_id in [job_id for job_id, old in self.jobs.items() if old["status"] in ("succeeded", "failed")]:
+            if len(self.jobs) <= self.max_jobs:
+                break
+            del self.jobs[job_id]
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def update(self, job_id: str, **fields) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        if job:
+            job.update(fields, updated_at=datetime.now(timezone.utc).isoformat())
+        return job
+
+    async def claim(self, job_id: str) -> bool:
+        """Move a queued job to running; False if it was already claimed"""
+        job = self.jobs.get(job_id)
+        if not job or job["status"] != "queued":
+            return False
+        job.update(status="running", updated_at=datetime.now(timezone.utc).isoformat())
+        return True
+
+    async def find_active(self, user_email: str, job_type: str) -> Optional[dict]:
+        for job in self.jobs.values():
+            if job["user_email"] == user_email and job["job_type"] == job_type and job["status"] in ("queued", "running"):
+                return dict(job)
+        return None
+
+    async def list_for_user(self, user_email: str, limit: int = 20) -> List[dict]:
+        jobs = [dict(job) for job in self.jobs.values() if job["user_email"] == user_email]
+        return jobs[::-1][:limit]
+
+    async def recoverable(self) -> List[dict]:
+        return []
+
+class SupabaseJobStore:
+    """Job records in the analysis_jobs table (see create_analysis_jobs_schema.sql)"""
+
+    async def create(self, job: dict) -> dict:
+        result = await run_query(supabase.table("analysis_jobs").insert(job))
+        return result.data[0]
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        result = await run_query(supabase.table("analysis_jobs").select("*").eq("job_id", job_id))
+        return result.data[0] if result.data else None
+
+    async def update(self, job_id: str, **fields) -> Optional[dict]:
+        fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+        result = await run_query(supabase.table("analysis_jobs").update(fields).eq("job_id", job_id))
+        return result.data[0] if result.data else None
+
+    async def claim(self, job_id: str) -> bool:
+        """Conditionally move a queued job to running, so only one instance runs it"""
+        result = await run_query(
+            supabase.table("analysis_jobs")
+            .update({"status": "running", "updated_at": datetime.now(timezone.utc).isoformat()})
+            .eq("job_id", job_id).eq("status", "queued")
+        )
+        return bool(result.data)
+
+    async def find_active(self, user_email: str, job_type: str) -> Optional[dict]:
+        result = await run_query(
+            supabase.table("analysis_jobs").select("*")
+            .eq("user_email", user_email).eq("job_type", job_type)
+            .in_("status", ["queued", "running"]).limit(1)
+        )
+        return result.data[0] if result.data else None
+
+    async def list_for_user(self, user_email: str, limit: int = 20) -> List[dict]:
+        result = await run_query(
+            supabase.table("analysis_jobs").select("*")
+            .eq("user_email", user_email).order("created_at", desc=True).limit(limit)
+        )
+        return result.data or []
+
+    async def recoverable(self) -> List[dict]:
+        """Queued jobs, plus running jobs abandoned by an instance that went away"""
+        stale = (datetime.now(timezone.utc) - timedelta(seconds=PERSONALITY_JOB_STALE_SECONDS)).isoformat()
+        await run_query(
+            supabase.table("analysis_jobs").update({"status": "queued"})
+            .eq("status", "running").lt("updated_at", stale)
+        )
+        result = await run_query(
+            supabase.table("analysis_jobs").select("job_id")
+            .eq("status", "queued").order("created_at").limit(PERSONALITY_JOB_QUEUE_SIZE)
+        )
+        return result.data or []
+
+job_store = SupabaseJobStore() if os.getenv("JOB_STORE", "memory") == "supabase" else InMemoryJobStore()
+personality_job_queue: Optional[asyncio.Queue] = None
+personality_job_workers: List[asyncio.Task] = []
+
+async def run_personality_job(job_id: str):
+    """Run one queued personality job and record its outcome"""
+    if not await job_store.claim(job_id):
+        return
+    job = await job_store.get(job_id)
+    request = PersonalityAnalysisRequest(userEmail=job["user_email"])
+    print(f"DEBUG: Running personality job {job_id} for {request.userEmail}")
+    try:
+        result, _ = await request_coalescer.do(
+            ("analyze_personality", request.userEmail),
+            lambda: run_personality_analysis(request, Response())
+        )
+        if isinstance(result, Response):
+            # Quota exhausted by the time the job ran
+            await job_store.update(job_id, status="failed", status_code=result.status_code, error=result.body.decode())
+        else:
+            await job_store.update(job_id, status="succeeded", status_code=200, result=dict(result))
+    except HTTPException as e:
+        await job_store.update(job_id, status="failed", status_code=e.status_code, error=str(e.detail))
+    except Exception as e:
+        print(f"DEBUG: Personality job {job_id} failed: {e}")
+        await job_store.update(job_id, status="failed", status_code=500, error=f"Personality analysis failed: {str(e)}")
+
+async def personality_job_worker():
+    while True:
+        job_id = await personality_job_queue.get()
+        try:
+            await run_personality_job(job_id)
+        except Exception as e:
+            print(f"DEBUG: Error running personality job {job_id}: {e}")
+        finally:
+            personality_job_queue.task_done()
+
+@app.on_event("startup")
+async def start_personality_job_workers():
+    global personality_job_queue
+    personality_job_queue = asyncio.Queue(maxsize=PERSONALITY_JOB_QUEUE_SIZE)
+    personality_job_workers.extend(
+        asyncio.create_task(personality_job_worker()) for _ in range(PERSONALITY_JOB_WORKERS)
+    )
+    try:
+        for job in await job_store.recoverable():
+            personality_job_queue.put_nowait(job["job_id"])
+    except Exception as e:
+        print(f"DEBUG: Error recovering personality jobs: {e}")
+
+@app.on_event("shutdown")
+async def stop_personality_job_workers():
+    for worker in personality_job_workers:
+        worker.cancel()
+
+@app.post("/analyze-personality/jobs", status_code=202)
+async def enqueue_personality_analysis(request: PersonalityAnalysisRequest):
+    """Queue a personality analysis and return its job id right away; poll /analyze-personality/jobs/{job_id}"""
+    # Cheap early check; the authoritative quota reservation happens when the job runs
+    tier_info = await get_or_create_user_tier(request.userEmail)
+    if tier_info["messages_used_this_month"] >= tier_info["messages_limit"]:
+        return quota_exhausted_response(request.userEmail)
+    
+    try:
+        active = await job_store.find_active(request.userEmail, "personality")
+        if active:
+            return {"job_id": active["job_id"], "status": active["status"]}
+        
+        if personality_job_queue.full():
+            raise HTTPException(status_code=503, detail="Too many analyses queued, please retry shortly", headers={"Retry-After": "30"})
+        
+        now = datetime.now(timezone.utc).isoformat()
+        job = await job_store.create({
+            "job_id": str(uuid.uuid4()),
+            "job_type": "personality",
+            "user_email": request.userEmail,
+            "status": "queued",
+            "created_at": now,
+            "updated_at": now
+        })
+        try:
+            personality_job_queue.put_nowait(job["job_id"])
+        except asyncio.QueueFull:
+            # Filled up while the job row was being written; fail it so it doesn't block the user's next request
+            await job_store.update(job["job_id"], status="failed", status_code=503, error="Too many analyses queued")
+            raise HTTPException(status_code=503, detail="Too many analyses queued, please retry shortly", headers={"Retry-After": "30"})
+        return {"job_id": job["job_id"], "status": job["status"]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"DEBUG: Error queueing personality job: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue personality analysis: {str(e)}")
+
+@app.get("/analyze-personality/jobs/{job_id}")
+async def get_personality_job(job_id: str):
+    """Get a personality job's status, and its analysis once it has succeeded"""
+    try:
+        job = await job_store.get(job_id)
+    except Exception as e:
+        print(f"DEBUG: Error fetching personality job: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch job: {str(e)}")
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/personality-jobs/{user_email}")
+async def list_personality_jobs(user_email: str, limit: int = 20):
+    """List a user's recent personality jobs, newest first"""
+    try:
+        return {"jobs": await job_store.list_for_user(user_email, min(limit, 100))}
+    except Exception as e:
+        print(f"DEBUG: Error listing personality jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to list jobs: {str(e)}")
+
 @app.get("/personality-history/{user_email}")
-async def get_personality_history(user_email: str):
+async def get_personality_history(user_email: str, summary: bool = False):
     """Get user's personality analysis history"""
+    columns = PERSONALITY_SUMMARY_COLUMNS if summary else "*"
     try:
-        result = supabase.table("personality_analyses").select("*").eq("user_email", user_email).order("analysis_date", desc=True).execute()
+        result = await run_query(supabase.table("personality_analyses").select(columns).eq("user_email", user_email).order("analysis_date", desc=True))
         return {"analyses": result.data if result.data else []}
     except Exception as e:
         print(f"DEBUG: Error fetching personality history: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch personality history: {str(e)}")
 
+@app.get("/personality-history/{user_email}/{analysis_id}")
+async def get_personality_analysis(user_email: str, analysis_id: str):
+    """Get one full personality analysis (the detail view for ?summary=true listings)"""
+    try:
+        result = await run_query(supabase.table("personality_analyses").select("*").eq("user_email", user_email).eq("analysis_id", analysis_id))
+    except Exception as e:
+        print(f"DEBUG: Error fetching personality analysis: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch personality analysis: {str(e)}")
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return {"analysis": result.data[0]}
+
 @app.post("/admin/create-personality-table")
 async def create_personality_table():
     """Create the personality_analyses table if it doesn't exist"""
@@ -897,7 +3717,7 @@ async def create_personality_table():
         """
         
         # Execute the SQL using Supabase's RPC function
-        result = supabase.rpc('execute_sql', {'sql': create_table_sql}).execute()
+        result = await run_query(supabase.rpc('execute_sql', {'sql': create_table_sql}))
         
         return {"message": "Successfully created personality_analyses table", "result": result.data}
     except Exception as e:
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Load test for atomic quota reservation.
+
+Fires concurrent /record-thought requests at a running backend and checks that
+every successful request was counted exactly once and that the monthly limit
+is never overshot. Requires add_quota_reservation_functions.sql to be applied.
+
+Usage:
+    python scripts/load_test_quota.py [--backend http://localhost:8000] [--email loadtest@example.com] [--requests 100]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+import httpx
+
+
+async def fire(client: httpx.AsyncClient, email: str, count: int):
+    """Send `count` concurrent /record-thought requests, return (ok_responses, status_codes)"""
+    async def one(i: int):
+        return await client.post("/record-thought", json={
+            "userEmail": email,
+            "journalEntry": f"Quota load test thought #{i}",
+        })
+
+    responses = await asyncio.gather(*[one(i) for i in range(count)])
+    ok = [r for r in responses if r.status_code == 200]
+    return ok, [r.status_code for r in responses]
+
+
+async def get_usage(client: httpx.AsyncClient, email: str) -> dict:
+    r = await client.get(f"/user-tier/{email}")
+    r.raise_for_status()
+    return r.json()
+
+
+async def set_usage(client: httpx.AsyncClient, email: str, count: int):
+    r = await client.post(f"/test/set-messages/{email}/{count}")
+    r.raise_for_status()
+
+
+async def cleanup(client: httpx.AsyncClient, email: str, responses):
+    """Delete the journal entries created by the test"""
+    ids = [r.json()["entry"]["id"] for r in responses]
+    await asyncio.gather(*[client.delete(f"/user-history/{email}/{entry_id}") for entry_id in ids])
+
+
+async def run(backend: str, email: str, n: int) -> bool:
+    limits = httpx.Limits(max_connections=n, max_keepalive_connections=n)
+    async with httpx.AsyncClient(base_url=backend, timeout=60, limits=limits) as client:
+        tier = await get_usage(client, email)
+        original_used = tier["messages_used_this_month"]
+        limit = tier["messages_limit"]
+        if limit < n:
+            print(f"❌ {email} has a limit of {limit}; need at least {n}. Upgrade the tier first.")
+            return False
+
+        passed = True
+        created = []
+        try:
+            # 1. No lost increments: start from 0 and fire n requests under the limit
+            await set_usage(client, email, 0)
+            ok, codes = await fire(client, email, n)
+            created += ok
+            used = (await get_usage(client, email))["messages_used_this_month"]
+            print(f"📊 Phase 1: {len(ok)}/{n} succeeded, counter = {used}, statuses = {sorted(set(codes))}")
+            if len(ok) != n or used != n:
+                print(f"❌ Lost increments: expected {n}, counter shows {used}")
+                passed = False
+            else:
+                print("✅ No lost increments")
+
+            # 2. No overshoot: leave room for half the requests
+            headroom = n // 2
+            await set_usage(client, email, limit - headroom)
+            ok, codes = await fire(client, email, n)
+            created += ok
+            used = (await get_usage(client, email))["messages_used_this_month"]
+            rejected = codes.count(429)
+            print(f"📊 Phase 2: {len(ok)} succeeded, {rejected} rejected with 429, counter = {used}/{limit}")
+            if len(ok) != headroom or used != limit:
+                print(f"❌ Limit not enforced atomically: expected {headroom} successes and {limit} used")
+                passed = False
+            else:
+                print("✅ Limit enforced exactly")
+        finally:
+            await cleanup(client, email, created)
+            await set_usage(client, email, original_used)
+            print(f"🧹 Deleted {len(created)} test entries and restored usage to {original_used}")
+
+        return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quota reservation load test")
+    parser.add_argument("--backend", default=os.getenv("BACKEND_URL", "http://localhost:8000"))
+    parser.add_argument("--email", default="loadtest@example.com")
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"🚀 Running quota load test against {args.backend} with {args.requests} concurrent requests")
+    ok = asyncio.run(run(args.backend, args.email, args.requests))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
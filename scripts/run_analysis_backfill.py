@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Backfill analyses for journal entries recorded without one (/record-thought).
+
+Runs the same backfill as POST /admin/backfill-analyses from the command line.
+Progress is checkpointed after every chunk, so an interrupted run can simply be
+started again. Requires create_backfill_schema.sql to be applied.
+
+Usage:
+    python scripts/run_analysis_backfill.py [--max-entries 500] [--rate-per-minute 60] [--chunk-size 50] [--restart]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi_backend import (  # noqa: E402
+    BACKFILL_CHUNK_SIZE,
+    BACKFILL_RATE_PER_MINUTE,
+    run_analysis_backfill,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill missing journal analyses")
+    parser.add_argument("--max-entries", type=int, default=None, help="Stop after this many entries")
+    parser.add_argument("--rate-per-minute", type=float, default=BACKFILL_RATE_PER_MINUTE, help="Model calls per minute")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="Entries fetched and written per round trip")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and rescan from the oldest entry")
+    args = parser.parse_args()
+
+    print(f"🚀 Backfilling analyses at up to {args.rate_per_minute:g} calls/minute")
+    try:
+        stats = asyncio.run(run_analysis_backfill(
+            max_entries=args.max_entries,
+            rate_per_minute=args.rate_per_minute,
+            chunk_size=args.chunk_size,
+            restart=args.restart,
+        ))
+    except KeyboardInterrupt:
+        print("\n👋 Stopped; run again to resume from the last checkpoint")
+        sys.exit(1)
+
+    print(f"✅ Analyzed {stats['analyzed']} entries ({stats['written']} written), {stats['failed']} failed")
+    sys.exit(0 if stats["failed"] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
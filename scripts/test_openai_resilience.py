@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Checks the OpenAI wrapper (ResilientOpenAI in fastapi_backend.py) against a
+local fake OpenAI server, so no API key or network access is needed.
+
+Covers retry with backoff on 429/5xx, no retry on 4xx, per-call timeouts,
+the circuit breaker failing fast with 503 + Retry-After and recovering, and
+rejection when the rate limit queue is full, including while half-open.
+
+Usage:
+    python scripts/test_openai_resilience.py
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+# fastapi_backend needs these at import time; nothing here talks to the real services
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "eyJhbGciOiJIUzI1NiJ9.e30.placeholder")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import openai  # noqa: E402
+import uvicorn  # noqa: E402
+from fastapi import FastAPI, HTTPException  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+from fastapi_backend import CircuitBreaker, ResilientOpenAI  # noqa: E402
+
+# Each request pops the next (status, delay seconds) off `script`; 200 once it's empty
+fake_openai = FastAPI()
+script = []
+hits = []
+
+
+@fake_openai.post("/v1/chat/completions")
+async def chat_completions():
+    status, delay = script.pop(0) if script else (200, 0)
+    hits.append(status)
+    await asyncio.sleep(delay)
+    if status != 200:
+        return JSONResponse({"error": {"message": f"fake {status}", "type": "fake"}}, status_code=status,
+                            headers={"retry-after-ms": "50"} if status == 429 else None)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "{}"}}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+    }
+
+
+def start_fake_server() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_openai, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def make_client(base_url: str, **kwargs) -> ResilientOpenAI:
+    options = dict(requests_per_minute=0, tokens_per_minute=0, max_retries=3, timeout_seconds=5,
+                   backoff_base=0.05, backoff_max=0.5, breaker=CircuitBreaker(100, 1))
+    options.update(kwargs)
+    return ResilientOpenAI(AsyncOpenAI(base_url=base_url, api_key="test", max_retries=0), **options)
+
+
+async def call(client: ResilientOpenAI, max_tokens: int = 10):
+    return await client.create(model="gpt-4o", messages=[{"role": "user", "content": "hi"}], max_tokens=max_tokens)
+
+
+def reset(*steps):
+    script[:] = list(steps)
+    hits.clear()
+
+
+async def test_retries_transient_errors(base_url: str):
+    client = make_client(base_url)
+    reset((429, 0), (500, 0), (503, 0))
+    response = await call(client)
+    assert response.choices[0].message.content == "{}"
+    assert hits == [429, 500, 503, 200], hits
+    assert client.counters["retries"] == 3
+
+
+async def test_gives_up_with_503(base_url: str):
+    client = make_client(base_url, max_retries=2)
+    reset((500, 0), (500, 0), (500, 0), (500, 0))
+    try:
+        await call(client)
+        raise AssertionError("expected a 503")
+    except HTTPException as e:
+        assert e.status_code == 503 and "Retry-After" in e.headers, e
+    assert len(hits) == 3, hits
+
+
+async def test_does_not_retry_client_errors(base_url: str):
+    client = make_client(base_url)
+    reset((400, 0))
+    try:
+        await call(client)
+        raise AssertionError("expected BadRequestError")
+    except openai.BadRequestError:
+        pass
+    assert hits == [400], hits
+    assert client.breaker.state == "closed"
+
+
+async def test_times_out_slow_calls(base_url: str):
+    client = make_client(base_url, max_retries=1, timeout_seconds=0.3)
+    reset((200, 2), (200, 2))
+    started = time.monotonic()
+    try:
+        await call(client)
+        raise AssertionError("expected a 503")
+    except HTTPException as e:
+        assert e.status_code == 503
+    elapsed = time.monotonic() - started
+    assert elapsed < 1.5, f"took {elapsed:.2f}s"
+
+
+async def test_circuit_breaker(base_url: str):
+    client = make_client(base_url, max_retries=0, breaker=CircuitBreaker(3, 1))
+    reset(*[(500, 0)] * 3)
+    for _ in range(3):
+        try:
+            await call(client)
+        except HTTPException:
+            pass
+    assert client.breaker.state == "open"
+
+    # While open, calls fail fast without reaching the server
+    before = len(hits)
+    started = time.monotonic()
+    try:
+        await call(client)
+        raise AssertionError("expected a 503")
+    except HTTPException as e:
+        assert e.status_code == 503 and int(e.headers["Retry-After"]) >= 1
+    assert len(hits) == before and time.monotonic() - started < 0.05
+
+    # After reset_seconds one trial call goes through and closes the circuit
+    await asyncio.sleep(1.1)
+    assert client.breaker.state == "half_open"
+    await call(client)
+    assert client.breaker.state == "closed"
+
+
+async def test_rejects_when_rate_limit_queue_is_full(base_url: str):
+    # 600 tokens per minute allows a burst of two 300-token calls, then ~30s waits
+    client = make_client(base_url, tokens_per_minute=600, max_queue_seconds=0.3)
+    reset()
+    await call(client, max_tokens=299)
+    await call(client, max_tokens=299)
+    try:
+        await call(client, max_tokens=299)
+        raise AssertionError("expected a 503")
+    except HTTPException as e:
+        assert e.status_code == 503
+    assert len(hits) == 2, hits
+
+
+async def test_queue_timeout_releases_half_open_trial(base_url: str):
+    client = make_client(base_url, tokens_per_minute=600, max_queue_seconds=0.3, breaker=CircuitBreaker(1, 0.2))
+    reset()
+    await call(client, max_tokens=299)
+    await call(client, max_tokens=299)
+    client.breaker.record_failure()
+    await asyncio.sleep(0.25)
+    assert client.breaker.state == "half_open"
+
+    # The trial call times out in the rate limit queue; that must not leave the trial slot taken
+    try:
+        await call(client, max_tokens=299)
+        raise AssertionError("expected a 503")
+    except HTTPException as e:
+        assert e.status_code == 503
+    assert not client.breaker.trial_in_flight
+
+    # Same for a trial call cancelled while it waits in the queue
+    waiting = asyncio.create_task(call(client, max_tokens=299))
+    await asyncio.sleep(0.05)
+    waiting.cancel()
+    try:
+        await waiting
+    except asyncio.CancelledError:
+        pass
+    assert not client.breaker.trial_in_flight
+
+    # Once capacity is back the next trial goes through and closes the circuit
+    client.token_bucket = None
+    await call(client)
+    assert client.breaker.state == "closed"
+    assert len(hits) == 3, hits
+
+
+async def run(base_url: str) -> bool:
+    tests = [
+        test_retries_transient_errors,
+        test_gives_up_with_503,
+        test_does_not_retry_client_errors,
+        test_times_out_slow_calls,
+        test_circuit_breaker,
+        test_rejects_when_rate_limit_queue_is_full,
+        test_queue_timeout_releases_half_open_trial,
+    ]
+    passed = True
+    for test in tests:
+        try:
+            await test(base_url)
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            print(f"❌ {test.__name__}: {e}")
+            passed = False
+    return passed
+
+
+if __name__ == "__main__":
+    base_url = start_fake_server()
+    print(f"🚀 Fake OpenAI server running at {base_url}")
+    sys.exit(0 if asyncio.run(run(base_url)) else 1)